@@ -0,0 +1,213 @@
+import re
+import logging
+import pandas as pd
+from armazenamento import armazenamento
+from hierarquia_territorial import NIVEL_REGIAO, NIVEL_UF, NIVEL_RM, NIVEL_MUNICIPIO
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+TABELA_AGREGADOS = "pnad_agregados"
+COLUNAS_CONTROLE = {"id", "d2n", "d3n", "tabela_id", "data_extracao", "nivel_geografico", "data_criacao"}
+NIVEIS_AGREGACAO = {NIVEL_REGIAO: "REGIAO", NIVEL_UF: "UF", NIVEL_RM: "RM"}
+# Unidades de medida (MN do SIDRA) cujos valores podem ser somados entre
+# localidades: contagens e totais monetários. Taxas, médias, índices e
+# rendimentos médios ("Reais") só têm média e contagem.
+UNIDADES_ADITIVAS = re.compile(
+    r"^((mil|milhares de|milh[oõ]es de) )?(pessoas|domic[ií]lios|fam[ií]lias|unidades)$"
+    r"|^(mil|milhares de|milh[oõ]es de) reais$",
+    re.IGNORECASE,
+)
+
+# Formatos de nome usados pelo SIDRA para a unidade territorial (D3N)
+PADRAO_MUNICIPIO = re.compile(r'^(.*\S)\s+-\s+([A-Z]{2})$')       # "Campinas - SP"
+PADRAO_COM_UF = re.compile(r'^(.*\S)\s+\(([A-Z]{2})\)$')           # "Belém (PA)"
+
+
+# ------------------------------
+# Resolução de localidades
+# ------------------------------
+def _sigla_uf(hierarquia, nivel, codigo):
+    uf = hierarquia.ancestral(nivel, codigo, NIVEL_UF)
+    return hierarquia.sigla(NIVEL_UF, uf) if uf is not None else None
+
+
+def _unico(candidatos):
+    return candidatos[0] if len(candidatos) == 1 else None
+
+
+def resolver_localidade(hierarquia, nome):
+    """
+    Converte o nome de localidade do SIDRA em (nivel, codigo) do índice
+    territorial, ou None se não houver correspondência única.
+    """
+    m = PADRAO_MUNICIPIO.match(nome)
+    if m:
+        base, uf = m.groups()
+        return _unico([
+            no for no in hierarquia.buscar_por_nome(base, NIVEL_MUNICIPIO)
+            if _sigla_uf(hierarquia, *no) == uf
+        ])
+
+    m = PADRAO_COM_UF.match(nome)
+    if m:
+        base, uf = m.groups()
+        candidatos = hierarquia.buscar_por_nome(f"RM {base}", NIVEL_RM) + hierarquia.buscar_por_nome(base, NIVEL_RM)
+        candidatos = [no for no in candidatos if _sigla_uf(hierarquia, *no) == uf]
+        if not candidatos:
+            candidatos = [
+                no for no in hierarquia.buscar_por_nome(base, NIVEL_MUNICIPIO)
+                if _sigla_uf(hierarquia, *no) == uf
+            ]
+        return _unico(candidatos)
+
+    for nivel in (NIVEL_UF, NIVEL_REGIAO, NIVEL_RM, NIVEL_MUNICIPIO):
+        candidatos = hierarquia.buscar_por_nome(nome, nivel)
+        if candidatos:
+            return _unico(candidatos)
+    return None
+
+
+def chaves_agregacao(hierarquia, nivel, codigo):
+    """
+    Retorna [(nivel_agregacao, codigo, nome)] para os quais a localidade
+    contribui, incluindo ela mesma quando o nível dela é de agregação
+    (uma tabela por UF gera linhas de UF e de região).
+    """
+    chaves = []
+    for nivel_destino in (NIVEL_REGIAO, NIVEL_UF):
+        if nivel >= nivel_destino:
+            destino = hierarquia.ancestral(nivel, codigo, nivel_destino)
+            if destino is not None:
+                chaves.append((NIVEIS_AGREGACAO[nivel_destino], str(destino), hierarquia.nome(nivel_destino, destino)))
+    if nivel == NIVEL_RM:
+        chaves.append((NIVEIS_AGREGACAO[NIVEL_RM], str(int(codigo)), hierarquia.nome(NIVEL_RM, codigo)))
+    elif nivel == NIVEL_MUNICIPIO:
+        for rm in hierarquia.rms_do_municipio(codigo):
+            chaves.append((NIVEIS_AGREGACAO[NIVEL_RM], str(int(rm)), hierarquia.nome(NIVEL_RM, rm)))
+    return chaves
+
+
+# ------------------------------
+# Cálculo e gravação
+# ------------------------------
+def variavel_aditiva(unidade):
+    return bool(unidade) and UNIDADES_ADITIVAS.match(str(unidade).strip()) is not None
+
+
+def calcular_agregados(df_pivoted, hierarquia, unidades=None):
+    """
+    Agrega as colunas de variáveis de uma tabela pivotada por região, UF e
+    RM (soma, média e contagem) para cada período.
+
+    Valores ausentes (NaN, a tabela pivotada não preenche lacunas) ficam
+    fora da média e da contagem. A soma só é calculada para variáveis cuja
+    unidade em `unidades` ({coluna: MN}) é aditiva; nas demais fica nula.
+
+    Retorna:
+        DataFrame com periodo, nivel_agregacao, codigo, nome, variavel,
+        soma, media, contagem (vazio se nada puder ser resolvido)
+    """
+    variaveis = [c for c in df_pivoted.columns if c not in COLUNAS_CONTROLE]
+    mapa = []
+    nao_resolvidas = 0
+    for nome in df_pivoted["d3n"].dropna().unique():
+        no = resolver_localidade(hierarquia, str(nome))
+        if no is None:
+            nao_resolvidas += 1
+            continue
+        for chave in chaves_agregacao(hierarquia, *no):
+            mapa.append((nome, *chave))
+    if nao_resolvidas:
+        logger.warning(f"{nao_resolvidas} localidades sem correspondência na hierarquia territorial")
+
+    colunas = ["periodo", "nivel_agregacao", "codigo", "nome", "variavel", "soma", "media", "contagem"]
+    if not mapa or not variaveis:
+        return pd.DataFrame(columns=colunas)
+
+    mapa_df = pd.DataFrame(mapa, columns=["d3n", "nivel_agregacao", "codigo", "nome"])
+    longo = df_pivoted[["d2n", "d3n"] + variaveis].melt(
+        id_vars=["d2n", "d3n"], var_name="variavel", value_name="valor"
+    )
+    agregados = (
+        longo.merge(mapa_df, on="d3n")
+        .groupby(["d2n", "nivel_agregacao", "codigo", "nome", "variavel"])["valor"]
+        .agg(soma="sum", media="mean", contagem="count")
+        .reset_index()
+        .rename(columns={"d2n": "periodo"})
+    )
+    aditivas = {v for v in variaveis if variavel_aditiva((unidades or {}).get(v))}
+    agregados["soma"] = agregados["soma"].where(agregados["variavel"].isin(aditivas))
+    # Grupos sem nenhum valor: nada a agregar
+    agregados = agregados[agregados["contagem"] > 0]
+    return agregados[colunas]
+
+
+def criar_tabela_agregados(cursor, backend=None):
+    backend = backend or armazenamento()
+    backend.criar_tabela(cursor, TABELA_AGREGADOS, [
+        ("tabela_id", "texto(50)"),
+        ("periodo", "texto(100)"),
+        ("nivel_agregacao", "texto(20)"),
+        ("codigo", "texto(50)"),
+        ("nome", "texto(255)"),
+        ("variavel", "texto(128)"),
+        ("soma", "real"),
+        ("media", "real"),
+        ("contagem", "inteiro"),
+    ], coluna_criacao="data_atualizacao")
+    backend.criar_indice(
+        cursor, f"IX_{TABELA_AGREGADOS}_consulta", TABELA_AGREGADOS,
+        ["tabela_id", "periodo", "nivel_agregacao", "codigo"], incluir=["variavel", "soma", "media", "contagem"]
+    )
+
+
+def atualizar_agregados(table_id, df_pivoted, hierarquia, unidades=None):
+    """
+    Recalcula pnad_agregados apenas para os períodos presentes em
+    df_pivoted (os que acabaram de ser carregados). Os demais períodos da
+    tabela não são tocados. `unidades` ({coluna: MN}) decide quais
+    variáveis têm soma.
+    """
+    if hierarquia is None:
+        logger.warning("Hierarquia territorial indisponível: agregados não atualizados")
+        return False
+    if df_pivoted is None or df_pivoted.empty:
+        return False
+
+    agregados = calcular_agregados(df_pivoted, hierarquia, unidades)
+    periodos = [str(p) for p in df_pivoted["d2n"].dropna().unique()]
+
+    backend = armazenamento()
+    conn = backend.conectar()
+    if not conn:
+        logger.error("Não foi possível conectar ao banco de dados")
+        return False
+
+    try:
+        cursor = conn.cursor()
+        criar_tabela_agregados(cursor, backend)
+        for i in range(0, len(periodos), 500):
+            lote = periodos[i:i + 500]
+            cursor.execute(
+                f"DELETE FROM {TABELA_AGREGADOS} WHERE tabela_id = ? AND periodo IN ({', '.join('?' for _ in lote)})",
+                (str(table_id), *lote)
+            )
+
+        if not agregados.empty:
+            carga = agregados.assign(tabela_id=str(table_id), periodo=agregados["periodo"].astype(str))
+            backend.inserir_dataframe(conn, TABELA_AGREGADOS, carga[[
+                "tabela_id", "periodo", "nivel_agregacao", "codigo", "nome", "variavel", "soma", "media", "contagem"
+            ]])
+
+        conn.commit()
+        logger.info(f"{len(agregados)} agregados atualizados para a tabela {table_id} ({len(periodos)} períodos)")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao atualizar agregados da tabela {table_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
@@ -1,10 +1,20 @@
-import requests
-import geopandas as gpd
 import pandas as pd
 import logging
-import time
 from io import BytesIO
-from database import DatabaseConnection
+from armazenamento import armazenamento
+from niveis_sidra import ordenar_niveis, cache_niveis
+from perfilamento import com_perfil
+from lago_parquet import registrar_extracao
+from memo_execucao import memoizar, execucao_memoizada
+from assinatura_conteudo import (
+    hash_payload, hash_resposta, conteudo_inalterado, SUCESSO, SEM_ALTERACAO, STATUS_CONCLUIDOS, CANCELADO,
+)
+from memoria_compacta import memoria_compacta, compactar_geo, pegada_bytes
+from metricas import MedicaoExecucao, medir_etapa, garantir_colunas_log, iniciar_rastreamento_memoria, COLUNAS_LOG
+from politica_retry import (
+    PoliticaRetry, Prazo, get, get_com_retry, erro_nivel_territorial, SIDRA_PRAZO_TABELA, URL_SIDRA, URL_SERVICOS_IBGE,
+    ErroRequisicao, ErroPermanente, ErroRetentavel, CircuitoAberto, PrazoEsgotado,
+)
 import json
 
 # Configuração de logging
@@ -14,7 +24,7 @@ logger = logging.getLogger(__name__)
 # ------------------------------
 # Função para baixar malhas geográficas (GeoJSON)
 # ------------------------------
-def get_geo(geo_level="N3", code=None, retry_count=3):
+def get_geo(geo_level="N3", code=None, retry_count=3, medicao=None):
     """
     Baixa malha geográfica do IBGE em GeoJSON.
     
@@ -26,50 +36,52 @@ def get_geo(geo_level="N3", code=None, retry_count=3):
     Retorna:
         GeoDataFrame ou None se falhar
     """
-    for attempt in range(retry_count):
-        try:
-            url = f"https://servicodados.ibge.gov.br/api/v2/malhas/{code if code else ''}?formato=application/vnd.geo+json"
-            logger.info(f"Baixando malha geográfica: {url}")
-            
-            response = requests.get(url, timeout=60)
-            
-            if response.status_code == 200:
-                gdf = gpd.read_file(url)
-                
-                if gdf.empty:
-                    logger.warning(f"Malha geográfica vazia para código {code}")
-                    return None
-                
-                # Adiciona metadados
-                gdf['geo_level'] = geo_level
-                gdf['ibge_code'] = code if code else 'BR'
-                gdf['data_extracao'] = pd.Timestamp.now()
-                
-                logger.info(f"Malha geográfica baixada com sucesso: {len(gdf)} feições")
-                return gdf
-                
-            else:
-                logger.error(f"Erro na requisição: {response.status_code} - {response.text}")
-                if attempt < retry_count - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Erro ao baixar malha geográfica na tentativa {attempt + 1}: {e}")
-            if attempt < retry_count - 1:
-                time.sleep(2 ** attempt)
-                continue
-            else:
-                return None
+    # Uma busca por malha em cada execução, compartilhada entre chamadas simultâneas
+    return memoizar(("malhas", geo_level, code), lambda: _buscar_malha(geo_level, code, retry_count, medicao))
+
+def _buscar_malha(geo_level, code, retry_count, medicao):
+    # geopandas (shapely, pyproj, fiona) só quando alguém baixa malha
+    import geopandas as gpd
+
+    url = f"{URL_SERVICOS_IBGE}/api/v2/malhas/{code if code else ''}?formato=application/vnd.geo+json"
+    logger.info(f"Baixando malha geográfica: {url}")
+    try:
+        response = get_com_retry(url, timeout=60, politica=PoliticaRetry(tentativas=retry_count), medicao=medicao)
+    except ErroRequisicao as e:
+        logger.error(f"Falha ao baixar malha geográfica {code or 'BR'}: {e}")
+        return None
     
-    return None
+    try:
+        # Lê a malha do conteúdo já baixado (sem uma segunda requisição)
+        with medir_etapa(medicao, "decode") as etapa:
+            gdf = gpd.read_file(BytesIO(response.content))
+            hash_conteudo = hash_resposta(response.content, malha=code or "BR", nivel=geo_level)
+            etapa.linhas = len(gdf)
+            etapa.memoria = pegada_bytes(gdf)
+    except Exception as e:
+        logger.error(f"Malha geográfica inválida para código {code}: {e}")
+        return None
+    
+    if gdf.empty:
+        logger.warning(f"Malha geográfica vazia para código {code}")
+        return None
+    
+    # Adiciona metadados
+    gdf['geo_level'] = geo_level
+    gdf['ibge_code'] = code if code else 'BR'
+    gdf['data_extracao'] = pd.Timestamp.now()
+    registrar_extracao("malhas", gdf, nivel=geo_level, codigo=code)
+    if memoria_compacta():
+        gdf = compactar_geo(gdf)
+    gdf.attrs["hash_conteudo"] = hash_conteudo
+    
+    logger.info(f"Malha geográfica baixada com sucesso: {len(gdf)} feições")
+    return gdf
 
 # ------------------------------
 # Função para obter informações das localidades
 # ------------------------------
-def get_location_info(geo_level="N3", retry_count=3):
+def get_location_info(geo_level="N3", retry_count=3, medicao=None):
     """
     Obtém informações das localidades disponíveis para um nível geográfico.
     
@@ -80,64 +92,59 @@ def get_location_info(geo_level="N3", retry_count=3):
     Retorna:
         DataFrame com informações das localidades
     """
-    for attempt in range(retry_count):
-        try:
-            if geo_level == "N1":
-                url = "https://servicodados.ibge.gov.br/api/v1/localidades/paises/76"
-            elif geo_level == "N2":
-                url = "https://servicodados.ibge.gov.br/api/v1/localidades/estados"
-            elif geo_level == "N3":
-                url = "https://servicodados.ibge.gov.br/api/v1/localidades/regioes-metropolitanas"
-            elif geo_level == "N6":
-                url = "https://servicodados.ibge.gov.br/api/v1/localidades/municipios"
-            else:
-                logger.error(f"Nível geográfico não suportado: {geo_level}")
-                return None
-            
-            logger.info(f"Obtendo informações de localidades: {url}")
-            
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                df = pd.DataFrame(data)
-                
-                if df.empty:
-                    logger.warning(f"Nenhuma localidade encontrada para nível {geo_level}")
-                    return None
-                
-                # Adiciona metadados
-                df['geo_level'] = geo_level
-                df['data_extracao'] = pd.Timestamp.now()
-                
-                logger.info(f"Informações obtidas: {len(df)} localidades")
-                return df
-                
-            else:
-                logger.error(f"Erro na requisição: {response.status_code}")
-                if attempt < retry_count - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Erro ao obter informações na tentativa {attempt + 1}: {e}")
-            if attempt < retry_count - 1:
-                time.sleep(2 ** attempt)
-                continue
-            else:
-                return None
+    # Localidades e malhas de níveis abaixo de N1 pedem a mesma lista: uma busca por execução
+    return memoizar(("localidades", geo_level), lambda: _buscar_localidades(geo_level, retry_count, medicao))
+
+def _buscar_localidades(geo_level, retry_count, medicao):
+    urls = {
+        "N1": f"{URL_SERVICOS_IBGE}/api/v1/localidades/paises/76",
+        "N2": f"{URL_SERVICOS_IBGE}/api/v1/localidades/estados",
+        "N3": f"{URL_SERVICOS_IBGE}/api/v1/localidades/regioes-metropolitanas",
+        "N6": f"{URL_SERVICOS_IBGE}/api/v1/localidades/municipios",
+    }
+    url = urls.get(geo_level)
+    if url is None:
+        logger.error(f"Nível geográfico não suportado: {geo_level}")
+        return None
     
-    return None
+    logger.info(f"Obtendo informações de localidades: {url}")
+    try:
+        response = get_com_retry(url, timeout=30, politica=PoliticaRetry(tentativas=retry_count), medicao=medicao)
+        with medir_etapa(medicao, "decode") as etapa:
+            data = response.json()
+            hash_conteudo = hash_payload(data, localidades=url, nivel=geo_level)
+            df = pd.DataFrame(data)
+            etapa.linhas = len(df)
+            etapa.memoria = pegada_bytes(df)
+    except ErroRequisicao as e:
+        logger.error(f"Falha ao obter localidades do nível {geo_level}: {e}")
+        return None
+    except ValueError as e:
+        logger.error(f"Resposta inválida para localidades do nível {geo_level}: {e}")
+        return None
+    
+    if df.empty:
+        logger.warning(f"Nenhuma localidade encontrada para nível {geo_level}")
+        return None
+    
+    # Adiciona metadados
+    df['geo_level'] = geo_level
+    df['data_extracao'] = pd.Timestamp.now()
+    registrar_extracao("localidades", df, nivel=geo_level)
+    if memoria_compacta():
+        df = compactar_geo(df)
+    df.attrs["hash_conteudo"] = hash_conteudo
+    
+    logger.info(f"Informações obtidas: {len(df)} localidades")
+    return df
 
 # ------------------------------
 # Funções para banco de dados
 # ------------------------------
 def create_ibge_tables():
     """Cria as tabelas necessárias para os dados IBGE"""
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     
     if not conn:
         logger.error("Não foi possível conectar ao banco de dados")
@@ -147,53 +154,38 @@ def create_ibge_tables():
         cursor = conn.cursor()
         
         # Tabela para malhas geográficas
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ibge_malhas' AND xtype='U')
-        CREATE TABLE ibge_malhas (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            nome NVARCHAR(255),
-            codigo_ibge NVARCHAR(50),
-            nivel_geografico NVARCHAR(10),
-            geometria NVARCHAR(MAX),
-            propriedades NVARCHAR(MAX),
-            data_extracao DATETIME,
-            data_criacao DATETIME DEFAULT GETDATE()
-        )
-        """)
+        backend.criar_tabela(cursor, "ibge_malhas", [
+            ("nome", "texto(255)"),
+            ("codigo_ibge", "texto(50)"),
+            ("nivel_geografico", "texto(10)"),
+            ("geometria", "texto"),
+            ("propriedades", "texto"),
+            ("data_extracao", "data_hora"),
+        ])
         
         # Tabela para informações de localidades
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ibge_localidades' AND xtype='U')
-        CREATE TABLE ibge_localidades (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            nome NVARCHAR(255),
-            codigo_ibge NVARCHAR(50),
-            nivel_geografico NVARCHAR(10),
-            sigla NVARCHAR(10),
-            regiao NVARCHAR(255),
-            uf NVARCHAR(255),
-            municipio NVARCHAR(255),
-            propriedades NVARCHAR(MAX),
-            data_extracao DATETIME,
-            data_criacao DATETIME DEFAULT GETDATE()
-        )
-        """)
+        backend.criar_tabela(cursor, "ibge_localidades", [
+            ("nome", "texto(255)"),
+            ("codigo_ibge", "texto(50)"),
+            ("nivel_geografico", "texto(10)"),
+            ("sigla", "texto(10)"),
+            ("regiao", "texto(255)"),
+            ("uf", "texto(255)"),
+            ("municipio", "texto(255)"),
+            ("propriedades", "texto"),
+            ("data_extracao", "data_hora"),
+        ])
         
         # Tabela para log de extrações
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ibge_log_extracao' AND xtype='U')
-        CREATE TABLE ibge_log_extracao (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            tipo_extracao NVARCHAR(50),
-            nivel_geografico NVARCHAR(10),
-            codigo_ibge NVARCHAR(50),
-            registros_extraidos INT,
-            status NVARCHAR(50),
-            mensagem NVARCHAR(500),
-            data_extracao DATETIME,
-            data_criacao DATETIME DEFAULT GETDATE()
-        )
-        """)
+        backend.criar_tabela(cursor, "ibge_log_extracao", [
+            ("tipo_extracao", "texto(50)"),
+            ("nivel_geografico", "texto(10)"),
+            ("codigo_ibge", "texto(50)"),
+            ("registros_extraidos", "inteiro"),
+            ("status", "texto(50)"),
+            ("mensagem", "texto(500)"),
+            ("data_extracao", "data_hora"),
+        ])
         
         conn.commit()
         logger.info("Tabelas IBGE criadas com sucesso")
@@ -206,42 +198,43 @@ def create_ibge_tables():
     finally:
         conn.close()
 
-def insert_malha_to_sql(gdf, table_name="ibge_malhas"):
+def _nome_aninhado(valor):
+    return valor.get('nome', '') if isinstance(valor, dict) else ''
+
+def insert_malha_to_sql(gdf, table_name="ibge_malhas", medicao=None):
     """Insere dados de malha geográfica no banco SQL"""
     if gdf is None or gdf.empty:
         logger.warning("Nenhuma malha geográfica para inserir")
         return False
     
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     
     if not conn:
         logger.error("Não foi possível conectar ao banco de dados")
         return False
     
     try:
-        cursor = conn.cursor()
-        
-        for idx, row in gdf.iterrows():
-            nome = row.get('nome', '')
-            codigo_ibge = row.get('codigo_ibge', '')
-            nivel_geografico = row.get('geo_level', '')
-            
-            # Converte geometria para WKT (Well-Known Text)
-            geometria = row.geometry.wkt if hasattr(row, 'geometry') else ''
-            
-            # Converte propriedades para JSON
-            propriedades = json.dumps(row.to_dict(), ensure_ascii=False, default=str)
-            
-            data_extracao = row.get('data_extracao', pd.Timestamp.now())
-            
-            cursor.execute(f"""
-            INSERT INTO {table_name} 
-            (nome, codigo_ibge, nivel_geografico, geometria, propriedades, data_extracao)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (nome, codigo_ibge, nivel_geografico, geometria, propriedades, data_extracao))
-        
-        conn.commit()
+        with medir_etapa(medicao, "insert") as etapa:
+            etapa.linhas = len(gdf)
+            agora = pd.Timestamp.now()
+            registros = []
+            for idx, row in gdf.iterrows():
+                registros.append((
+                    row.get('nome', ''),
+                    row.get('codigo_ibge', ''),
+                    row.get('geo_level', ''),
+                    # Converte geometria para WKT (Well-Known Text)
+                    row.geometry.wkt if hasattr(row, 'geometry') else '',
+                    # Converte propriedades para JSON
+                    json.dumps(row.to_dict(), ensure_ascii=False, default=str),
+                    row.get('data_extracao', agora),
+                ))
+            df = pd.DataFrame(registros, columns=[
+                "nome", "codigo_ibge", "nivel_geografico", "geometria", "propriedades", "data_extracao"
+            ])
+            backend.inserir_dataframe(conn, table_name, df)
+            conn.commit()
         logger.info(f"{len(gdf)} registros de malha inseridos na tabela {table_name}")
         return True
         
@@ -252,43 +245,43 @@ def insert_malha_to_sql(gdf, table_name="ibge_malhas"):
     finally:
         conn.close()
 
-def insert_localidades_to_sql(df, table_name="ibge_localidades"):
+def insert_localidades_to_sql(df, table_name="ibge_localidades", medicao=None):
     """Insere informações de localidades no banco SQL"""
     if df is None or df.empty:
         logger.warning("Nenhuma localidade para inserir")
         return False
     
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     
     if not conn:
         logger.error("Não foi possível conectar ao banco de dados")
         return False
     
     try:
-        cursor = conn.cursor()
-        
-        for idx, row in df.iterrows():
-            nome = row.get('nome', '')
-            codigo_ibge = str(row.get('id', ''))
-            nivel_geografico = row.get('geo_level', '')
-            sigla = row.get('sigla', '')
-            regiao = row.get('regiao', {}).get('nome', '') if isinstance(row.get('regiao'), dict) else ''
-            uf = row.get('uf', {}).get('nome', '') if isinstance(row.get('uf'), dict) else ''
-            municipio = row.get('municipio', {}).get('nome', '') if isinstance(row.get('municipio'), dict) else ''
-            
-            # Converte propriedades para JSON
-            propriedades = json.dumps(row.to_dict(), ensure_ascii=False, default=str)
-            
-            data_extracao = row.get('data_extracao', pd.Timestamp.now())
-            
-            cursor.execute(f"""
-            INSERT INTO {table_name} 
-            (nome, codigo_ibge, nivel_geografico, sigla, regiao, uf, municipio, propriedades, data_extracao)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (nome, codigo_ibge, nivel_geografico, sigla, regiao, uf, municipio, propriedades, data_extracao))
-        
-        conn.commit()
+        with medir_etapa(medicao, "insert") as etapa:
+            etapa.linhas = len(df)
+            agora = pd.Timestamp.now()
+            registros = []
+            for idx, row in df.iterrows():
+                registros.append((
+                    row.get('nome', ''),
+                    str(row.get('id', '')),
+                    row.get('geo_level', ''),
+                    row.get('sigla', ''),
+                    _nome_aninhado(row.get('regiao')),
+                    _nome_aninhado(row.get('uf')),
+                    _nome_aninhado(row.get('municipio')),
+                    # Converte propriedades para JSON
+                    json.dumps(row.to_dict(), ensure_ascii=False, default=str),
+                    row.get('data_extracao', agora),
+                ))
+            linhas = pd.DataFrame(registros, columns=[
+                "nome", "codigo_ibge", "nivel_geografico", "sigla", "regiao", "uf", "municipio",
+                "propriedades", "data_extracao"
+            ])
+            backend.inserir_dataframe(conn, table_name, linhas)
+            conn.commit()
         logger.info(f"{len(df)} registros de localidades inseridos na tabela {table_name}")
         return True
         
@@ -299,21 +292,30 @@ def insert_localidades_to_sql(df, table_name="ibge_localidades"):
     finally:
         conn.close()
 
-def log_extraction(tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem=""):
-    """Registra log da extração"""
-    db = DatabaseConnection()
-    conn = db.get_connection()
+def log_extraction(tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem="", medicao=None):
+    """Registra log da extração (com as métricas por etapa, se houver medição)"""
+    conn = armazenamento().conectar()
     
     if not conn:
         return False
     
     try:
         cursor = conn.cursor()
-        cursor.execute("""
+        garantir_colunas_log(cursor, "ibge_log_extracao")
+
+        colunas = ["tipo_extracao", "nivel_geografico", "codigo_ibge", "registros_extraidos", "status", "mensagem", "data_extracao"]
+        valores = [tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem, pd.Timestamp.now()]
+        if medicao is not None:
+            metricas_log = medicao.valores_log()
+            colunas += [coluna for coluna, _ in COLUNAS_LOG]
+            valores += [metricas_log[coluna] for coluna, _ in COLUNAS_LOG]
+            medicao.finalizar(status)
+
+        cursor.execute(f"""
         INSERT INTO ibge_log_extracao 
-        (tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem, data_extracao)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem, pd.Timestamp.now()))
+        ({', '.join(colunas)})
+                    VALUES ({', '.join('?' for _ in colunas)})
+        """, valores)
         
         conn.commit()
         return True
@@ -327,8 +329,95 @@ def log_extraction(tipo_extracao, nivel_geografico, codigo_ibge, registros_extra
 # ------------------------------
 # Função principal de extração
 # ------------------------------
-def extract_all_ibge_data():
-    """Extrai todos os dados IBGE e salva no banco"""
+# Lista de operações para extrair
+OPERACOES_IBGE = [
+    {"type": "localidades", "geo_level": "N1", "description": "País Brasil"},
+    {"type": "localidades", "geo_level": "N2", "description": "Estados"},
+    {"type": "localidades", "geo_level": "N3", "description": "Regiões Metropolitanas"},
+    {"type": "localidades", "geo_level": "N6", "description": "Municípios"},
+    {"type": "malhas", "geo_level": "N1", "description": "Malha do Brasil"},
+    {"type": "malhas", "geo_level": "N2", "description": "Malhas dos Estados"},
+]
+
+def operacoes_ibge(tipos=None, niveis=None):
+    """OPERACOES_IBGE filtradas por tipo ("localidades"/"malhas") e nível"""
+    return [
+        op for op in OPERACOES_IBGE
+        if (not tipos or op['type'] in tipos) and (not niveis or op['geo_level'] in niveis)
+    ]
+
+def _inalterado(tipo, geo_level, codigo_log, dados, tabela_destino, medicao):
+    """Guarda o hash do payload na medição e compara com a última carga concluída da unidade"""
+    medicao.hash_conteudo = dados.attrs.get("hash_conteudo")
+    filtros = {"tipo_extracao": tipo.upper(), "nivel_geografico": geo_level, "codigo_ibge": codigo_log}
+    return conteudo_inalterado(medicao.hash_conteudo, "ibge_log_extracao", filtros, tabela_destino)
+
+def extract_ibge_unit(tipo, geo_level, code=None, medicao=None, forcar=False, pode_gravar=None):
+    """
+    Extrai e grava uma unidade de trabalho IBGE: as localidades de um nível
+    ou a malha de um nível (opcionalmente de uma única localidade).
+    Se o payload tem o mesmo hash da última carga concluída da unidade (e
+    forcar=False), a carga é pulada e o log registra SEM_ALTERACAO. Se
+    pode_gravar() retornar False antes da gravação, a unidade é abandonada
+    com status CANCELADO, sem gravar nem registrar no log.
+
+    Retorna:
+        str: status gravado em ibge_log_extracao
+    """
+    codigo_log = code or "ALL"
+    if medicao is None:
+        medicao = MedicaoExecucao("ibge", f"{tipo}_{geo_level}" + (f"_{code}" if code else ""))
+
+    if tipo == "localidades":
+        df = get_location_info(geo_level=geo_level, medicao=medicao)
+        if df is None or df.empty:
+            status, registros, mensagem = "DADOS_VAZIOS", 0, "API retornou dados vazios"
+        elif not forcar and _inalterado(tipo, geo_level, codigo_log, df, "ibge_localidades", medicao):
+            status, registros, mensagem = SEM_ALTERACAO, len(df), "Payload idêntico ao da última carga"
+        elif pode_gravar is not None and not pode_gravar():
+            return CANCELADO
+        elif insert_localidades_to_sql(df, medicao=medicao):
+            status, registros, mensagem = SUCESSO, len(df), f"Extraídas {len(df)} localidades"
+        else:
+            status, registros, mensagem = "ERRO_INSERCAO", 0, "Falha ao inserir localidades no banco"
+    elif tipo == "malhas":
+        gdf = get_geo(geo_level=geo_level, code=code, medicao=medicao)
+        if gdf is None or gdf.empty:
+            status, registros, mensagem = "DADOS_VAZIOS", 0, "API retornou malha vazia"
+        elif not forcar and _inalterado(tipo, geo_level, codigo_log, gdf, "ibge_malhas", medicao):
+            status, registros, mensagem = SEM_ALTERACAO, len(gdf), "Payload idêntico ao da última carga"
+        elif pode_gravar is not None and not pode_gravar():
+            return CANCELADO
+        elif insert_malha_to_sql(gdf, medicao=medicao):
+            status, registros, mensagem = SUCESSO, len(gdf), "Malha extraída com sucesso"
+        else:
+            status, registros, mensagem = "ERRO_INSERCAO", 0, "Falha ao inserir malha no banco"
+    else:
+        raise ValueError(f"Tipo de extração IBGE desconhecido: {tipo}")
+
+    log_extraction(tipo.upper(), geo_level, codigo_log, registros, status, mensagem, medicao=medicao)
+    return status
+
+def codigos_malhas(geo_level, limite=3):
+    """Códigos das localidades cujas malhas são extraídas em níveis abaixo de N1"""
+    df_loc = get_location_info(geo_level=geo_level)
+    if df_loc is None or df_loc.empty:
+        return []
+    # Pega apenas as primeiras localidades para não sobrecarregar
+    return df_loc.head(limite)['id'].astype(str).tolist()
+
+@com_perfil("ibge")
+@execucao_memoizada("ibge")
+def extract_all_ibge_data(tipos=None, niveis=None, progresso=None):
+    """
+    Extrai os dados IBGE e salva no banco.
+
+    Params:
+        tipos (list): restringe a "localidades" e/ou "malhas" (padrão: ambos)
+        niveis (list): restringe aos níveis geográficos (ex: ["N2", "N6"])
+        progresso (callable): chamado como progresso(concluidas, total, operacao, status)
+            ao final de cada operação
+    """
     logger.info("Iniciando extração de dados IBGE...")
     
     # Cria as tabelas se não existirem
@@ -339,129 +428,22 @@ def extract_all_ibge_data():
     success_count = 0
     total_operations = 0
     
-    # Lista de operações para extrair
-    operations = [
-        {"type": "localidades", "geo_level": "N1", "description": "País Brasil"},
-        {"type": "localidades", "geo_level": "N2", "description": "Estados"},
-        {"type": "localidades", "geo_level": "N3", "description": "Regiões Metropolitanas"},
-        {"type": "localidades", "geo_level": "N6", "description": "Municípios"},
-        {"type": "malhas", "geo_level": "N1", "description": "Malha do Brasil"},
-        {"type": "malhas", "geo_level": "N2", "description": "Malhas dos Estados"},
-    ]
+    operations = operacoes_ibge(tipos, niveis)
     
     for operation in operations:
         total_operations += 1
+        sucessos_antes = success_count
+        medicao = MedicaoExecucao("ibge", f"{operation['type']}_{operation['geo_level']}")
         try:
             logger.info(f"Processando: {operation['description']}")
             
-            if operation['type'] == "localidades":
-                # Extrai informações de localidades
-                df = get_location_info(geo_level=operation['geo_level'])
-                
-                if df is not None and not df.empty:
-                    if insert_localidades_to_sql(df):
-                        log_extraction(
-                            "LOCALIDADES",
-                            operation['geo_level'],
-                            "ALL",
-                            len(df),
-                            "SUCESSO",
-                            f"Extraídas {len(df)} localidades"
-                        )
-                        success_count += 1
-                    else:
-                        log_extraction(
-                            "LOCALIDADES",
-                            operation['geo_level'],
-                            "ALL",
-                            0,
-                            "ERRO_INSERCAO",
-                            "Falha ao inserir localidades no banco"
-                        )
-                else:
-                    log_extraction(
-                        "LOCALIDADES",
-                        operation['geo_level'],
-                        "ALL",
-                        0,
-                        "DADOS_VAZIOS",
-                        "API retornou dados vazios"
-                    )
-                    
-            elif operation['type'] == "malhas":
-                # Extrai malhas geográficas
-                if operation['geo_level'] == "N1":
-                    gdf = get_geo(geo_level=operation['geo_level'])
-                else:
-                    # Para outros níveis, pega algumas localidades como exemplo
-                    df_loc = get_location_info(geo_level=operation['geo_level'])
-                    if df_loc is not None and not df_loc.empty:
-                        # Pega apenas as primeiras 3 localidades para não sobrecarregar
-                        sample_codes = df_loc.head(3)['id'].astype(str).tolist()
-                        for code in sample_codes:
-                            gdf = get_geo(geo_level=operation['geo_level'], code=code)
-                            if gdf is not None and not gdf.empty:
-                                if insert_malha_to_sql(gdf):
-                                    log_extraction(
-                                        "MALHAS",
-                                        operation['geo_level'],
-                                        code,
-                                        len(gdf),
-                                        "SUCESSO",
-                                        f"Malha extraída com sucesso"
-                                    )
-                                    success_count += 1
-                                else:
-                                    log_extraction(
-                                        "MALHAS",
-                                        operation['geo_level'],
-                                        code,
-                                        0,
-                                        "ERRO_INSERCAO",
-                                        "Falha ao inserir malha no banco"
-                                    )
-                            else:
-                                log_extraction(
-                                    "MALHAS",
-                                    operation['geo_level'],
-                                    code,
-                                    0,
-                                    "DADOS_VAZIOS",
-                                    "API retornou malha vazia"
-                                )
-                        continue
-                    else:
-                        continue
-                
-                if gdf is not None and not gdf.empty:
-                    if insert_malha_to_sql(gdf):
-                        log_extraction(
-                            "MALHAS",
-                            operation['geo_level'],
-                            "ALL",
-                            len(gdf),
-                            "SUCESSO",
-                            f"Malha extraída com sucesso"
-                        )
+            if operation['type'] == "malhas" and operation['geo_level'] != "N1":
+                # Para outros níveis, pega algumas localidades como exemplo
+                for code in codigos_malhas(operation['geo_level']):
+                    if extract_ibge_unit("malhas", operation['geo_level'], code) in STATUS_CONCLUIDOS:
                         success_count += 1
-                    else:
-                        log_extraction(
-                            "MALHAS",
-                            operation['geo_level'],
-                            "ALL",
-                            0,
-                            "ERRO_INSERCAO",
-                            "Falha ao inserir malha no banco"
-                        )
-                else:
-                    log_extraction(
-                        "MALHAS",
-                        operation['geo_level'],
-                        "ALL",
-                        0,
-                        "DADOS_VAZIOS",
-                        "API retornou malha vazia"
-                    )
+            elif extract_ibge_unit(operation['type'], operation['geo_level'], medicao=medicao) in STATUS_CONCLUIDOS:
+                success_count += 1
                     
         except Exception as e:
             logger.error(f"Erro ao processar {operation['description']}: {e}")
@@ -471,8 +453,13 @@ def extract_all_ibge_data():
                 "ALL",
                 0,
                 "ERRO_EXTRACAO",
-                str(e)
+                str(e),
+                medicao=medicao
             )
+        finally:
+            if progresso is not None:
+                status = "SUCESSO" if success_count > sucessos_antes else "FALHA"
+                progresso(total_operations, len(operations), f"{operation['type']}_{operation['geo_level']}", status)
     
     logger.info(f"Extração concluída. {success_count}/{total_operations} operações processadas com sucesso")
     return success_count > 0
@@ -482,15 +469,15 @@ def extract_all_ibge_data():
 # ------------------------------
 def query_ibge_data(table_name, limit=100):
     """Consulta dados das tabelas IBGE"""
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     
     if not conn:
         return None
     
     try:
         cursor = conn.cursor()
-        cursor.execute(f"SELECT TOP {limit} * FROM {table_name} ORDER BY data_criacao DESC")
+        cursor.execute(backend.limitar(f"SELECT * FROM {table_name} ORDER BY data_criacao DESC", limit))
         
         columns = [column[0] for column in cursor.description]
         results = []
@@ -540,7 +527,7 @@ def get_sidra_table(table_id, variables="all", period="last 3", geo="n3", retry_
         pandas.DataFrame ou None se falhar
     """
     # URL base da API SIDRA (única que funciona)
-    base_url = "https://apisidra.ibge.gov.br"
+    base_url = URL_SIDRA
     
     # URL encoding correto para o período
     if period == "last 3":
@@ -549,71 +536,58 @@ def get_sidra_table(table_id, variables="all", period="last 3", geo="n3", retry_
         encoded_period = period
     
     # Tenta diferentes níveis geográficos se o principal falhar
-    geo_options = [geo, "n1", "n2"]  # Tenta n3, depois n1 (Brasil), depois n2 (UF)
+    # Tenta n3, depois n1 (Brasil), depois n2 (UF), começando pelos níveis que a tabela publica
+    geo_options = ordenar_niveis(table_id, [geo, "n1", "n2"], variables)
+    
+    politica = PoliticaRetry(tentativas=retry_count)
+    prazo = Prazo(SIDRA_PRAZO_TABELA)
     
     for geo_option in geo_options:
-        for attempt in range(retry_count):
-            try:
-                # Estrutura correta da URL SIDRA: /values/t/{tabela}/v/{variaveis}/p/{periodo}/n{territorio}/all
-                url = f"{base_url}/values/t/{table_id}/v/{variables}/p/{encoded_period}/{geo_option}/all"
-                logger.info(f"Tentativa {attempt + 1} com geo: {geo_option}")
-                logger.info(f"Fazendo requisição para: {url}")
-                
-                response = requests.get(url, timeout=45)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if not data:
-                        logger.warning(f"Tabela {table_id} retornou dados vazios")
-                        continue  # Tenta próxima opção geográfica
-                    
-                    df = pd.DataFrame(data)
-                    
-                    # Verifica se há dados
-                    if df.empty:
-                        logger.warning(f"Tabela {table_id} está vazia")
-                        continue  # Tenta próxima opção geográfica
-                    
-                    # Limpa os nomes das colunas (remove espaços em branco)
-                    df.columns = [c.strip() for c in df.columns]
-                    
-                    # NÃO renomeia as colunas - mantém os nomes originais da API
-                    # As colunas mantêm seus nomes originais como D1N, D2N, V, D3N, D4N, etc.
-                    
-                    # Adiciona metadados da tabela
-                    df['Tabela_ID'] = table_id
-                    df['Data_Extracao'] = pd.Timestamp.now()
-                    df['Nivel_Geografico'] = geo_option
-                    
-                    logger.info(f"✅ Tabela {table_id} extraída com sucesso (geo: {geo_option}): {len(df)} registros")
-                    logger.info(f"Colunas extraídas: {list(df.columns)}")
-                    return df
-                    
-                else:
-                    logger.error(f"Erro na requisição (geo: {geo_option}): {response.status_code} - {response.text}")
-                    if attempt < retry_count - 1:
-                        time.sleep(2 ** attempt)  # Backoff exponencial
-                        continue
-                    else:
-                        break  # Tenta próxima opção geográfica
-                        
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Erro de requisição na tentativa {attempt + 1} (geo: {geo_option}): {e}")
-                if attempt < retry_count - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    break  # Tenta próxima opção geográfica
-            except Exception as e:
-                logger.error(f"Erro inesperado na tentativa {attempt + 1} (geo: {geo_option}): {e}")
-                if attempt < retry_count - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    break  # Tenta próxima opção geográfica
+        # Estrutura correta da URL SIDRA: /values/t/{tabela}/v/{variaveis}/p/{periodo}/n{territorio}/all
+        url = f"{base_url}/values/t/{table_id}/v/{variables}/p/{encoded_period}/{geo_option}/all"
+        logger.info(f"Fazendo requisição para: {url}")
+        try:
+            response = politica.executar(lambda: get(url, timeout=45, prazo=prazo), prazo, f"tabela {table_id} ({geo_option})")
+            data = response.json()
+        except ErroPermanente as e:
+            logger.error(f"Erro na requisição (geo: {geo_option}): {e}")
+            if not erro_nivel_territorial(e):
+                break  # Tabela inválida: os outros níveis também vão falhar
+            continue
+        except (CircuitoAberto, PrazoEsgotado) as e:
+            logger.error(f"Extração da tabela {table_id} interrompida: {e}")
+            break
+        except (ErroRetentavel, ValueError) as e:
+            logger.error(f"Falha com geo {geo_option}: {e}")
+            logger.info(f"Tentando próxima opção geográfica após falhar com {geo_option}")
+            continue
+        
+        if not data:
+            logger.warning(f"Tabela {table_id} retornou dados vazios")
+            continue  # Tenta próxima opção geográfica
+        
+        df = pd.DataFrame(data)
+        
+        # Verifica se há dados
+        if df.empty:
+            logger.warning(f"Tabela {table_id} está vazia")
+            continue  # Tenta próxima opção geográfica
+        
+        # Limpa os nomes das colunas (remove espaços em branco)
+        df.columns = [c.strip() for c in df.columns]
+        
+        # NÃO renomeia as colunas - mantém os nomes originais da API
+        # As colunas mantêm seus nomes originais como D1N, D2N, V, D3N, D4N, etc.
+        
+        # Adiciona metadados da tabela
+        df['Tabela_ID'] = table_id
+        df['Data_Extracao'] = pd.Timestamp.now()
+        df['Nivel_Geografico'] = geo_option
         
-        # Se chegou aqui, tenta próxima opção geográfica
-        logger.info(f"Tentando próxima opção geográfica após falhar com {geo_option}")
+        cache_niveis().registrar_sucesso(table_id, geo_option)
+        logger.info(f"✅ Tabela {table_id} extraída com sucesso (geo: {geo_option}): {len(df)} registros")
+        logger.info(f"Colunas extraídas: {list(df.columns)}")
+        return df
     
     logger.error(f"❌ Todas as opções geográficas falharam para a tabela {table_id}")
     return None
@@ -622,6 +596,7 @@ def get_sidra_table(table_id, variables="all", period="last 3", geo="n3", retry_
 # Execução principal (só roda se chamado diretamente)
 # ------------------------------
 if __name__ == "__main__":
+    iniciar_rastreamento_memoria()
     print("🗺️ Iniciando extração de dados IBGE...")
     success = extract_all_ibge_data()
     
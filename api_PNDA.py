@@ -1,9 +1,23 @@
-import requests
 import pandas as pd
 import logging
 import json
-from database import DatabaseConnection
-import time
+from armazenamento import armazenamento
+from hierarquia_territorial import carregar_ou_construir
+from agregados_pnad import atualizar_agregados
+from indicadores_pnad import atualizar_indicadores
+from niveis_sidra import ordenar_niveis, cache_niveis
+from especificacao_sidra import especificacao_tabela
+from perfilamento import com_perfil
+from lago_parquet import registrar_extracao
+from assinatura_conteudo import hash_payload, conteudo_inalterado, SEM_ALTERACAO, CANCELADO
+from memoria_compacta import (
+    memoria_compacta, dataframe_sidra, compactar_sidra, restaurar_valores, expandir_constantes, pegada_bytes,
+)
+from metricas import MedicaoExecucao, medir_etapa, garantir_colunas_log, iniciar_rastreamento_memoria, COLUNAS_LOG
+from politica_retry import (
+    PoliticaRetry, Prazo, get, erro_nivel_territorial,
+    ErroPermanente, ErroRetentavel, CircuitoAberto, PrazoEsgotado, RETRY_TENTATIVAS, SIDRA_PRAZO_TABELA, URL_SIDRA,
+)
 import re
 import unicodedata
 from datetime import datetime
@@ -20,6 +34,20 @@ logger = logging.getLogger(__name__)
 MAX_COLUMN_LENGTH = 128  # Limite do SQL Server
 MAX_VARCHAR_LENGTH = 255  # Tamanho padrão para colunas textuais
 
+# Tabelas SIDRA extraídas por padrão
+TABLE_IDS_TO_FETCH = [
+    "4093",  # Força de trabalho
+    "4094",  # Pessoas ocupadas
+    "4095",  # Rendimento
+    "5440",  # Empresas e pessoal
+    "5918",  # Serviços para empresas
+    "5919",  # Manutenção e reparação
+    "1616",  # Domicílios por cômodos
+    "1617",  # Tipos de domicílios
+    "3416",  # Bens duráveis e internet
+    "3516"   # Condição de ocupação
+]
+
 # ------------------------------
 # Função para normalizar nomes de colunas
 # ------------------------------
@@ -50,6 +78,10 @@ def normalize_column_names(columns):
 # ------------------------------
 # Função para pivotar dados SIDRA
 # ------------------------------
+INDICE_PIVOT = ["D2N", "D3N", "Tabela_ID", "Data_Extracao", "Nivel_Geografico"]
+# Nomes das categorias das classificações (D4N em diante)
+PADRAO_CATEGORIA = re.compile(r"^D[4-9]N$")
+
 def pivot_sidra_data(df):
     if df is None or df.empty:
         logger.warning("DataFrame vazio para pivotar.")
@@ -61,21 +93,51 @@ def pivot_sidra_data(df):
         return None
 
     try:
+        # Frames compactos (memoria_compacta.py) trazem as constantes em attrs
+        constantes = df.attrs.get("constantes", {})
+        casas, tipo_valores = df.attrs.get("casas_decimais"), df.attrs.get("tipo_valores")
+
         df["V"] = pd.to_numeric(df["V"], errors='coerce')
         df_cleaned = df.dropna(subset=["V"]).copy()
         if df_cleaned.empty:
             logger.warning("Nenhum dado válido após limpeza.")
             return None
 
+        # Classificação pedida com várias categorias (especificacao_sidra.py):
+        # cada combinação variável × categoria vira uma coluna própria
+        categorias = [col for col in df_cleaned.columns if PADRAO_CATEGORIA.match(col) and df_cleaned[col].nunique() > 1]
+        if categorias:
+            rotulo = df_cleaned["D1N"].astype(str)
+            for col in categorias:
+                rotulo = rotulo + " - " + df_cleaned[col].astype(str)
+            df_cleaned["D1N"] = rotulo
+
         df_pivot = df_cleaned.pivot_table(
-            index=["D2N", "D3N", "Tabela_ID", "Data_Extracao", "Nivel_Geografico"],
+            index=[col for col in INDICE_PIVOT if col not in constantes],
             columns="D1N",
             values="V",
             aggfunc='first',
-            fill_value=0
-        ).reset_index()
+            observed=True
+        )
+        variaveis = [str(col) for col in df_pivot.columns]
+        df_pivot.columns = variaveis
+        df_pivot = df_pivot.reset_index()
+
+        if constantes:
+            # O resultado sai igual ao do caminho sem compactação
+            for col in ("D2N", "D3N"):
+                df_pivot[col] = df_pivot[col].astype(object)
+            expandir_constantes(df_pivot, constantes, INDICE_PIVOT)
+            restaurar_valores(df_pivot, variaveis, casas, tipo_valores)
 
-        df_pivot.columns = normalize_column_names(df_pivot.columns)
+        nomes = list(df_pivot.columns)
+        df_pivot.columns = normalize_column_names(nomes)
+        # Unidade de medida (MN) por coluna de variável, para os agregados
+        if "MN" in df_cleaned.columns:
+            unidades = df_cleaned.groupby("D1N", observed=True)["MN"].first().astype(str)
+            df_pivot.attrs["unidades"] = {
+                coluna: unidades[nome] for nome, coluna in zip(nomes, df_pivot.columns) if nome in unidades.index
+            }
         logger.info(f"Dados pivotados com sucesso: {len(df_pivot)} registros, {len(df_pivot.columns)} colunas")
         return df_pivot
 
@@ -86,40 +148,86 @@ def pivot_sidra_data(df):
 # ------------------------------
 # Função para extrair tabelas SIDRA
 # ------------------------------
-def get_sidra_table(table_id, variables="all", period="last 3", geo="n3", retry_count=3):
-    base_url = "https://apisidra.ibge.gov.br"
-    encoded_period = "last%203" if period == "last 3" else period
-    geo_options = [geo, "n1", "n2", "n6"]
+def get_sidra_table(table_id, variables=None, period=None, geo=None, retry_count=RETRY_TENTATIVAS,
+                    medicao=None, prazo_segundos=SIDRA_PRAZO_TABELA, especificacao=None):
+    """
+    Extrai dados da API SIDRA, tentando os níveis geográficos em ordem.
+
+    A URL sai da especificação da tabela (especificacao_sidra.py): só as
+    variáveis, classificações, períodos e níveis declarados. variables,
+    period e geo, quando informados, sobrepõem a especificação (geo vira o
+    primeiro nível tentado).
+
+    Falhas transitórias são repetidas (com jitter) dentro do mesmo nível;
+    uma resposta vazia ou um 400 ligado ao nível territorial passa para o
+    próximo nível; um 400 da tabela, o circuito aberto ou o fim do prazo
+    (prazo_segundos para a tabela inteira) encerram a extração.
+    """
+    espec = (especificacao or especificacao_tabela(table_id)).com(variaveis=variables, periodos=period)
+    niveis = [geo] + espec.niveis if geo else espec.niveis
+    # Níveis que a tabela publica (cache local / metadados / sondagem paralela)
+    geo_options = ordenar_niveis(table_id, niveis, espec.variaveis_url())
+    cache = cache_niveis()
+    politica = PoliticaRetry(tentativas=retry_count)
+    prazo = Prazo(prazo_segundos)
 
     for geo_option in geo_options:
-        for attempt in range(retry_count):
+        caminho = espec.caminho(geo_option)
+        url = URL_SIDRA + caminho
+        logger.info(f"Extraindo tabela {table_id} com geo: {geo_option}")
+        try:
+            response = politica.executar(
+                lambda: get(url, timeout=60, prazo=prazo, medicao=medicao), prazo, f"tabela {table_id} ({geo_option})"
+            )
+        except ErroPermanente as e:
+            if not erro_nivel_territorial(e):
+                logger.error(f"Tabela {table_id} rejeitada pelo SIDRA, sem novas tentativas: {e}")
+                return None
+            logger.warning(f"Nível {geo_option} indisponível para a tabela {table_id}: {e}")
+            cache.registrar_falha(table_id, geo_option)
+            continue
+        except (CircuitoAberto, PrazoEsgotado) as e:
+            logger.error(f"Extração da tabela {table_id} interrompida: {e}")
+            return None
+        except ErroRetentavel as e:
+            logger.error(f"Tentativas esgotadas para tabela {table_id} com geo {geo_option}: {e}")
+            continue
+
+        with medir_etapa(medicao, "decode") as etapa:
             try:
-                url = f"{base_url}/values/t/{table_id}/v/{variables}/p/{encoded_period}/{geo_option}/all"
-                logger.info(f"Tentativa {attempt + 1} para tabela {table_id} com geo: {geo_option}")
-
-                response = requests.get(url, timeout=60)
-                if response.status_code == 200:
-                    data = response.json()
-                    if not data or len(data) <= 1:
-                        logger.warning(f"Tabela {table_id} retornou dados vazios ou insuficientes")
-                        continue
-
-                    df = pd.DataFrame(data[1:], columns=data[0])
-                    df["Tabela_ID"] = table_id
-                    df["Data_Extracao"] = pd.Timestamp.now()
-                    df["Nivel_Geografico"] = geo_option
-
-                    logger.info(f"Tabela {table_id} extraída: {len(df)} registros")
-                    return df
-                else:
-                    logger.error(f"Erro HTTP {response.status_code}: {response.text}")
-                    time.sleep(2 ** attempt)
-            except requests.exceptions.Timeout:
-                logger.error(f"Timeout na tentativa {attempt + 1} para tabela {table_id}")
-                time.sleep(5)
-            except Exception as e:
-                logger.error(f"Erro de requisição: {e}")
-                time.sleep(2 ** attempt)
+                data = response.json()
+            except ValueError as e:
+                # JSON inválido é tratado como payload vazio: próximo nível
+                logger.warning(f"Tabela {table_id} retornou JSON inválido em {geo_option}: {e}")
+                data = []
+            # Com /h/n não há a linha de descrições: os dados começam na primeira linha
+            linhas = data[1:] if espec.cabecalho else data
+            if not linhas:
+                # Payload vazio não melhora repetindo: próximo nível
+                logger.warning(f"Tabela {table_id} retornou dados vazios ou insuficientes em {geo_option}")
+                cache.registrar_falha(table_id, geo_option)
+                continue
+
+            # Hash do payload antes de montar o frame (no modo compacto `data` é descartado)
+            hash_conteudo = hash_payload(data, requisicao=caminho)
+            constantes = {"Tabela_ID": table_id, "Data_Extracao": pd.Timestamp.now(), "Nivel_Geografico": geo_option}
+            if memoria_compacta():
+                # Colunas categóricas/numéricas direto do JSON, constantes em df.attrs
+                df = dataframe_sidra(data, constantes, cabecalho=espec.cabecalho)
+            else:
+                df = pd.DataFrame(linhas, columns=list(linhas[0]))
+                for coluna, valor in constantes.items():
+                    df[coluna] = valor
+            del data, linhas
+            df.attrs["hash_conteudo"] = hash_conteudo
+            etapa.linhas = len(df)
+            etapa.memoria = pegada_bytes(df)
+
+        cache.registrar_sucesso(table_id, geo_option)
+        # Cópia bruta no lago Parquet (LAGO_GRAVAR=1) para reprocessar sem a API
+        registrar_extracao("sidra", df, tabela=table_id, nivel=geo_option)
+        logger.info(f"Tabela {table_id} extraída: {len(df)} registros")
+        return df
                 
     logger.error(f"Todas as tentativas falharam para a tabela {table_id}")
     return None
@@ -128,37 +236,36 @@ def get_sidra_table(table_id, variables="all", period="last 3", geo="n3", retry_
 # Funções para banco de dados
 # ------------------------------
 def create_dynamic_table(table_name, df):
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     if not conn:
         logger.error("Não foi possível conectar ao banco de dados")
         return False
 
     try:
         cursor = conn.cursor()
+        # Tipos lógicos, traduzidos para o banco configurado (armazenamento.py)
         dtype_mapping = {
-            "object": f"NVARCHAR({MAX_VARCHAR_LENGTH})",
-            "int64": "INT",
-            "float64": "FLOAT",
-            "datetime64[ns]": "DATETIME",
-            "bool": "BIT"
+            "object": f"texto({MAX_VARCHAR_LENGTH})",
+            "int64": "inteiro",
+            "float64": "real",
+            "datetime64[ns]": "data_hora",
+            "bool": "booleano"
         }
         
-        columns_sql = []
+        columns = []
         for col, dtype in df.dtypes.items():
-            sql_type = dtype_mapping.get(str(dtype), f"NVARCHAR({MAX_VARCHAR_LENGTH})")
+            tipo = dtype_mapping.get(str(dtype), f"texto({MAX_VARCHAR_LENGTH})")
             normalized_col = normalize_column_names([col])[0]
-            columns_sql.append(f"{normalized_col} {sql_type}")
+            columns.append((normalized_col, tipo))
         
-        create_table_query = f"""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{table_name}' AND xtype='U')
-        CREATE TABLE {table_name} (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            {', '.join(columns_sql)},
-            data_criacao DATETIME DEFAULT GETDATE()
-        )
-        """
-        cursor.execute(create_table_query)
+        backend.criar_tabela(cursor, table_name, columns)
+        # Cargas por período (ex.: backfill) podem trazer variáveis que a tabela ainda não tem
+        existentes = {c.lower() for c in backend.colunas_existentes(cursor, table_name)}
+        faltantes = [(col, tipo) for col, tipo in columns if col.lower() not in existentes]
+        if faltantes:
+            backend.garantir_colunas(cursor, table_name, faltantes)
+            logger.info(f"Colunas acrescentadas à tabela {table_name}: {[col for col, _ in faltantes]}")
         conn.commit()
         logger.info(f"Tabela {table_name} criada ou já existente")
         return True
@@ -171,13 +278,21 @@ def create_dynamic_table(table_name, df):
         if conn:
             conn.close()
 
-def insert_data_to_sql(df, table_name):
+def insert_data_to_sql(df, table_name, modo="substituir"):
+    """
+    Grava o DataFrame pivotado na tabela.
+
+    Params:
+        modo (str): "substituir" trunca a tabela antes de inserir;
+            "periodos" apaga apenas os períodos (d2n) presentes em df, o que
+            permite cargas parciais e concorrentes da mesma tabela
+    """
     if df is None or df.empty:
         logger.warning(f"Nenhum dado para inserir na tabela {table_name}")
         return False
 
-    db = DatabaseConnection()
-    conn = db.get_connection()
+    backend = armazenamento()
+    conn = backend.conectar()
     if not conn:
         logger.error("Não foi possível conectar ao banco de dados")
         return False
@@ -188,20 +303,23 @@ def insert_data_to_sql(df, table_name):
         df.columns = normalized_columns
         df = df.drop(columns=['id', 'data_criacao'], errors='ignore')
 
-        # Trunca a tabela para substituir dados antigos
-        cursor.execute(f"TRUNCATE TABLE {table_name}")
-        conn.commit()
-        logger.info(f"Tabela {table_name} truncada com sucesso")
-
-        columns = ', '.join(df.columns)
-        placeholders = ', '.join(['?' for _ in df.columns])
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        if modo == "periodos":
+            # Substitui apenas os períodos carregados agora (mesma transação do insert)
+            periodos = [str(p) for p in df["d2n"].dropna().unique()]
+            for i in range(0, len(periodos), 500):
+                lote = periodos[i:i + 500]
+                cursor.execute(
+                    f"DELETE FROM {table_name} WHERE d2n IN ({', '.join('?' for _ in lote)})", lote
+                )
+            logger.info(f"{len(periodos)} períodos substituídos na tabela {table_name}")
+        else:
+            # Trunca a tabela para substituir dados antigos
+            backend.truncar(cursor, table_name)
+            conn.commit()
+            logger.info(f"Tabela {table_name} truncada com sucesso")
 
-        batch_size = 100
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i + batch_size]
-            records = [tuple(row) for row in batch.to_numpy()]
-            cursor.executemany(insert_query, records)
+        # Carga em lote (fast_executemany no SQL Server, vetorizada no DuckDB)
+        backend.inserir_dataframe(conn, table_name, df)
 
         conn.commit()
         logger.info(f"{len(df)} registros inseridos na tabela {table_name}")
@@ -215,30 +333,35 @@ def insert_data_to_sql(df, table_name):
         if conn:
             conn.close()
 
-def log_extraction(table_id, registros_extraidos, status, mensagem=""):
-    db = DatabaseConnection()
-    conn = db.get_connection()
+def log_extraction(table_id, registros_extraidos, status, mensagem="", medicao=None):
+    backend = armazenamento()
+    conn = backend.conectar()
     if not conn:
         return False
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='pnad_log_extracao' AND xtype='U')
-        CREATE TABLE pnad_log_extracao (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            tabela_id NVARCHAR(50),
-            data_extracao DATETIME,
-            registros_extraidos INT,
-            status NVARCHAR(50),
-            mensagem NVARCHAR(500),
-            data_criacao DATETIME DEFAULT GETDATE()
-        )
-        """)
-        cursor.execute("""
+        backend.criar_tabela(cursor, "pnad_log_extracao", [
+            ("tabela_id", "texto(50)"),
+            ("data_extracao", "data_hora"),
+            ("registros_extraidos", "inteiro"),
+            ("status", "texto(50)"),
+            ("mensagem", "texto(500)"),
+        ])
+        garantir_colunas_log(cursor, "pnad_log_extracao")
+
+        colunas = ["tabela_id", "data_extracao", "registros_extraidos", "status", "mensagem"]
+        valores = [table_id, pd.Timestamp.now(), registros_extraidos, status, mensagem]
+        if medicao is not None:
+            metricas_log = medicao.valores_log()
+            colunas += [coluna for coluna, _ in COLUNAS_LOG]
+            valores += [metricas_log[coluna] for coluna, _ in COLUNAS_LOG]
+            medicao.finalizar(status)
+
+        cursor.execute(f"""
         INSERT INTO pnad_log_extracao 
-        (tabela_id, data_extracao, registros_extraidos, status, mensagem)
-        VALUES (?, ?, ?, ?, ?)
-        """, (table_id, pd.Timestamp.now(), registros_extraidos, status, mensagem))
+        ({', '.join(colunas)})
+        VALUES ({', '.join('?' for _ in colunas)})
+        """, valores)
         conn.commit()
         return True
     except Exception as e:
@@ -250,48 +373,129 @@ def log_extraction(table_id, registros_extraidos, status, mensagem=""):
 # ------------------------------
 # Função principal
 # ------------------------------
-def extract_and_insert_data(table_ids):
-    for table_id in table_ids:
-        try:
-            logger.info(f"Iniciando extração para tabela: {table_id}")
-            
-            df_sidra = get_sidra_table(table_id)
-            if df_sidra is None or df_sidra.empty:
-                log_extraction(table_id, 0, "FALHA", "Falha ao extrair dados do SIDRA")
-                continue
+def processar_tabela(table_id, hierarquia=None, period=None, modo="substituir", df_sidra=None, forcar=False,
+                     medicao=None, pode_gravar=None):
+    """
+    Extrai, pivota e grava uma tabela SIDRA (ou um lote de períodos dela).
+
+    Params:
+        table_id (str): id da tabela SIDRA
+        hierarquia (HierarquiaTerritorial): índice territorial para os agregados
+        period (str): períodos pedidos ao SIDRA (ex: "last 3" ou "202301,202302");
+            None = os da especificação da tabela (especificacao_sidra.py)
+        modo (str): modo de gravação de insert_data_to_sql
+        df_sidra (DataFrame): forma longa já disponível (ex.: lida do lago
+            Parquet); quando informada, o SIDRA não é consultado
+        forcar (bool): carrega mesmo que o hash do payload seja igual ao
+            da última carga concluída
+        medicao (MedicaoExecucao): medição já iniciada (ex.: com o fetch feito
+            fora daqui); padrão: uma nova
+        pode_gravar (callable): consultado antes de criar a tabela e gravar;
+            se retornar False a carga é abandonada com status CANCELADO,
+            sem gravar nem registrar no log
 
+    Retorna:
+        str: status gravado em pnad_log_extracao
+    """
+    medicao = medicao or MedicaoExecucao("pnad", table_id)
+    try:
+        logger.info(f"Iniciando extração para tabela: {table_id} (períodos: {period or 'da especificação'})")
+        
+        if df_sidra is None:
+            df_sidra = get_sidra_table(table_id, period=period, medicao=medicao)
+        elif memoria_compacta():
+            df_sidra = compactar_sidra(df_sidra)
+        if df_sidra is None or df_sidra.empty:
+            status = "FALHA"
+            log_extraction(table_id, 0, status, "Falha ao extrair dados do SIDRA", medicao)
+            return status
+
+        # Mesmo conteúdo da última carga: pivot, DDL e carga não mudariam nada.
+        # Frames sem hash (ex.: lidos do lago) nunca são pulados.
+        medicao.hash_conteudo = df_sidra.attrs.get("hash_conteudo")
+        if not forcar and conteudo_inalterado(
+            medicao.hash_conteudo, "pnad_log_extracao", {"tabela_id": table_id}, f"pnad_pivoted_{table_id}"
+        ):
+            status = SEM_ALTERACAO
+            logger.info(f"Tabela {table_id} sem alteração desde a última carga: pivot e carga ignorados")
+            log_extraction(table_id, len(df_sidra), status, "Payload idêntico ao da última carga", medicao)
+            return status
+
+        with medir_etapa(medicao, "pivot") as etapa:
             df_pivoted = pivot_sidra_data(df_sidra)
-            if df_pivoted is None or df_pivoted.empty:
-                log_extraction(table_id, 0, "FALHA", "Falha ao pivotar os dados")
-                continue
+            etapa.linhas = len(df_pivoted) if df_pivoted is not None else 0
+            etapa.memoria = pegada_bytes(df_pivoted)
+        # A forma longa não é mais usada: libera antes da carga
+        df_sidra = None
+        if df_pivoted is None or df_pivoted.empty:
+            status = "FALHA"
+            log_extraction(table_id, 0, status, "Falha ao pivotar os dados", medicao)
+            return status
 
-            table_name = f"pnad_pivoted_{table_id}"
-            if create_dynamic_table(table_name, df_pivoted):
-                if insert_data_to_sql(df_pivoted, table_name):
-                    log_extraction(table_id, len(df_pivoted), "SUCESSO", "Dados inseridos com sucesso")
-                else:
-                    log_extraction(table_id, 0, "FALHA", "Erro ao inserir dados no SQL")
+        if pode_gravar is not None and not pode_gravar():
+            logger.warning(f"Tabela {table_id}: gravação cancelada antes da carga")
+            return CANCELADO
+
+        table_name = f"pnad_pivoted_{table_id}"
+        with medir_etapa(medicao, "create_table"):
+            tabela_criada = create_dynamic_table(table_name, df_pivoted)
+        if tabela_criada:
+            with medir_etapa(medicao, "insert") as etapa:
+                inserido = insert_data_to_sql(df_pivoted, table_name, modo=modo)
+                etapa.linhas = len(df_pivoted) if inserido else 0
+            if inserido:
+                # Atualiza os agregados apenas dos períodos recém-carregados
+                atualizar_agregados(table_id, df_pivoted, hierarquia, df_pivoted.attrs.get("unidades"))
+                # Indicadores derivados (indicadores_pnad.py) dos mesmos períodos
+                atualizar_indicadores(table_id, df_pivoted)
+                status = "SUCESSO"
+                log_extraction(table_id, len(df_pivoted), status, "Dados inseridos com sucesso", medicao)
             else:
-                log_extraction(table_id, 0, "FALHA", "Falha ao criar tabela dinâmica")
-                
-        except Exception as e:
-            logger.error(f"Erro inesperado processando tabela {table_id}: {e}")
-            log_extraction(table_id, 0, "ERRO", f"Erro inesperado: {str(e)}")
+                status = "FALHA"
+                log_extraction(table_id, 0, status, "Erro ao inserir dados no SQL", medicao)
+        else:
+            status = "FALHA"
+            log_extraction(table_id, 0, status, "Falha ao criar tabela dinâmica", medicao)
+        return status
+            
+    except Exception as e:
+        logger.error(f"Erro inesperado processando tabela {table_id}: {e}")
+        status = "ERRO"
+        log_extraction(table_id, 0, status, f"Erro inesperado: {str(e)}", medicao)
+        return status
+
+@com_perfil("pnad")
+def extract_and_insert_data(table_ids, progresso=None, hierarquia=None, modo="periodos"):
+    """
+    Extrai, pivota e grava cada tabela SIDRA de table_ids.
+
+    Params:
+        table_ids (list): ids das tabelas SIDRA
+        progresso (callable): chamado como progresso(concluidas, total, table_id, status)
+            ao final de cada tabela
+        hierarquia (HierarquiaTerritorial): índice territorial já carregado (opcional)
+        modo (str): modo de gravação de insert_data_to_sql; "periodos" (padrão)
+            substitui só os períodos baixados e preserva o histórico carregado
+            por backfill_pnad.py; "substituir" é a recarga completa da tabela
+
+    Retorna:
+        dict {table_id: status} com o status gravado no log de cada tabela
+    """
+    # Índice territorial usado para atualizar os agregados após cada carga
+    if hierarquia is None:
+        hierarquia = carregar_ou_construir(armazenamento().conectar)
+
+    resultados = {}
+    for table_id in table_ids:
+        resultados[table_id] = processar_tabela(table_id, hierarquia, modo=modo)
+        if progresso is not None:
+            progresso(len(resultados), len(table_ids), table_id, resultados[table_id])
+
+    return resultados
 
 # ------------------------------
 # Exemplo de uso
 # ------------------------------
 if __name__ == "__main__":
-    TABLE_IDS_TO_FETCH = [
-        "4093",  # Força de trabalho
-        "4094",  # Pessoas ocupadas
-        "4095",  # Rendimento
-        "5440",  # Empresas e pessoal
-        "5918",  # Serviços para empresas
-        "5919",  # Manutenção e reparação
-        "1616",  # Domicílios por cômodos
-        "1617",  # Tipos de domicílios
-        "3416",  # Bens duráveis e internet
-        "3516"   # Condição de ocupação
-    ]
+    iniciar_rastreamento_memoria()
     extract_and_insert_data(TABLE_IDS_TO_FETCH)
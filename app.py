@@ -1,17 +1,206 @@
-from fastapi import FastAPI, HTTPException
-from database import DatabaseConnection
-import uvicorn
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response
+from database import DatabaseConnection, PoolConexoes, carregar_config
+from hierarquia_territorial import carregar_ou_construir, NOMES_NIVEIS
+from consulta_streaming import ConsultaStreaming, ErroConsulta, TIPOS_MIDIA
+from cache_resultados import CacheResultados
+from malhas_tiles import ServidorMalhas, ZOOM_MAX, NIVEIS_MALHAS
+from metricas import REGISTRO
+from fila_extracoes import FilaExtracoes, PedidoExtracao, EstadoExtracao, ErroPedido
+from consultas_pnad import (
+    ErroFiltro, RespostaTabelas, RespostaPNAD, RespostaVariaveis, RespostaLocalidades,
+    listar_tabelas_pnad, listar_variaveis, consultar_dados_pnad,
+    consultar_localidades, versoes_cargas, versoes_cargas_ibge,
+)
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import logging
+import math
+import time
 import os
-from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente
-load_dotenv('config.env')
+carregar_config()
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Projeto TL - PNAD", description="API com conexão SQL Server")
 
 # Instância da conexão com o banco
 db_connection = DatabaseConnection()
 
+# Acesso ao banco fora do event loop: o pyodbc é bloqueante, então cada
+# consulta roda em um executor limitado ao tamanho do pool de conexões
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_QUERY_TIMEOUT = float(os.getenv('DB_QUERY_TIMEOUT', 30))
+DB_MAX_ROWS = int(os.getenv('DB_MAX_ROWS', 50000))
+
+pool_conexoes = PoolConexoes(db_connection, tamanho=DB_POOL_SIZE)
+executor_banco = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def executar_no_banco(funcao, timeout=DB_QUERY_TIMEOUT):
+    """
+    Executa funcao(cursor) em uma thread do executor com uma conexão do pool.
+
+    Se o tempo estourar (ou a requisição for cancelada pelo cliente), a
+    consulta em andamento é cancelada no SQL Server via cursor.cancel().
+    """
+    estado = {"cursor": None}
+
+    def tarefa():
+        with pool_conexoes.conexao(timeout=timeout) as conn:
+            conn.timeout = max(1, math.ceil(timeout))
+            cursor = conn.cursor()
+            estado["cursor"] = cursor
+            inicio = time.perf_counter()
+            try:
+                return funcao(cursor)
+            finally:
+                cursor.close()
+                REGISTRO.observar(
+                    "pnad_api_consulta_duracao_segundos", time.perf_counter() - inicio,
+                    {"operacao": getattr(funcao, "__name__", "consulta")}, "Duração das consultas da API ao banco"
+                )
+
+    futuro = asyncio.get_running_loop().run_in_executor(executor_banco, tarefa)
+    try:
+        return await asyncio.wait_for(futuro, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        cursor = estado["cursor"]
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+        raise
+
+async def consultar_banco(funcao, timeout=DB_QUERY_TIMEOUT):
+    """Como executar_no_banco, mas converte falhas em HTTPException"""
+    try:
+        return await executar_no_banco(funcao, timeout)
+    except (asyncio.TimeoutError, TimeoutError):
+        raise HTTPException(status_code=504, detail=f"Consulta excedeu o tempo limite de {timeout}s")
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _versao_servidor(cursor):
+    cursor.execute("SELECT @@version")
+    return cursor.fetchone()[0]
+
+# Cache de resultados das consultas tipadas, invalidado quando
+# pnad_log_extracao registra uma nova carga bem-sucedida da tabela
+cache_resultados = CacheResultados(
+    max_itens=int(os.getenv('CACHE_MAX_ITENS', 1024)),
+    ttl=float(os.getenv('CACHE_TTL', 300)),
+)
+CACHE_INTERVALO_VERIFICACAO = float(os.getenv('CACHE_INTERVALO_VERIFICACAO', 10))
+TAG_CATALOGO = "catalogo"
+TAG_LOCALIDADES = "localidades"
+TAG_MALHAS = "malhas"
+# Cargas IBGE que mudam ibge_localidades_tratado (a API de localidades lê a tabela tratada)
+TIPOS_CARGA_LOCALIDADES = ("LOCALIDADES", "TRATAMENTO")
+# Cargas que mudam as malhas servidas (SIMPLIFICACAO é gravada por precomputar_simplificacoes)
+TIPOS_CARGA_MALHAS = ("MALHAS", "SIMPLIFICACAO")
+versoes_tabelas = {}
+versoes_ibge = None  # None até a primeira verificação
+tarefas_fundo = []
+
+async def monitorar_cargas():
+    """
+    Consulta periodicamente pnad_log_extracao e invalida as tabelas
+    recarregadas; em ibge_log_extracao, uma nova carga de localidades ou
+    tratamento invalida as respostas de /localidades, e uma nova carga ou
+    simplificação das malhas descarta as camadas, os tiles em disco e o
+    GeoJSON em cache
+    """
+    global versoes_ibge
+    while True:
+        try:
+            atuais = await executar_no_banco(versoes_cargas, timeout=10)
+            for tabela_id, versao in atuais.items():
+                if tabela_id in versoes_tabelas and versoes_tabelas[tabela_id] != versao:
+                    logger.info(f"Nova carga da tabela {tabela_id}: invalidando cache")
+                    cache_resultados.invalidar(tabela_id)
+                    cache_resultados.invalidar(TAG_CATALOGO)
+                elif tabela_id not in versoes_tabelas and versoes_tabelas:
+                    cache_resultados.invalidar(TAG_CATALOGO)
+            versoes_tabelas.update(atuais)
+
+            atuais_ibge = await executar_no_banco(versoes_cargas_ibge, timeout=10)
+            if versoes_ibge is not None and any(
+                atuais_ibge.get(tipo) != versoes_ibge.get(tipo) for tipo in TIPOS_CARGA_LOCALIDADES
+            ):
+                logger.info("Nova carga de localidades IBGE: invalidando cache")
+                cache_resultados.invalidar(TAG_LOCALIDADES)
+            if versoes_ibge is not None and any(
+                atuais_ibge.get(tipo) != versoes_ibge.get(tipo) for tipo in TIPOS_CARGA_MALHAS
+            ):
+                logger.info("Malhas recarregadas ou simplificadas: invalidando tiles e GeoJSON")
+                await asyncio.get_running_loop().run_in_executor(executor_banco, servidor_malhas.recarregar)
+                cache_resultados.invalidar(TAG_MALHAS)
+            versoes_ibge = atuais_ibge
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Falha ao verificar novas cargas: {e}")
+        await asyncio.sleep(CACHE_INTERVALO_VERIFICACAO)
+
+async def responder_com_cache(request, chave, tag, produtor):
+    """
+    Devolve a resposta do cache (ou gera com produtor(cursor) e guarda),
+    respeitando If-None-Match com o ETag da entrada.
+    """
+    entrada = cache_resultados.obter(chave)
+    if entrada is None:
+        versao = cache_resultados.versao(tag)
+        try:
+            modelo = await consultar_banco(produtor)
+        except ErroFiltro as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        entrada = cache_resultados.gravar(chave, modelo.model_dump_json().encode('utf-8'), tag, versao)
+
+    return responder_entrada(request, entrada, "application/json")
+
+def responder_entrada(request, entrada, media_type):
+    """Resposta de uma entrada do cache: 304 se If-None-Match casar com o ETag (lista ou *)"""
+    cabecalhos = {"ETag": entrada.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or entrada.etag in [e.strip() for e in if_none_match.split(",")]:
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=entrada.corpo, media_type=media_type, headers=cabecalhos)
+
+# Malhas simplificadas por zoom (tiles MVT e GeoJSON)
+servidor_malhas = ServidorMalhas(db_connection.get_connection)
+
+# Extrações disparadas pela API (workers em segundo plano, fora do executor do banco)
+fila_extracoes = FilaExtracoes()
+
+# Índice territorial (carregado no startup a partir do arquivo mapeado em memória)
+hierarquia = None
+
+@app.on_event("startup")
+async def carregar_hierarquia():
+    """Carrega o índice região → UF → RM → município"""
+    global hierarquia
+    hierarquia = await asyncio.get_running_loop().run_in_executor(
+        executor_banco, carregar_ou_construir, db_connection.get_connection
+    )
+
+@app.on_event("startup")
+async def iniciar_monitor_cargas():
+    tarefas_fundo.append(asyncio.create_task(monitorar_cargas()))
+
+@app.on_event("shutdown")
+async def encerrar_banco():
+    """Libera as threads do executor e fecha as conexões ociosas"""
+    for tarefa in tarefas_fundo:
+        tarefa.cancel()
+    executor_banco.shutdown(wait=False, cancel_futures=True)
+    fila_extracoes.encerrar()
+    pool_conexoes.fechar()
+
 @app.get("/")
 async def root():
     return {"message": "Bem-vindo ao Projeto TL - PNAD!"}
@@ -20,19 +209,18 @@ async def root():
 async def health_check():
     """Verifica a saúde da aplicação e conexão com o banco"""
     try:
-        # Testa a conexão com o banco
-        if db_connection.test_connection():
-            return {
-                "status": "healthy",
-                "database": "connected",
-                "message": "Aplicação funcionando normalmente"
-            }
-        else:
-            return {
-                "status": "unhealthy",
-                "database": "disconnected",
-                "message": "Problema na conexão com o banco de dados"
-            }
+        await executar_no_banco(_versao_servidor, timeout=5)
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "message": "Aplicação funcionando normalmente"
+        }
+    except (asyncio.TimeoutError, TimeoutError, ConnectionError):
+        return {
+            "status": "unhealthy",
+            "database": "disconnected",
+            "message": "Problema na conexão com o banco de dados"
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
@@ -40,46 +228,205 @@ async def health_check():
 async def test_database():
     """Testa especificamente a conexão com o banco de dados"""
     try:
-        success = db_connection.test_connection()
-        if success:
-            return {"status": "success", "message": "Conexão com o banco estabelecida"}
-        else:
-            return {"status": "error", "message": "Falha na conexão com o banco"}
+        versao = await executar_no_banco(_versao_servidor, timeout=5)
+        return {"status": "success", "message": "Conexão com o banco estabelecida", "versao": versao}
+    except (asyncio.TimeoutError, TimeoutError, ConnectionError):
+        return {"status": "error", "message": "Falha na conexão com o banco"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao testar banco: {str(e)}")
 
 @app.get("/database/query")
-async def execute_query(query: str = "SELECT @@version"):
-    """Executa uma query no banco de dados (apenas SELECT por segurança)"""
+async def execute_query(query: str = "SELECT @@version", formato: str = "json",
+                        limite: int = DB_MAX_ROWS, chave: str = None, token: str = None,
+                        timeout: float = DB_QUERY_TIMEOUT):
+    """
+    Executa uma query no banco de dados (apenas SELECT por segurança).
+
+    O resultado é transmitido em lotes (json, ndjson ou csv) sem ser
+    materializado na API e nunca passa de DB_MAX_ROWS linhas. Informando
+    `chave` (coluna única e ordenável do resultado), a resposta traz um
+    `proximo_token` para buscar a página seguinte por keyset.
+    """
     if not query.strip().upper().startswith("SELECT"):
         raise HTTPException(status_code=400, detail="Apenas queries SELECT são permitidas")
-    
+
     try:
-        # Tenta usar pymssql primeiro
-        conn = db_connection.get_pymssql_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return {"status": "success", "results": results}
-        
-        # Se pymssql falhar, tenta pyodbc
-        conn = db_connection.get_pyodbc_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return {"status": "success", "results": results}
-        
-        raise HTTPException(status_code=500, detail="Não foi possível conectar ao banco")
-        
+        consulta = ConsultaStreaming(
+            pool_conexoes, executor_banco, query,
+            formato=formato,
+            limite=max(1, min(limite, DB_MAX_ROWS)),
+            chave=chave,
+            token=token,
+            timeout=min(timeout, DB_QUERY_TIMEOUT),
+        )
+        await consulta.abrir()
+    except ErroConsulta as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (asyncio.TimeoutError, TimeoutError):
+        raise HTTPException(status_code=504, detail="Consulta excedeu o tempo limite")
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao executar query: {str(e)}")
 
+    return StreamingResponse(consulta.transmitir(), media_type=TIPOS_MIDIA[formato])
+
+@app.get("/localidades/{nivel}/{codigo}")
+async def consultar_localidade(nivel: str, codigo: int):
+    """Retorna pai, filhos e RMs de uma localidade a partir do índice territorial"""
+    if hierarquia is None:
+        raise HTTPException(status_code=503, detail="Hierarquia territorial não disponível")
+    if nivel not in NOMES_NIVEIS:
+        raise HTTPException(status_code=400, detail=f"Nível inválido. Use: {', '.join(NOMES_NIVEIS)}")
+
+    nivel_id = NOMES_NIVEIS[nivel]
+    if not hierarquia.contem(nivel_id, codigo):
+        raise HTTPException(status_code=404, detail="Localidade não encontrada")
+
+    nomes_por_id = {v: k for k, v in NOMES_NIVEIS.items()}
+    pai = hierarquia.pai(nivel_id, codigo)
+    resultado = {
+        "nivel": nivel,
+        "codigo": codigo,
+        "nome": hierarquia.nome(nivel_id, codigo),
+        "sigla": hierarquia.sigla(nivel_id, codigo),
+        "pai": {"nivel": nomes_por_id[pai[0]], "codigo": pai[1]} if pai else None,
+        "filhos": hierarquia.filhos(nivel_id, codigo).tolist(),
+    }
+    if nivel == "rm":
+        resultado["municipios"] = hierarquia.municipios_da_rm(codigo).tolist()
+    elif nivel == "municipio":
+        resultado["regioes_metropolitanas"] = hierarquia.rms_do_municipio(codigo).tolist()
+    return resultado
+
+@app.get("/pnad/tabelas", response_model=RespostaTabelas)
+async def pnad_tabelas(request: Request):
+    """Lista os ids das tabelas PNAD já extraídas"""
+    def produtor(cursor):
+        return RespostaTabelas(tabelas=listar_tabelas_pnad(cursor))
+    return await responder_com_cache(request, ("tabelas",), TAG_CATALOGO, produtor)
+
+@app.get("/pnad/{tabela_id}/variaveis", response_model=RespostaVariaveis)
+async def pnad_variaveis(tabela_id: str, request: Request):
+    """Lista as variáveis (colunas) de uma tabela pnad_pivoted_*"""
+    def produtor(cursor):
+        return RespostaVariaveis(tabela_id=tabela_id, variaveis=listar_variaveis(cursor, tabela_id))
+    return await responder_com_cache(request, ("variaveis", tabela_id), tabela_id, produtor)
+
+@app.get("/pnad/{tabela_id}/dados", response_model=RespostaPNAD)
+async def pnad_dados(tabela_id: str, request: Request,
+                     periodo: Optional[List[str]] = Query(None),
+                     localidade: Optional[List[str]] = Query(None),
+                     variavel: Optional[List[str]] = Query(None),
+                     limite: int = 10000):
+    """Dados de uma tabela PNAD filtrados por período, localidade e variável"""
+    limite = max(1, min(limite, DB_MAX_ROWS))
+    chave = (
+        "dados", tabela_id,
+        tuple(sorted(periodo or [])), tuple(sorted(localidade or [])), tuple(sorted(variavel or [])),
+        limite,
+    )
+
+    def produtor(cursor):
+        return consultar_dados_pnad(cursor, tabela_id, periodo, localidade, variavel, limite)
+    return await responder_com_cache(request, chave, tabela_id, produtor)
+
+@app.get("/localidades", response_model=RespostaLocalidades)
+async def localidades_tratadas(request: Request, nivel: Optional[str] = None,
+                               uf: Optional[str] = None, regiao: Optional[str] = None,
+                               limite: int = 10000):
+    """Localidades de ibge_localidades_tratado (filtros por nível, UF e região)"""
+    limite = max(1, min(limite, DB_MAX_ROWS))
+    chave = ("localidades", nivel, uf, regiao, limite)
+
+    def produtor(cursor):
+        return consultar_localidades(cursor, nivel, uf, regiao, limite)
+    return await responder_com_cache(request, chave, TAG_LOCALIDADES, produtor)
+
+@app.get("/tiles/{z}/{x}/{y}")
+async def tile_malhas(z: int, x: int, y: int, nivel: Optional[str] = None):
+    """Tile vetorial (MVT) das malhas simplificadas para o zoom z"""
+    if z < 0 or z > ZOOM_MAX or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Coordenadas de tile inválidas (zoom máximo {ZOOM_MAX})")
+    if nivel is not None and nivel not in NIVEIS_MALHAS:
+        raise HTTPException(status_code=400, detail=f"Nível inválido: use {', '.join(NIVEIS_MALHAS)}")
+    try:
+        conteudo = await asyncio.get_running_loop().run_in_executor(
+            executor_banco, servidor_malhas.tile, z, x, y, nivel
+        )
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar tile: {str(e)}")
+    return Response(
+        content=conteudo,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+@app.get("/malhas/geojson")
+async def malhas_geojson(request: Request, zoom: int = 4, nivel: Optional[str] = None,
+                         codigo: Optional[List[str]] = Query(None)):
+    """GeoJSON com a geometria simplificada para o zoom (para mapas coropléticos)"""
+    zoom = min(max(zoom, 0), ZOOM_MAX)
+    chave = ("geojson", zoom, nivel, tuple(sorted(codigo or [])))
+    entrada = cache_resultados.obter(chave)
+    if entrada is None:
+        versao = cache_resultados.versao(TAG_MALHAS)
+        try:
+            colecao = await asyncio.get_running_loop().run_in_executor(
+                executor_banco, servidor_malhas.geojson, zoom, nivel, codigo
+            )
+        except ConnectionError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        corpo = json.dumps(colecao, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        entrada = cache_resultados.gravar(chave, corpo, TAG_MALHAS, versao)
+    return responder_entrada(request, entrada, "application/geo+json")
+
+@app.get("/cache/estatisticas")
+async def estatisticas_cache():
+    """Acertos/falhas e tamanho do cache de resultados"""
+    return cache_resultados.estatisticas()
+
+@app.post("/extracoes", response_model=EstadoExtracao, status_code=202)
+async def criar_extracao(pedido: PedidoExtracao, response: Response):
+    """
+    Enfileira uma extração (pnad: lista de tabelas; ibge: níveis/tipos;
+    tratamento). Um pedido idêntico a um job ainda ativo devolve o mesmo job.
+    """
+    try:
+        job, novo = fila_extracoes.submeter(pedido)
+    except ErroPedido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not novo:
+        response.status_code = 200
+    response.headers["Location"] = f"/extracoes/{job.id}"
+    return job.estado(duplicado=not novo)
+
+@app.get("/extracoes", response_model=List[EstadoExtracao])
+async def listar_extracoes(status: Optional[str] = None):
+    """Jobs de extração recentes (mais novos primeiro)"""
+    return [job.estado() for job in fila_extracoes.listar(status.upper() if status else None)]
+
+@app.get("/extracoes/{job_id}", response_model=EstadoExtracao)
+async def estado_extracao(job_id: str):
+    """Status e progresso (tabelas/operações concluídas) de um job"""
+    job = fila_extracoes.obter(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Extração não encontrada")
+    return job.estado()
+
+@app.get("/metrics")
+async def metricas():
+    """Métricas no formato de exposição do Prometheus"""
+    estatisticas = cache_resultados.estatisticas()
+    REGISTRO.definir("pnad_api_cache_acertos", estatisticas["acertos"], ajuda="Acertos do cache de resultados")
+    REGISTRO.definir("pnad_api_cache_falhas", estatisticas["falhas"], ajuda="Falhas do cache de resultados")
+    REGISTRO.definir("pnad_api_cache_itens", estatisticas["itens"], ajuda="Itens no cache de resultados")
+    return Response(content=REGISTRO.exportar(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv('PORT', 8000))
     uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
@@ -0,0 +1,387 @@
+import os
+import re
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from database import carregar_config
+
+# Carrega as variáveis de ambiente
+carregar_config()
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+DB_BACKEND = os.getenv('DB_BACKEND', 'sqlserver').lower()
+DB_ARQUIVO = os.getenv('DB_ARQUIVO', '')  # Arquivo dos backends embutidos (padrão: pnad.sqlite / pnad.duckdb)
+DB_LOTE_INSERCAO = int(os.getenv('DB_LOTE_INSERCAO', 1000))
+
+# Tipos lógicos usados pelas definições de tabela do projeto:
+# "texto(N)", "texto", "inteiro", "inteiro_grande", "real", "data_hora", "booleano"
+_TEXTO_COM_TAMANHO = re.compile(r"^texto\((\d+)\)$")
+
+
+# ------------------------------
+# Backend base
+# ------------------------------
+class Armazenamento:
+    """
+    Operações de armazenamento que mudam de um banco para outro: DDL,
+    tipos, truncamento, colunas novas e carga de DataFrames. Consultas e
+    DML simples (SELECT/INSERT/DELETE com "?") são escritos uma vez só
+    pelo resto do código.
+    """
+
+    nome = "base"
+    TIPOS = {}
+    TEXTO_LIMITADO = "{tamanho}"
+
+    def conectar(self):
+        """Conexão DB-API (cursor/commit/rollback/close) ou None se falhar"""
+        raise NotImplementedError
+
+    def tipo(self, logico):
+        tamanho = _TEXTO_COM_TAMANHO.match(logico)
+        if tamanho:
+            return self.TEXTO_LIMITADO.format(tamanho=tamanho.group(1))
+        return self.TIPOS[logico]
+
+    def criar_tabela(self, cursor, tabela, colunas, coluna_criacao="data_criacao"):
+        """
+        Cria a tabela se não existir, com `id` autoincremental e uma coluna
+        de data de criação preenchida pelo banco.
+
+        Params:
+            colunas (list): pares (nome, tipo lógico)
+        """
+        raise NotImplementedError
+
+    def criar_indice(self, cursor, nome, tabela, colunas, incluir=()):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})")
+
+    def tabela_existe(self, cursor, tabela):
+        raise NotImplementedError
+
+    def colunas_existentes(self, cursor, tabela):
+        raise NotImplementedError
+
+    def garantir_colunas(self, cursor, tabela, colunas):
+        """Acrescenta as colunas (nome, tipo lógico) que ainda não existirem"""
+        existentes = {c.lower() for c in self.colunas_existentes(cursor, tabela)}
+        for coluna, tipo in colunas:
+            if coluna.lower() not in existentes:
+                cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {self.tipo(tipo)}")
+
+    def truncar(self, cursor, tabela):
+        cursor.execute(f"DELETE FROM {tabela}")
+
+    def limitar(self, consulta, limite):
+        """Acrescenta o limite de linhas a um SELECT"""
+        return f"{consulta} LIMIT {int(limite)}"
+
+    def inserir_dataframe(self, conn, tabela, df, lote=DB_LOTE_INSERCAO):
+        """Insere todas as linhas de df (colunas = colunas da tabela); não faz commit"""
+        raise NotImplementedError
+
+
+def _linhas(df):
+    """Linhas de df como tuplas de tipos Python (NaN/NaT viram None)"""
+    import pandas as pd
+    objetos = df.astype(object).where(pd.notna(df), None)
+    return list(objetos.itertuples(index=False, name=None))
+
+
+# ------------------------------
+# SQL Server (padrão)
+# ------------------------------
+class ArmazenamentoSqlServer(Armazenamento):
+    nome = "sqlserver"
+    TIPOS = {
+        "texto": "NVARCHAR(MAX)", "inteiro": "INT", "inteiro_grande": "BIGINT", "real": "FLOAT",
+        "data_hora": "DATETIME", "booleano": "BIT",
+    }
+    TEXTO_LIMITADO = "NVARCHAR({tamanho})"
+
+    def __init__(self, db=None):
+        from database import DatabaseConnection
+        self.db = db or DatabaseConnection()
+
+    def conectar(self):
+        return self.db.get_connection()
+
+    def criar_tabela(self, cursor, tabela, colunas, coluna_criacao="data_criacao"):
+        definicoes = ",\n            ".join(f"{nome} {self.tipo(tipo)}" for nome, tipo in colunas)
+        cursor.execute(f"""
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{tabela}' AND xtype='U')
+        CREATE TABLE {tabela} (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            {definicoes},
+            {coluna_criacao} DATETIME DEFAULT GETDATE()
+        )
+        """)
+
+    def criar_indice(self, cursor, nome, tabela, colunas, incluir=()):
+        incluidas = f" INCLUDE ({', '.join(incluir)})" if incluir else ""
+        cursor.execute(f"""
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{nome}' AND object_id=OBJECT_ID('{tabela}'))
+        CREATE NONCLUSTERED INDEX {nome} ON {tabela} ({', '.join(colunas)}){incluidas}
+        """)
+
+    def tabela_existe(self, cursor, tabela):
+        cursor.execute("SELECT OBJECT_ID(?, 'U')", (tabela,))
+        return cursor.fetchone()[0] is not None
+
+    def garantir_colunas(self, cursor, tabela, colunas):
+        for coluna, tipo in colunas:
+            cursor.execute(
+                f"IF COL_LENGTH('{tabela}', '{coluna}') IS NULL ALTER TABLE {tabela} ADD {coluna} {self.tipo(tipo)} NULL"
+            )
+
+    def colunas_existentes(self, cursor, tabela):
+        cursor.execute("SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(?)", (tabela,))
+        return [linha[0] for linha in cursor.fetchall()]
+
+    def truncar(self, cursor, tabela):
+        cursor.execute(f"TRUNCATE TABLE {tabela}")
+
+    def limitar(self, consulta, limite):
+        return re.sub(r"^\s*SELECT\s", f"SELECT TOP {int(limite)} ", consulta, count=1, flags=re.IGNORECASE)
+
+    def inserir_dataframe(self, conn, tabela, df, lote=DB_LOTE_INSERCAO):
+        if df.empty:
+            return 0
+        cursor = conn.cursor()
+        # Parâmetros enviados em bloco pelo driver ODBC (uma ida ao servidor por lote)
+        cursor.fast_executemany = True
+        colunas = list(df.columns)
+        sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})"
+        linhas = _linhas(df)
+        for i in range(0, len(linhas), lote):
+            cursor.executemany(sql, linhas[i:i + lote])
+        return len(linhas)
+
+
+# ------------------------------
+# SQLite (embutido, sem dependências)
+# ------------------------------
+class ArmazenamentoSqlite(Armazenamento):
+    nome = "sqlite"
+    TIPOS = {
+        "texto": "TEXT", "inteiro": "INTEGER", "inteiro_grande": "INTEGER", "real": "REAL",
+        "data_hora": "TIMESTAMP", "booleano": "INTEGER",
+    }
+    TEXTO_LIMITADO = "TEXT"
+
+    _adaptadores_registrados = False
+
+    def __init__(self, arquivo=None):
+        self.arquivo = arquivo or DB_ARQUIVO or "pnad.sqlite"
+        self._registrar_adaptadores()
+
+    @classmethod
+    def _registrar_adaptadores(cls):
+        if cls._adaptadores_registrados:
+            return
+        import numpy as np
+        import pandas as pd
+
+        # Timestamps do pandas e escalares do numpy chegam ao sqlite3 pelos DataFrames
+        sqlite3.register_adapter(pd.Timestamp, lambda t: t.isoformat(sep=" "))
+        sqlite3.register_adapter(datetime, lambda t: t.isoformat(sep=" "))
+        for tipo in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64):
+            sqlite3.register_adapter(tipo, int)
+        for tipo in (np.float16, np.float32, np.float64):
+            sqlite3.register_adapter(tipo, float)
+        sqlite3.register_adapter(np.bool_, bool)
+        cls._adaptadores_registrados = True
+
+    def conectar(self):
+        try:
+            conn = sqlite3.connect(self.arquivo, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao abrir {self.arquivo}: {e}")
+            return None
+
+    def criar_tabela(self, cursor, tabela, colunas, coluna_criacao="data_criacao"):
+        definicoes = ",\n            ".join(f"{nome} {self.tipo(tipo)}" for nome, tipo in colunas)
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {definicoes},
+            {coluna_criacao} TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+    def tabela_existe(self, cursor, tabela):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tabela,))
+        return cursor.fetchone() is not None
+
+    def colunas_existentes(self, cursor, tabela):
+        cursor.execute(f"PRAGMA table_info({tabela})")
+        return [linha[1] for linha in cursor.fetchall()]
+
+    def inserir_dataframe(self, conn, tabela, df, lote=DB_LOTE_INSERCAO):
+        if df.empty:
+            return 0
+        colunas = list(df.columns)
+        sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})"
+        linhas = _linhas(df)
+        conn.cursor().executemany(sql, linhas)
+        return len(linhas)
+
+
+# ------------------------------
+# DuckDB (embutido, colunar)
+# ------------------------------
+class CursorDuckDB:
+    """Cursor que executa na própria conexão, para que commit/rollback valham para ele"""
+
+    def __init__(self, conexao):
+        self._conexao = conexao
+
+    def execute(self, sql, parametros=None):
+        if parametros is None:
+            self._conexao.execute(sql)
+        else:
+            self._conexao.execute(sql, list(parametros))
+        return self
+
+    def executemany(self, sql, registros):
+        self._conexao.executemany(sql, [list(r) for r in registros])
+        return self
+
+    @property
+    def description(self):
+        return self._conexao.description
+
+    def fetchone(self):
+        return self._conexao.fetchone()
+
+    def fetchall(self):
+        return self._conexao.fetchall()
+
+    def close(self):
+        pass
+
+
+class ConexaoDuckDB:
+    """
+    Conexão DuckDB com a semântica das outras (transação aberta até o
+    commit/rollback); cursor() devolve um cursor sobre a mesma conexão.
+    """
+
+    def __init__(self, conexao):
+        self.duckdb = conexao
+        self.duckdb.begin()
+
+    def cursor(self):
+        return CursorDuckDB(self.duckdb)
+
+    def execute(self, sql, parametros=None):
+        return self.cursor().execute(sql, parametros)
+
+    def commit(self):
+        self.duckdb.commit()
+        self.duckdb.begin()
+
+    def rollback(self):
+        self.duckdb.rollback()
+        self.duckdb.begin()
+
+    def close(self):
+        try:
+            self.duckdb.rollback()
+        finally:
+            self.duckdb.close()
+
+
+class ArmazenamentoDuckDB(Armazenamento):
+    nome = "duckdb"
+    TIPOS = {
+        "texto": "VARCHAR", "inteiro": "INTEGER", "inteiro_grande": "BIGINT", "real": "DOUBLE",
+        "data_hora": "TIMESTAMP", "booleano": "BOOLEAN",
+    }
+    TEXTO_LIMITADO = "VARCHAR"
+
+    def __init__(self, arquivo=None):
+        import duckdb
+        self._duckdb = duckdb
+        self.arquivo = arquivo or DB_ARQUIVO or "pnad.duckdb"
+        self._contador = 0
+        self._lock = threading.Lock()
+
+    def conectar(self):
+        try:
+            return ConexaoDuckDB(self._duckdb.connect(self.arquivo))
+        except self._duckdb.Error as e:
+            logger.error(f"Erro ao abrir {self.arquivo}: {e}")
+            return None
+
+    def criar_tabela(self, cursor, tabela, colunas, coluna_criacao="data_criacao"):
+        definicoes = ",\n            ".join(f"{nome} {self.tipo(tipo)}" for nome, tipo in colunas)
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS seq_{tabela}")
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            id BIGINT DEFAULT nextval('seq_{tabela}'),
+            {definicoes},
+            {coluna_criacao} TIMESTAMP DEFAULT current_timestamp
+        )
+        """)
+
+    def tabela_existe(self, cursor, tabela):
+        cursor.execute("SELECT 1 FROM information_schema.tables WHERE table_name = ?", (tabela,))
+        return cursor.fetchone() is not None
+
+    def colunas_existentes(self, cursor, tabela):
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = ?", (tabela,))
+        return [linha[0] for linha in cursor.fetchall()]
+
+    def inserir_dataframe(self, conn, tabela, df, lote=DB_LOTE_INSERCAO):
+        if df.empty:
+            return 0
+        # Carga vetorizada: o DuckDB lê o DataFrame direto da memória, sem linha a linha
+        with self._lock:
+            self._contador += 1
+            apelido = f"_carga_{self._contador}"
+        colunas = ", ".join(df.columns)
+        conn.duckdb.register(apelido, df)
+        try:
+            conn.duckdb.execute(f"INSERT INTO {tabela} ({colunas}) SELECT {colunas} FROM {apelido}")
+        finally:
+            conn.duckdb.unregister(apelido)
+        return len(df)
+
+
+BACKENDS = {
+    "sqlserver": ArmazenamentoSqlServer,
+    "sqlite": ArmazenamentoSqlite,
+    "duckdb": ArmazenamentoDuckDB,
+}
+
+_armazenamento = None
+_lock_armazenamento = threading.Lock()
+
+
+def armazenamento():
+    """Backend configurado em DB_BACKEND (sqlserver, sqlite ou duckdb)"""
+    global _armazenamento
+    with _lock_armazenamento:
+        if _armazenamento is None:
+            if DB_BACKEND not in BACKENDS:
+                raise ValueError(f"DB_BACKEND inválido: {DB_BACKEND} (use {', '.join(BACKENDS)})")
+            _armazenamento = BACKENDS[DB_BACKEND]()
+            logger.info(f"Backend de armazenamento: {_armazenamento.nome}")
+        return _armazenamento
+
+
+def usar_armazenamento(backend):
+    """Troca o backend em uso (ex.: benchmarks e execuções locais); retorna o anterior"""
+    global _armazenamento
+    with _lock_armazenamento:
+        anterior, _armazenamento = _armazenamento, backend
+    return anterior
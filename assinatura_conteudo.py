@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+SUCESSO = "SUCESSO"
+SEM_ALTERACAO = "SEM_ALTERACAO"
+# Status em que o destino ficou com o conteúdo da extração
+STATUS_CONCLUIDOS = (SUCESSO, SEM_ALTERACAO)
+# Carga abandonada antes da gravação (ex.: lease da fila distribuída perdido)
+CANCELADO = "CANCELADO"
+
+
+def pular_inalteradas():
+    """Pula pivot/DDL/carga quando o conteúdo não mudou (HASH_PULAR_INALTERADAS, padrão 1)"""
+    return os.getenv('HASH_PULAR_INALTERADAS', '1') == '1'
+
+
+# ------------------------------
+# Hash do conteúdo
+# ------------------------------
+def hash_payload(dados, **contexto):
+    """
+    SHA-256 do payload normalizado: JSON canônico (chaves ordenadas, sem
+    espaços) do conteúdo decodificado mais o contexto da requisição
+    (tabela, períodos, nível...), para que pedidos diferentes não colidam.
+    A ordem das linhas é mantida: as APIs do IBGE a devolvem estável.
+    """
+    resumo = hashlib.sha256()
+    resumo.update(json.dumps(contexto, sort_keys=True, separators=(",", ":"), default=str).encode('utf-8'))
+    resumo.update(b"\0")
+    resumo.update(json.dumps(dados, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode('utf-8'))
+    return resumo.hexdigest()
+
+
+def hash_resposta(conteudo, **contexto):
+    """hash_payload de uma resposta em bytes; se não for JSON, hash dos bytes crus"""
+    try:
+        dados = json.loads(conteudo)
+    except ValueError:
+        resumo = hashlib.sha256(json.dumps(contexto, sort_keys=True, default=str).encode('utf-8'))
+        resumo.update(b"\0")
+        resumo.update(conteudo)
+        return resumo.hexdigest()
+    return hash_payload(dados, **contexto)
+
+
+# ------------------------------
+# Comparação com a última carga
+# ------------------------------
+def ultimo_hash(cursor, tabela_log, filtros):
+    """
+    hash_conteudo da última extração concluída (SUCESSO ou SEM_ALTERACAO)
+    que casa com `filtros` ({coluna: valor}) na tabela de log, ou None.
+    """
+    from armazenamento import armazenamento
+
+    condicoes = " AND ".join(f"{coluna} = ?" for coluna in filtros)
+    consulta = f"""
+        SELECT hash_conteudo FROM {tabela_log}
+        WHERE {condicoes} AND hash_conteudo IS NOT NULL
+          AND status IN ({', '.join('?' for _ in STATUS_CONCLUIDOS)})
+        ORDER BY id DESC
+    """
+    cursor.execute(armazenamento().limitar(consulta.strip(), 1), [*filtros.values(), *STATUS_CONCLUIDOS])
+    linha = cursor.fetchone()
+    return linha[0] if linha else None
+
+
+def conteudo_inalterado(hash_conteudo, tabela_log, filtros, tabela_destino=None):
+    """
+    True se a última carga concluída tem o mesmo hash e a tabela de destino
+    (se informada) ainda existe. Qualquer erro na verificação devolve False:
+    na dúvida, a carga é refeita.
+    """
+    if not hash_conteudo or not pular_inalteradas():
+        return False
+    from armazenamento import armazenamento
+
+    backend = armazenamento()
+    conn = backend.conectar()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        if not backend.tabela_existe(cursor, tabela_log):
+            return False
+        if tabela_destino and not backend.tabela_existe(cursor, tabela_destino):
+            return False
+        from metricas import garantir_colunas_log
+        garantir_colunas_log(cursor, tabela_log)
+        conn.commit()
+        return ultimo_hash(cursor, tabela_log, filtros) == hash_conteudo
+    except Exception as e:
+        logger.warning(f"Não foi possível comparar o hash com a última carga ({tabela_log} {filtros}): {e}")
+        return False
+    finally:
+        conn.close()
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from database import carregar_config
+from assinatura_conteudo import STATUS_CONCLUIDOS
+from monitor_lancamentos import periodos_publicados
+
+logger = logging.getLogger(__name__)
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', 4))
+BACKFILL_MAX_PERIODOS = int(os.getenv('BACKFILL_MAX_PERIODOS', 12))  # Um ano de dados mensais por requisição
+BACKFILL_PRAZO_LOTE = float(os.getenv('BACKFILL_PRAZO_LOTE', 600))
+
+
+def caminho_progresso():
+    return os.getenv('BACKFILL_PATH', 'backfill_sidra.json')
+
+
+def lotes_por_ano(periodos, maximo=BACKFILL_MAX_PERIODOS):
+    """
+    Agrupa códigos de período SIDRA (ex: 202301, 2023) pelo ano — os quatro
+    primeiros dígitos — com no máximo `maximo` períodos por lote.
+    """
+    anos = {}
+    for periodo in sorted(periodos):
+        anos.setdefault(periodo[:4], []).append(periodo)
+    lotes = []
+    for ano in sorted(anos):
+        lotes += [anos[ano][i:i + maximo] for i in range(0, len(anos[ano]), maximo)]
+    return lotes
+
+
+# ------------------------------
+# Progresso retomável
+# ------------------------------
+class ProgressoBackfill:
+    """
+    Períodos já carregados (e os que falharam sozinhos) por tabela. Gravado
+    a cada lote (tmp + replace): um backfill interrompido recomeça de onde
+    parou.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or caminho_progresso()
+        self._lock = threading.Lock()
+        self._dados = self._ler()
+
+    def _ler(self):
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Progresso do backfill ilegível ({self.caminho}), recomeçando: {e}")
+            return {}
+
+    def _gravar(self):
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self._dados, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporario, self.caminho)
+
+    def concluidos(self, tabela):
+        with self._lock:
+            return set(self._dados.get(str(tabela), {}).get("concluidos", []))
+
+    def registrar(self, tabela, periodos, sucesso):
+        with self._lock:
+            entrada = self._dados.setdefault(str(tabela), {"concluidos": [], "falhas": []})
+            chave, outra = ("concluidos", "falhas") if sucesso else ("falhas", "concluidos")
+            entrada[chave] = sorted(set(entrada[chave]) | set(periodos))
+            entrada[outra] = sorted(set(entrada[outra]) - set(periodos))
+            entrada["atualizado_em"] = datetime.now().isoformat(timespec='seconds')
+            self._gravar()
+
+    def limpar(self, tabela):
+        with self._lock:
+            if self._dados.pop(str(tabela), None) is not None:
+                self._gravar()
+
+
+# ------------------------------
+# Backfill de uma tabela
+# ------------------------------
+def _buscar_lote(tabela, lote):
+    from api_PNDA import get_sidra_table
+    from metricas import MedicaoExecucao
+
+    medicao = MedicaoExecucao("pnad", tabela)
+    df = get_sidra_table(tabela, period=",".join(lote), medicao=medicao, prazo_segundos=BACKFILL_PRAZO_LOTE)
+    return df, medicao
+
+
+def backfill_tabela(tabela, periodos=None, hierarquia=None, progresso=None,
+                    workers=BACKFILL_WORKERS, maximo=BACKFILL_MAX_PERIODOS):
+    """
+    Carrega o histórico de uma tabela SIDRA em lotes por ano.
+
+    Os lotes são baixados em paralelo (até `workers` em voo) e gravados um
+    de cada vez, conforme chegam, com processar_tabela(modo="periodos"):
+    cada lote substitui só os próprios períodos, sem truncar a tabela, e
+    variáveis novas viram colunas novas. Um lote que falha é dividido ao
+    meio e reenfileirado; um período que falha sozinho fica registrado em
+    "falhas" e não impede os demais.
+
+    Params:
+        tabela (str): id da tabela SIDRA
+        periodos (list): códigos de período; padrão: todos os publicados
+        progresso (ProgressoBackfill): períodos já concluídos são pulados
+
+    Retorna:
+        dict {"concluidos": n, "falhas": [períodos]}
+    """
+    from api_PNDA import processar_tabela, log_extraction
+
+    progresso = progresso or ProgressoBackfill()
+    if periodos is None:
+        periodos = sorted(periodos_publicados(tabela) or [])
+    if not periodos:
+        logger.error(f"Nenhum período disponível para a tabela {tabela}")
+        return {"concluidos": 0, "falhas": []}
+
+    feitos = progresso.concluidos(tabela)
+    pendentes = [p for p in periodos if p not in feitos]
+    lotes = deque(lotes_por_ano(pendentes, maximo))
+    logger.info(
+        f"Backfill da tabela {tabela}: {len(pendentes)} de {len(periodos)} períodos pendentes em {len(lotes)} lotes"
+    )
+
+    concluidos, falhas = 0, []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"backfill-{tabela}") as executor:
+        em_voo = {}
+        while lotes or em_voo:
+            # Poucos lotes adiantados: os frames baixados esperam pouco pela gravação
+            while lotes and len(em_voo) < max(1, workers):
+                lote = lotes.popleft()
+                em_voo[executor.submit(_buscar_lote, tabela, lote)] = lote
+            prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+
+            for futuro in prontos:
+                lote = em_voo.pop(futuro)
+                periodo = ",".join(lote)
+                try:
+                    df, medicao = futuro.result()
+                except Exception as e:
+                    logger.error(f"Erro ao baixar os períodos {periodo} da tabela {tabela}: {e}")
+                    df, medicao = None, None
+
+                if df is None or df.empty:
+                    status = "FALHA"
+                    log_extraction(tabela, 0, status, f"Backfill: falha ao extrair os períodos {periodo}", medicao)
+                else:
+                    status = processar_tabela(tabela, hierarquia, period=periodo, modo="periodos", df_sidra=df, medicao=medicao)
+                df = None
+
+                if status in STATUS_CONCLUIDOS:
+                    progresso.registrar(tabela, lote, True)
+                    concluidos += len(lote)
+                    logger.info(f"Tabela {tabela}: períodos {periodo} carregados ({concluidos}/{len(pendentes)})")
+                elif len(lote) > 1:
+                    # Lote grande demais (limite de valores do SIDRA, prazo): tenta as metades
+                    meio = len(lote) // 2
+                    lotes.extend([lote[:meio], lote[meio:]])
+                    logger.warning(f"Tabela {tabela}: lote {periodo} falhou ({status}), dividindo em dois")
+                else:
+                    progresso.registrar(tabela, lote, False)
+                    falhas += lote
+                    logger.error(f"Tabela {tabela}: período {periodo} falhou ({status})")
+
+    logger.info(f"Backfill da tabela {tabela} concluído: {concluidos} períodos carregados, {len(falhas)} falhas")
+    return {"concluidos": concluidos, "falhas": sorted(falhas)}
+
+
+# ------------------------------
+# Linha de comando
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill do histórico de tabelas SIDRA em lotes paralelos por ano")
+    parser.add_argument("tabelas", nargs="+")
+    parser.add_argument("--periodos", help="Períodos separados por vírgula (padrão: todos os publicados)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="Lotes baixados em paralelo")
+    parser.add_argument("--max-periodos", type=int, default=BACKFILL_MAX_PERIODOS, help="Períodos por lote")
+    parser.add_argument("--recomecar", action="store_true", help="Ignora o progresso gravado")
+    args = parser.parse_args(argv)
+
+    from armazenamento import armazenamento
+    from hierarquia_territorial import carregar_ou_construir
+
+    hierarquia = carregar_ou_construir(armazenamento().conectar)
+    progresso = ProgressoBackfill()
+    periodos = [p.strip() for p in args.periodos.split(",") if p.strip()] if args.periodos else None
+    falhas = 0
+    for tabela in args.tabelas:
+        if args.recomecar:
+            progresso.limpar(tabela)
+        resultado = backfill_tabela(tabela, periodos, hierarquia, progresso, args.workers, args.max_periodos)
+        print(f"{tabela}: {resultado['concluidos']} períodos carregados, falhas: {', '.join(resultado['falhas']) or '-'}")
+        falhas += len(resultado["falhas"])
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import sys
+import logging
+import argparse
+import subprocess
+from benchmark_pnad import ler_baseline, salvar_baseline
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+IMPORTACAO_BASELINE_PATH = os.getenv('IMPORTACAO_BASELINE_PATH', 'importacao_baseline.json')
+IMPORTACAO_TOLERANCIA = float(os.getenv('IMPORTACAO_TOLERANCIA', 0.5))  # Importação oscila mais que os benchmarks
+IMPORTACAO_REPETICOES = int(os.getenv('IMPORTACAO_REPETICOES', 5))
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+# Pontos de entrada medidos e as dependências pesadas que eles NÃO podem
+# carregar na importação (devem vir só no caminho de código que as usa)
+_PESADAS_EXTRACAO = ["geopandas", "shapely", "pyproj", "fiona", "duckdb", "pyodbc", "requests", "fastapi"]
+ENTRADAS = {
+    "pnad": ["pandas", "numpy", "pyarrow"] + _PESADAS_EXTRACAO,
+    "api_PNDA": _PESADAS_EXTRACAO,
+    "api_IBGE": _PESADAS_EXTRACAO,
+    "pipeline": ["pandas", "numpy", "pyarrow"] + _PESADAS_EXTRACAO,
+    "app": ["pandas", "geopandas", "shapely", "pyarrow", "duckdb", "uvicorn"],
+}
+
+
+# ------------------------------
+# Medição (python -X importtime em um processo novo)
+# ------------------------------
+def ler_importtime(saida):
+    """
+    Interpreta o stderr de -X importtime. Retorna uma lista de
+    (módulo, próprio_us, acumulado_us, profundidade) na ordem impressa.
+    """
+    registros = []
+    for linha in saida.splitlines():
+        if not linha.startswith("import time:") or "self [us]" in linha:
+            continue
+        try:
+            proprio, acumulado, nome = linha[len("import time:"):].split("|")
+            profundidade = (len(nome) - len(nome.lstrip(" ")) - 1) // 2
+            registros.append((nome.strip(), int(proprio), int(acumulado), profundidade))
+        except ValueError:
+            continue
+    return registros
+
+
+def medir_importacao(modulo, repeticoes=IMPORTACAO_REPETICOES, top=5):
+    """
+    Importa `modulo` em `repeticoes` processos novos e fica com a mais
+    rápida (a menos afetada por ruído da máquina).
+
+    Retorna:
+        dict com total_ms, os maiores imports diretos e todos os módulos carregados
+    """
+    melhor = None
+    for _ in range(max(1, repeticoes)):
+        processo = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+            cwd=DIRETORIO_PROJETO, capture_output=True, text=True,
+        )
+        if processo.returncode != 0:
+            raise RuntimeError(f"Falha ao importar {modulo}: {processo.stderr.strip().splitlines()[-1:]}")
+        registros = ler_importtime(processo.stderr)
+        total = next((acumulado for nome, _, acumulado, prof in registros if nome == modulo and prof == 0), None)
+        if total is None:
+            raise RuntimeError(f"{modulo} não aparece na saída de -X importtime")
+        if melhor is None or total < melhor[0]:
+            melhor = (total, registros)
+
+    total, registros = melhor
+    # Filhos diretos do módulo: o importtime imprime os filhos antes do pai,
+    # então são as linhas de profundidade 1 logo antes da linha do módulo
+    diretos, pendentes = [], []
+    for nome, _, acumulado, prof in registros:
+        if prof == 1:
+            pendentes.append((nome, acumulado))
+        elif prof == 0:
+            if nome == modulo:
+                diretos = pendentes
+            pendentes = []
+    diretos.sort(key=lambda item: -item[1])
+    return {
+        "total_ms": round(total / 1000, 1),
+        "maiores": [[nome, round(acumulado / 1000, 1)] for nome, acumulado in diretos[:top]],
+        "modulos": sorted({nome for nome, *_ in registros}),
+    }
+
+
+def verificar_proibidos(modulo, resultado, proibidos):
+    carregados = set(resultado["modulos"])
+    return [f"{modulo}: importa {nome} na carga do módulo" for nome in proibidos if nome in carregados]
+
+
+def comparar(resultados, baseline, tolerancia=IMPORTACAO_TOLERANCIA):
+    regressoes = []
+    for modulo, atual in resultados.items():
+        anterior = (baseline or {}).get("casos", {}).get(modulo)
+        if anterior and atual["total_ms"] > anterior["total_ms"] * (1 + tolerancia):
+            regressoes.append(f"{modulo}: {atual['total_ms']:.0f}ms > {anterior['total_ms']:.0f}ms")
+    return regressoes
+
+
+def relatorio(resultados, baseline=None):
+    casos_base = (baseline or {}).get("casos", {})
+    linhas = [f"{'módulo':<14} {'total':>9} {'vs baseline':>12}  maiores imports diretos"]
+    for modulo, r in resultados.items():
+        anterior = casos_base.get(modulo)
+        variacao = f"{(r['total_ms'] / anterior['total_ms'] - 1) * 100:+.1f}%" if anterior else "-"
+        maiores = ", ".join(f"{nome} {ms:.0f}ms" for nome, ms in r["maiores"])
+        linhas.append(f"{modulo:<14} {r['total_ms']:>7.1f}ms {variacao:>12}  {maiores}")
+    return "\n".join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tempo de importação dos pontos de entrada (python -X importtime)")
+    parser.add_argument("modulos", nargs="*", help=f"Padrão: {', '.join(ENTRADAS)}")
+    parser.add_argument("--repeticoes", type=int, default=IMPORTACAO_REPETICOES)
+    parser.add_argument("--baseline", default=IMPORTACAO_BASELINE_PATH)
+    parser.add_argument("--tolerancia", type=float, default=IMPORTACAO_TOLERANCIA)
+    parser.add_argument("--salvar-baseline", action="store_true", help="Grava os tempos como nova baseline")
+    args = parser.parse_args(argv)
+
+    resultados, falhas = {}, []
+    for modulo in args.modulos or list(ENTRADAS):
+        resultados[modulo] = medir_importacao(modulo, args.repeticoes)
+        falhas += verificar_proibidos(modulo, resultados[modulo], ENTRADAS.get(modulo, []))
+
+    baseline = ler_baseline(args.baseline)
+    print(relatorio(resultados, baseline))
+
+    if args.salvar_baseline:
+        # A lista de módulos carregados só serve para a verificação; não vai para a baseline
+        salvar_baseline(
+            args.baseline, {m: {k: v for k, v in r.items() if k != "modulos"} for m, r in resultados.items()},
+            {"repeticoes": args.repeticoes},
+        )
+        print(f"\nBaseline gravada em {args.baseline}")
+    elif baseline is not None:
+        falhas += comparar(resultados, baseline, args.tolerancia)
+
+    if falhas:
+        print("\nProblemas de importação:")
+        for falha in falhas:
+            print(f"  - {falha}")
+        return 1
+    print("\nImportações dentro do esperado")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
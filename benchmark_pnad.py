@@ -0,0 +1,535 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from database import carregar_config
+
+logger = logging.getLogger(__name__)
+# As constantes abaixo vêm do config.env
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+BENCH_BASELINE_PATH = os.getenv('BENCH_BASELINE_PATH', 'bench_baseline.json')
+BENCH_TOLERANCIA = float(os.getenv('BENCH_TOLERANCIA', 0.2))  # Piora aceitável antes de acusar regressão
+BENCH_REPETICOES = int(os.getenv('BENCH_REPETICOES', 3))
+
+UFS = [
+    (11, "RO", "Rondônia", 1), (12, "AC", "Acre", 1), (13, "AM", "Amazonas", 1), (15, "PA", "Pará", 1),
+    (21, "MA", "Maranhão", 2), (23, "CE", "Ceará", 2), (26, "PE", "Pernambuco", 2), (29, "BA", "Bahia", 2),
+    (31, "MG", "Minas Gerais", 3), (33, "RJ", "Rio de Janeiro", 3), (35, "SP", "São Paulo", 3),
+    (41, "PR", "Paraná", 4), (43, "RS", "Rio Grande do Sul", 4), (50, "MS", "Mato Grosso do Sul", 5),
+]
+REGIOES = {1: ("N", "Norte"), 2: ("NE", "Nordeste"), 3: ("SE", "Sudeste"), 4: ("S", "Sul"), 5: ("CO", "Centro-Oeste")}
+
+
+# ------------------------------
+# Payloads sintéticos
+# ------------------------------
+def payload_sidra(periodos=12, territorios=27, variaveis=10, semente=0):
+    """
+    Lista no formato da API /values do SIDRA: primeira linha é o cabeçalho,
+    uma linha por variável × período × território.
+    """
+    aleatorio = random.Random(semente)
+    cabecalho = {
+        "NC": "Nível Territorial (Código)", "NN": "Nível Territorial", "MC": "Unidade de Medida (Código)",
+        "MN": "Unidade de Medida", "V": "Valor", "D1C": "Variável (Código)", "D1N": "Variável",
+        "D2C": "Trimestre (Código)", "D2N": "Trimestre", "D3C": "Unidade da Federação (Código)",
+        "D3N": "Unidade da Federação",
+    }
+    linhas = [cabecalho]
+    for v in range(variaveis):
+        nome_variavel = f"Pessoas de 14 anos ou mais de idade, ocupação {v} (Mil pessoas)"
+        for p in range(periodos):
+            ano, trimestre = 2012 + p // 4, p % 4 + 1
+            for t in range(territorios):
+                valor = "..." if aleatorio.random() < 0.01 else f"{aleatorio.uniform(0, 50000):.1f}"
+                linhas.append({
+                    "NC": "3", "NN": "Unidade da Federação", "MC": "1", "MN": "Mil pessoas", "V": valor,
+                    "D1C": str(4090 + v), "D1N": nome_variavel,
+                    "D2C": f"{ano}0{trimestre}", "D2N": f"{trimestre}º trimestre {ano}",
+                    "D3C": str(11 + t), "D3N": f"Território {t}",
+                })
+    return linhas
+
+
+def payload_localidades(quantidade=5570, semente=0):
+    """Lista no formato /api/v1/localidades/municipios"""
+    aleatorio = random.Random(semente)
+    municipios = []
+    for i in range(quantidade):
+        uf_id, uf_sigla, uf_nome, regiao_id = UFS[i % len(UFS)]
+        regiao_sigla, regiao_nome = REGIOES[regiao_id]
+        codigo = uf_id * 100000 + i
+        municipios.append({
+            "id": codigo,
+            "nome": f"Município {i} {aleatorio.choice(['do Norte', 'do Sul', 'Novo', 'Velho'])}",
+            "microrregiao": {
+                "id": uf_id * 1000 + i % 30,
+                "nome": f"Microrregião {i % 30}",
+                "mesorregiao": {
+                    "id": uf_id * 100 + i % 5,
+                    "nome": f"Mesorregião {i % 5}",
+                    "UF": {
+                        "id": uf_id, "sigla": uf_sigla, "nome": uf_nome,
+                        "regiao": {"id": regiao_id, "sigla": regiao_sigla, "nome": regiao_nome},
+                    },
+                },
+            },
+        })
+    return municipios
+
+
+def payload_geojson(feicoes=500, vertices=64, semente=0):
+    """FeatureCollection com polígonos aproximadamente circulares"""
+    import math
+    aleatorio = random.Random(semente)
+    features = []
+    for i in range(feicoes):
+        cx, cy = aleatorio.uniform(-74, -34), aleatorio.uniform(-33, 5)
+        raio = aleatorio.uniform(0.05, 0.5)
+        anel = [
+            [round(cx + raio * math.cos(2 * math.pi * k / vertices), 6),
+             round(cy + raio * math.sin(2 * math.pi * k / vertices), 6)]
+            for k in range(vertices)
+        ]
+        anel.append(anel[0])
+        features.append({
+            "type": "Feature",
+            "properties": {"codarea": str(1100000 + i)},
+            "geometry": {"type": "Polygon", "coordinates": [anel]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def propriedades_tratamento(localidades):
+    """Strings JSON como as gravadas em ibge_localidades.propriedades (com UF e região)"""
+    propriedades = []
+    for municipio in localidades:
+        uf = municipio["microrregiao"]["mesorregiao"]["UF"]
+        props = dict(municipio, geo_level="N6", UF=uf, data_extracao="2024-01-01 00:00:00")
+        propriedades.append(json.dumps(props, ensure_ascii=False))
+    return propriedades
+
+
+# ------------------------------
+# Banco substituto
+# ------------------------------
+class CursorSubstituto:
+    def __init__(self, banco):
+        self.banco = banco
+
+    def execute(self, sql, *parametros):
+        self.banco.ida_e_volta(1)
+        return self
+
+    def executemany(self, sql, registros):
+        registros = list(registros)
+        self.banco.ida_e_volta(len(registros))
+        return self
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class BancoSubstituto:
+    """
+    Conexão no lugar do SQL Server: não guarda nada, só conta idas e voltas
+    e linhas enviadas. `latencia_ms` simula o custo de cada ida e volta,
+    o que deixa visível a diferença entre inserir linha a linha e em lote.
+    """
+
+    def __init__(self, latencia_ms=0.0):
+        self.latencia = latencia_ms / 1000
+        self.idas_e_voltas = 0
+        self.linhas = 0
+
+    def ida_e_volta(self, linhas):
+        self.idas_e_voltas += 1
+        self.linhas += linhas
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    # Interface de conexão pyodbc usada pelo projeto
+    def cursor(self):
+        return CursorSubstituto(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def armazenamento_substituto(latencia_ms=0.0):
+    """Backend de armazenamento.py que entrega sempre o mesmo BancoSubstituto"""
+    from armazenamento import Armazenamento, ArmazenamentoSqlServer, DB_LOTE_INSERCAO, _linhas
+
+    class ArmazenamentoSubstituto(Armazenamento):
+        nome = "substituto"
+        TIPOS = ArmazenamentoSqlServer.TIPOS
+        TEXTO_LIMITADO = ArmazenamentoSqlServer.TEXTO_LIMITADO
+
+        def __init__(self):
+            self.banco = BancoSubstituto(latencia_ms)
+            self.colunas = {}  # Colunas criadas por tabela, para colunas_existentes
+
+        def conectar(self):
+            return self.banco
+
+        def criar_tabela(self, cursor, tabela, colunas, coluna_criacao="data_criacao"):
+            cursor.execute("CREATE TABLE")
+            self.colunas.setdefault(tabela, ["id", *(coluna for coluna, _ in colunas), coluna_criacao])
+
+        def garantir_colunas(self, cursor, tabela, colunas):
+            existentes = self.colunas.setdefault(tabela, [])
+            existentes += [coluna for coluna, _ in colunas if coluna not in existentes]
+
+        def colunas_existentes(self, cursor, tabela):
+            return list(self.colunas.get(tabela, []))
+
+        def inserir_dataframe(self, conn, tabela, df, lote=DB_LOTE_INSERCAO):
+            # Mesmo padrão do SQL Server: um executemany por lote
+            linhas = _linhas(df)
+            for i in range(0, len(linhas), lote):
+                conn.cursor().executemany("INSERT", linhas[i:i + lote])
+            return len(linhas)
+
+    return ArmazenamentoSubstituto()
+
+
+def criar_backend(nome, latencia_ms=0.0, diretorio=None):
+    """
+    "substituto" (padrão, sem banco) ou um backend embutido de verdade
+    ("sqlite", "duckdb") em um arquivo temporário.
+    """
+    if nome == "substituto":
+        return armazenamento_substituto(latencia_ms)
+    import tempfile
+    from armazenamento import BACKENDS
+    diretorio = diretorio or tempfile.mkdtemp(prefix="bench_pnad_")
+    return BACKENDS[nome](os.path.join(diretorio, f"bench.{nome}"))
+
+
+@contextmanager
+def usando(backend):
+    """Usa `backend` como armazenamento durante o bloco"""
+    from armazenamento import usar_armazenamento
+    anterior = usar_armazenamento(backend)
+    try:
+        yield backend
+    finally:
+        usar_armazenamento(anterior)
+
+
+# ------------------------------
+# Casos de benchmark
+# ------------------------------
+class Caso:
+    """
+    preparar() monta a entrada (fora da medição) e devolve o número de
+    linhas processadas; executar(entrada) é a parte medida.
+    """
+
+    def __init__(self, nome, preparar, executar, unidade="linhas"):
+        self.nome = nome
+        self.preparar = preparar
+        self.executar = executar
+        self.unidade = unidade
+
+
+def casos_padrao(periodos, territorios, variaveis, municipios, feicoes, backend):
+    import pandas as pd
+
+    estado = {}
+
+    def df_sidra():
+        if "sidra" not in estado:
+            dados = payload_sidra(periodos, territorios, variaveis)
+            df = pd.DataFrame(dados[1:], columns=list(dados[0].keys()))
+            df["Tabela_ID"] = "4094"
+            df["Data_Extracao"] = pd.Timestamp("2024-01-01")
+            df["Nivel_Geografico"] = "n3"
+            estado["sidra"] = df
+        return estado["sidra"]
+
+    def df_pivotado():
+        if "pivotado" not in estado:
+            from api_PNDA import pivot_sidra_data
+            estado["pivotado"] = pivot_sidra_data(df_sidra().copy())
+        return estado["pivotado"]
+
+    def bytes_sidra():
+        if "bytes_sidra" not in estado:
+            estado["bytes_sidra"] = json.dumps(payload_sidra(periodos, territorios, variaveis)).encode('utf-8')
+        return estado["bytes_sidra"]
+
+    # Decodificação do payload como em get_sidra_table
+    def preparar_decode():
+        return bytes_sidra(), len(df_sidra())
+
+    def executar_decode(corpo):
+        dados = json.loads(corpo)
+        pd.DataFrame(dados[1:], columns=dados[0])
+
+    def executar_decode_compacto(corpo):
+        from memoria_compacta import dataframe_sidra
+        dados = json.loads(corpo)
+        dataframe_sidra(dados, {"Tabela_ID": "4094", "Data_Extracao": pd.Timestamp("2024-01-01"), "Nivel_Geografico": "n3"})
+
+    def preparar_pivot():
+        return df_sidra(), len(df_sidra())
+
+    def executar_pivot(df):
+        from api_PNDA import pivot_sidra_data
+        pivot_sidra_data(df.copy())
+
+    def preparar_pivot_compacto():
+        from memoria_compacta import compactar_sidra
+        return compactar_sidra(df_sidra()), len(df_sidra())
+
+    def preparar_normalize():
+        nomes = [f"Variável {v} — Pessoas ocupadas (Mil pessoas) %{v % 7}" for v in range(variaveis)]
+        colunas = (nomes + ["D2N", "D3N", "Tabela_ID", "Data_Extracao", "Nivel_Geografico"]) * max(1, 2000 // (variaveis + 5))
+        return colunas, len(colunas)
+
+    def executar_normalize(colunas):
+        from api_PNDA import normalize_column_names
+        normalize_column_names(colunas)
+
+    def preparar_propriedades():
+        propriedades = propriedades_tratamento(payload_localidades(municipios))
+        return propriedades, len(propriedades)
+
+    def executar_propriedades(propriedades):
+        from tratamento_dados import TratamentoDadosIBGE
+        tratamento = TratamentoDadosIBGE()
+        for props in propriedades:
+            tratamento.processar_propriedades(props)
+
+    def preparar_insert_pnad():
+        import api_PNDA
+        with usando(backend):
+            api_PNDA.create_dynamic_table("pnad_pivoted_bench", df_pivotado())
+        return df_pivotado(), len(df_pivotado())
+
+    def executar_insert_pnad(df):
+        import api_PNDA
+        with usando(backend):
+            api_PNDA.insert_data_to_sql(df.copy(), "pnad_pivoted_bench")
+
+    def tabelas_ibge():
+        import api_IBGE
+        with usando(backend):
+            api_IBGE.create_ibge_tables()
+
+    def preparar_insert_localidades():
+        tabelas_ibge()
+        df = pd.DataFrame(payload_localidades(municipios))
+        df["geo_level"] = "N6"
+        df["data_extracao"] = pd.Timestamp("2024-01-01")
+        return df, len(df)
+
+    def executar_insert_localidades(df):
+        import api_IBGE
+        with usando(backend):
+            api_IBGE.insert_localidades_to_sql(df)
+
+    def preparar_insert_malha():
+        import geopandas as gpd
+        tabelas_ibge()
+        gdf = gpd.GeoDataFrame.from_features(payload_geojson(feicoes)["features"])
+        gdf["geo_level"] = "N6"
+        gdf["codigo_ibge"] = gdf["codarea"]
+        gdf["data_extracao"] = pd.Timestamp("2024-01-01")
+        return gdf, len(gdf)
+
+    def executar_insert_malha(gdf):
+        import api_IBGE
+        with usando(backend):
+            api_IBGE.insert_malha_to_sql(gdf)
+
+    return [
+        Caso("decode_sidra", preparar_decode, executar_decode),
+        Caso("decode_sidra_compacto", preparar_decode, executar_decode_compacto),
+        Caso("pivot_sidra_data", preparar_pivot, executar_pivot),
+        Caso("pivot_sidra_compacto", preparar_pivot_compacto, executar_pivot),
+        Caso("normalize_column_names", preparar_normalize, executar_normalize, "colunas"),
+        Caso("processar_propriedades", preparar_propriedades, executar_propriedades),
+        Caso("insert_pnad", preparar_insert_pnad, executar_insert_pnad),
+        Caso("insert_localidades", preparar_insert_localidades, executar_insert_localidades),
+        Caso("insert_malha", preparar_insert_malha, executar_insert_malha),
+    ]
+
+
+# ------------------------------
+# Execução e comparação
+# ------------------------------
+def medir(caso, repeticoes=BENCH_REPETICOES):
+    """
+    Roda o caso `repeticoes` vezes e fica com o melhor tempo (menos ruído
+    do sistema); o pico de memória vem de uma rodada extra com tracemalloc,
+    para o rastreamento não inflar os tempos.
+    """
+    entrada, linhas = caso.preparar()
+    tempos = []
+    for _ in range(max(1, repeticoes)):
+        gc.collect()
+        inicio = time.perf_counter()
+        caso.executar(entrada)
+        tempos.append(time.perf_counter() - inicio)
+
+    gc.collect()
+    ja_rastreando = tracemalloc.is_tracing()
+    if not ja_rastreando:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    caso.executar(entrada)
+    pico = tracemalloc.get_traced_memory()[1] - base
+    if not ja_rastreando:
+        tracemalloc.stop()
+
+    melhor = min(tempos)
+    return {
+        "linhas": linhas,
+        "unidade": caso.unidade,
+        "melhor_s": round(melhor, 6),
+        "mediana_s": round(sorted(tempos)[len(tempos) // 2], 6),
+        "vazao": round(linhas / melhor, 1) if melhor else None,
+        "pico_memoria_mb": round(pico / (1024 * 1024), 3),
+    }
+
+
+def executar_benchmarks(casos, filtro=None, repeticoes=BENCH_REPETICOES):
+    resultados = {}
+    for caso in casos:
+        if filtro and not any(f in caso.nome for f in filtro):
+            continue
+        try:
+            resultados[caso.nome] = medir(caso, repeticoes)
+        except ImportError as e:
+            logger.warning(f"{caso.nome} ignorado: dependência ausente ({e})")
+    return resultados
+
+
+def comparar(resultados, baseline, tolerancia=BENCH_TOLERANCIA):
+    """Lista de regressões: vazão abaixo ou memória acima da baseline além da tolerância"""
+    regressoes = []
+    for nome, atual in resultados.items():
+        anterior = baseline.get("casos", {}).get(nome)
+        if not anterior or anterior.get("linhas") != atual["linhas"]:
+            continue  # Sem baseline ou com outro tamanho de entrada: não comparável
+        if anterior.get("vazao") and atual["vazao"] is not None and atual["vazao"] < anterior["vazao"] * (1 - tolerancia):
+            regressoes.append(f"{nome}: vazão {atual['vazao']:.0f} < {anterior['vazao']:.0f} {atual['unidade']}/s")
+        if anterior.get("pico_memoria_mb") and atual["pico_memoria_mb"] > anterior["pico_memoria_mb"] * (1 + tolerancia):
+            regressoes.append(f"{nome}: pico de memória {atual['pico_memoria_mb']:.1f} > {anterior['pico_memoria_mb']:.1f} MB")
+    return regressoes
+
+
+def ler_baseline(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def salvar_baseline(caminho, resultados, parametros):
+    dados = {
+        "gerado_em": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "maquina": platform.node(),
+        "parametros": parametros,
+        "casos": resultados,
+    }
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temporario, caminho)
+
+
+def relatorio(resultados, baseline=None):
+    casos_base = (baseline or {}).get("casos", {})
+    linhas = [f"{'caso':<24} {'linhas':>9} {'melhor':>10} {'vazão/s':>12} {'memória':>10} {'vs baseline':>12}"]
+    for nome, r in resultados.items():
+        anterior = casos_base.get(nome)
+        variacao = "-"
+        if anterior and anterior.get("vazao") and anterior.get("linhas") == r["linhas"]:
+            variacao = f"{(r['vazao'] / anterior['vazao'] - 1) * 100:+.1f}%"
+        linhas.append(
+            f"{nome:<24} {r['linhas']:>9} {r['melhor_s'] * 1000:>8.1f}ms {r['vazao'] or 0:>12.0f} "
+            f"{r['pico_memoria_mb']:>8.1f}MB {variacao:>12}"
+        )
+    return "\n".join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de extração → pivot → carga com dados sintéticos")
+    parser.add_argument("casos", nargs="*", help="Filtra casos pelo nome (padrão: todos)")
+    parser.add_argument("--periodos", type=int, default=12)
+    parser.add_argument("--territorios", type=int, default=27)
+    parser.add_argument("--variaveis", type=int, default=10)
+    parser.add_argument("--municipios", type=int, default=5570)
+    parser.add_argument("--feicoes", type=int, default=500)
+    parser.add_argument("--backend", choices=["substituto", "sqlite", "duckdb"], default="substituto",
+                        help="Onde os inserts gravam (substituto: sem banco, só conta idas e voltas)")
+    parser.add_argument("--latencia-banco", type=float, default=0.0, help="Latência simulada por ida e volta ao banco (ms)")
+    parser.add_argument("--repeticoes", type=int, default=BENCH_REPETICOES)
+    parser.add_argument("--baseline", default=BENCH_BASELINE_PATH)
+    parser.add_argument("--tolerancia", type=float, default=BENCH_TOLERANCIA)
+    parser.add_argument("--salvar-baseline", action="store_true", help="Grava os resultados como nova baseline")
+    args = parser.parse_args(argv)
+
+    # Os módulos medidos logam em INFO a cada chamada
+    logging.getLogger().setLevel(logging.WARNING)
+
+    parametros = {
+        "periodos": args.periodos, "territorios": args.territorios, "variaveis": args.variaveis,
+        "municipios": args.municipios, "feicoes": args.feicoes, "latencia_banco_ms": args.latencia_banco, "backend": args.backend,
+    }
+    backend = criar_backend(args.backend, args.latencia_banco)
+    casos = casos_padrao(args.periodos, args.territorios, args.variaveis, args.municipios, args.feicoes, backend)
+    resultados = executar_benchmarks(casos, args.casos, args.repeticoes)
+    baseline = ler_baseline(args.baseline)
+    print(relatorio(resultados, baseline))
+
+    if args.salvar_baseline:
+        salvar_baseline(args.baseline, resultados, parametros)
+        print(f"\nBaseline gravada em {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\nSem baseline em {args.baseline} (use --salvar-baseline)")
+        return 0
+    regressoes = comparar(resultados, baseline, args.tolerancia)
+    if regressoes:
+        print(f"\nRegressões (tolerância {args.tolerancia:.0%}):")
+        for regressao in regressoes:
+            print(f"  - {regressao}")
+        return 1
+    print("\nSem regressões em relação à baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
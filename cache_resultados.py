@@ -0,0 +1,91 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class EntradaCache:
+    __slots__ = ("corpo", "etag", "expira", "tag")
+
+    def __init__(self, corpo, etag, expira, tag):
+        self.corpo = corpo
+        self.etag = etag
+        self.expira = expira
+        self.tag = tag
+
+
+class CacheResultados:
+    """
+    Cache LRU com TTL para respostas já serializadas.
+
+    Cada entrada guarda o corpo em bytes e o ETag, então um acerto não
+    consulta o banco nem serializa nada de novo. As entradas são marcadas
+    com uma tag (o id da tabela PNAD); invalidar(tag) remove todas as
+    entradas daquela tabela e avança a versão da tag, o que também impede
+    que uma consulta iniciada antes da invalidação grave um resultado velho.
+    """
+
+    def __init__(self, max_itens=1024, ttl=300):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._versoes = {}
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    @staticmethod
+    def calcular_etag(corpo, versao=0):
+        return '"' + hashlib.sha1(corpo + str(versao).encode()).hexdigest() + '"'
+
+    def versao(self, tag):
+        return self._versoes.get(tag, 0)
+
+    def obter(self, chave):
+        with self._lock:
+            entrada = self._itens.get(chave)
+            if entrada is None:
+                self.falhas += 1
+                return None
+            if entrada.expira < time.monotonic():
+                del self._itens[chave]
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return entrada
+
+    def gravar(self, chave, corpo, tag, versao):
+        """Grava a resposta se a tag não foi invalidada desde `versao`"""
+        etag = self.calcular_etag(corpo, versao)
+        entrada = EntradaCache(corpo, etag, time.monotonic() + self.ttl, tag)
+        with self._lock:
+            if self._versoes.get(tag, 0) != versao:
+                return entrada
+            self._itens[chave] = entrada
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return entrada
+
+    def invalidar(self, tag):
+        with self._lock:
+            self._versoes[tag] = self._versoes.get(tag, 0) + 1
+            for chave in [c for c, e in self._itens.items() if e.tag == tag]:
+                del self._itens[chave]
+
+    def limpar(self):
+        with self._lock:
+            for tag in list(self._versoes):
+                self._versoes[tag] += 1
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "ttl": self.ttl,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+            }
@@ -0,0 +1,230 @@
+import re
+import io
+import csv
+import json
+import base64
+import hashlib
+import asyncio
+
+# ------------------------------
+# Constantes
+# ------------------------------
+FORMATOS = ("json", "ndjson", "csv")
+TIPOS_MIDIA = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+TAMANHO_LOTE = 500
+IDENTIFICADOR_VALIDO = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,127}$')
+
+
+class ErroConsulta(ValueError):
+    """Parâmetros de consulta inválidos (mapeado para HTTP 400)"""
+
+
+# ------------------------------
+# Tokens de paginação por chave (keyset)
+# ------------------------------
+def _hash_consulta(query):
+    return hashlib.sha1(query.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def gerar_token(query, chave, ultimo_valor):
+    """Codifica o último valor da chave em um token opaco"""
+    dados = {"q": _hash_consulta(query), "c": chave, "v": ultimo_valor}
+    bruto = json.dumps(dados, default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+
+def ler_token(token, query, chave):
+    """Decodifica o token e confere se ele pertence à mesma consulta/chave"""
+    try:
+        bruto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        dados = json.loads(bruto)
+    except (ValueError, TypeError):
+        raise ErroConsulta("Token de paginação inválido")
+    if dados.get("q") != _hash_consulta(query) or dados.get("c") != chave:
+        raise ErroConsulta("Token de paginação não corresponde a esta consulta")
+    return dados.get("v")
+
+
+def montar_consulta(query, limite, chave=None, token=None):
+    """
+    Monta o SQL final e os parâmetros.
+
+    Sem chave, a consulta é executada como veio (o limite é aplicado na
+    leitura). Com chave, ela vira uma subconsulta ordenada pela chave e
+    filtrada a partir do último valor do token:
+        SELECT TOP (n) * FROM (<query>) AS q WHERE [chave] > ? ORDER BY [chave]
+    """
+    if not chave:
+        if token:
+            raise ErroConsulta("Paginação por token exige o parâmetro 'chave'")
+        return query, ()
+
+    if not IDENTIFICADOR_VALIDO.match(chave):
+        raise ErroConsulta(f"Nome de coluna inválido para chave: {chave}")
+
+    sql = f"SELECT TOP ({int(limite)}) * FROM ({query}) AS q"
+    params = ()
+    if token:
+        sql += f" WHERE q.[{chave}] > ?"
+        params = (ler_token(token, query, chave),)
+    sql += f" ORDER BY q.[{chave}]"
+    return sql, params
+
+
+# ------------------------------
+# Serialização incremental
+# ------------------------------
+def _valor_json(valor):
+    if isinstance(valor, (bytes, bytearray)):
+        return valor.hex()
+    return str(valor)
+
+
+class SerializadorLinhas:
+    """Converte lotes de linhas em pedaços de texto do formato escolhido"""
+
+    def __init__(self, formato, colunas):
+        self.formato = formato
+        self.colunas = colunas
+        self._primeira = True
+
+    def inicio(self):
+        if self.formato == "json":
+            return '{"status":"success","colunas":' + json.dumps(self.colunas, ensure_ascii=False) + ',"results":['
+        if self.formato == "csv":
+            return self._csv([self.colunas])
+        return ""
+
+    def lote(self, linhas):
+        if self.formato == "csv":
+            return self._csv(linhas)
+        if self.formato == "ndjson":
+            return "".join(
+                json.dumps(dict(zip(self.colunas, linha)), default=_valor_json, ensure_ascii=False) + "\n"
+                for linha in linhas
+            )
+        partes = []
+        for linha in linhas:
+            partes.append(("" if self._primeira else ",") + json.dumps(list(linha), default=_valor_json, ensure_ascii=False))
+            self._primeira = False
+        return "".join(partes)
+
+    def fim(self, total, truncado, proximo_token):
+        meta = {"linhas": total, "truncado": truncado, "proximo_token": proximo_token}
+        if self.formato == "json":
+            return '],' + json.dumps(meta)[1:]
+        if self.formato == "ndjson":
+            return json.dumps({"_meta": meta}) + "\n"
+        return ""
+
+    @staticmethod
+    def _csv(linhas):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(linhas)
+        return buffer.getvalue()
+
+
+# ------------------------------
+# Execução com cursor do lado do servidor
+# ------------------------------
+class ConsultaStreaming:
+    """
+    Consulta aberta em uma conexão do pool, lida em lotes com fetchmany.
+
+    abrir() executa o SQL (erros aparecem antes da resposta começar) e
+    transmitir() é o gerador assíncrono usado pela StreamingResponse. A
+    conexão fica presa à consulta até o fim da transmissão e volta ao pool
+    no finally, inclusive quando o cliente desconecta no meio.
+    """
+
+    def __init__(self, pool, executor, query, formato="json", limite=1000,
+                 chave=None, token=None, timeout=30):
+        if formato not in FORMATOS:
+            raise ErroConsulta(f"Formato inválido. Use: {', '.join(FORMATOS)}")
+        self.pool = pool
+        self.executor = executor
+        self.query = query
+        self.formato = formato
+        self.limite = int(limite)
+        self.chave = chave
+        self.timeout = timeout
+        self.sql, self.params = montar_consulta(query, self.limite, chave, token)
+        self.conn = None
+        self.cursor = None
+        self.colunas = []
+
+    async def _no_executor(self, funcao, *args):
+        futuro = asyncio.get_running_loop().run_in_executor(self.executor, funcao, *args)
+        try:
+            return await asyncio.wait_for(futuro, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if self.cursor is not None:
+                try:
+                    self.cursor.cancel()
+                except Exception:
+                    pass
+            raise
+
+    def _executar(self):
+        self.conn = self.pool.obter(self.timeout)
+        self.conn.timeout = max(1, int(self.timeout))
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(self.sql, *self.params)
+        self.colunas = [coluna[0] for coluna in self.cursor.description or []]
+
+    async def abrir(self):
+        try:
+            await self._no_executor(self._executar)
+        except BaseException:
+            await self.fechar(descartar=True)
+            raise
+        if self.chave and self.chave not in self.colunas:
+            await self.fechar()
+            raise ErroConsulta(f"Coluna de chave '{self.chave}' não está no resultado")
+        return self
+
+    async def fechar(self, descartar=False):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            if self.cursor is not None:
+                self.cursor.close()
+        except Exception:
+            descartar = True
+        self.cursor = None
+        self.pool.devolver(conn, descartar=descartar)
+
+    async def transmitir(self):
+        serializador = SerializadorLinhas(self.formato, self.colunas)
+        indice_chave = self.colunas.index(self.chave) if self.chave else None
+        total = 0
+        ultima = None
+        sucesso = False
+        try:
+            yield serializador.inicio()
+            while total < self.limite:
+                linhas = await self._no_executor(
+                    self.cursor.fetchmany, min(TAMANHO_LOTE, self.limite - total)
+                )
+                if not linhas:
+                    break
+                total += len(linhas)
+                ultima = linhas[-1]
+                yield serializador.lote(linhas)
+
+            truncado = False
+            proximo_token = None
+            if total >= self.limite:
+                if self.chave:
+                    proximo_token = gerar_token(self.query, self.chave, ultima[indice_chave])
+                else:
+                    truncado = bool(await self._no_executor(self.cursor.fetchmany, 1))
+            yield serializador.fim(total, truncado, proximo_token)
+            sucesso = True
+        finally:
+            await self.fechar(descartar=not sucesso)
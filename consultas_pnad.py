@@ -0,0 +1,180 @@
+import re
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+# ------------------------------
+# Constantes
+# ------------------------------
+PREFIXO_TABELA = "pnad_pivoted_"
+COLUNAS_FIXAS = {"id", "d2n", "d3n", "tabela_id", "data_extracao", "nivel_geografico", "data_criacao"}
+TABELA_ID_VALIDO = re.compile(r'^\d{1,10}$')
+
+
+# ------------------------------
+# Modelos de resposta
+# ------------------------------
+class RegistroPNAD(BaseModel):
+    periodo: str
+    localidade: str
+    nivel_geografico: Optional[str] = None
+    valores: Dict[str, Optional[float]]
+
+
+class RespostaPNAD(BaseModel):
+    tabela_id: str
+    total: int
+    registros: List[RegistroPNAD]
+
+
+class RespostaTabelas(BaseModel):
+    tabelas: List[str]
+
+
+class RespostaVariaveis(BaseModel):
+    tabela_id: str
+    variaveis: List[str]
+
+
+class LocalidadeTratada(BaseModel):
+    codigo_ibge: Optional[str] = None
+    nome: Optional[str] = None
+    nivel_geografico: Optional[str] = None
+    sigla: Optional[str] = None
+    regiao_id: Optional[int] = None
+    regiao_sigla: Optional[str] = None
+    regiao_nome: Optional[str] = None
+    uf_id: Optional[int] = None
+    uf_sigla: Optional[str] = None
+    uf_nome: Optional[str] = None
+    municipio_id: Optional[int] = None
+    municipio_nome: Optional[str] = None
+    regiao_metropolitana: Optional[str] = None
+
+
+class RespostaLocalidades(BaseModel):
+    total: int
+    localidades: List[LocalidadeTratada]
+
+
+class ErroFiltro(ValueError):
+    """Filtro inválido (tabela inexistente, variável desconhecida...)"""
+
+
+# ------------------------------
+# Consultas (recebem um cursor já aberto)
+# ------------------------------
+def validar_tabela_id(tabela_id):
+    if not TABELA_ID_VALIDO.match(str(tabela_id)):
+        raise ErroFiltro(f"Id de tabela inválido: {tabela_id}")
+    return f"{PREFIXO_TABELA}{tabela_id}"
+
+
+def listar_tabelas_pnad(cursor):
+    """Retorna os ids das tabelas pnad_pivoted_* existentes"""
+    cursor.execute("""
+        SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_NAME LIKE 'pnad[_]pivoted[_]%'
+        ORDER BY TABLE_NAME
+    """)
+    return [row[0][len(PREFIXO_TABELA):] for row in cursor.fetchall()]
+
+
+def listar_variaveis(cursor, tabela_id):
+    """Retorna as colunas de variáveis (tudo que não é coluna de controle)"""
+    nome_tabela = validar_tabela_id(tabela_id)
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = ?
+        ORDER BY ORDINAL_POSITION
+    """, (nome_tabela,))
+    colunas = [row[0] for row in cursor.fetchall()]
+    if not colunas:
+        raise ErroFiltro(f"Tabela {nome_tabela} não encontrada")
+    return [c for c in colunas if c.lower() not in COLUNAS_FIXAS]
+
+
+def _filtro_in(coluna, valores, condicoes, params):
+    if valores:
+        condicoes.append(f"{coluna} IN ({', '.join('?' for _ in valores)})")
+        params.extend(valores)
+
+
+def consultar_dados_pnad(cursor, tabela_id, periodos=None, localidades=None, variaveis=None, limite=10000):
+    """
+    Lê uma tabela pnad_pivoted_* filtrando por período (d2n), localidade
+    (d3n) e variáveis (colunas). Nomes de variáveis são validados contra o
+    catálogo da tabela antes de entrar no SQL.
+    """
+    nome_tabela = validar_tabela_id(tabela_id)
+    disponiveis = listar_variaveis(cursor, tabela_id)
+    if variaveis:
+        desconhecidas = sorted(set(variaveis) - set(disponiveis))
+        if desconhecidas:
+            raise ErroFiltro(f"Variáveis inexistentes na tabela {tabela_id}: {', '.join(desconhecidas)}")
+        selecionadas = [v for v in disponiveis if v in set(variaveis)]
+    else:
+        selecionadas = disponiveis
+
+    condicoes, params = [], []
+    _filtro_in("d2n", periodos, condicoes, params)
+    _filtro_in("d3n", localidades, condicoes, params)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    colunas_sql = ", ".join(f"[{v}]" for v in selecionadas)
+
+    cursor.execute(f"""
+        SELECT TOP ({int(limite)}) d2n, d3n, nivel_geografico{', ' + colunas_sql if colunas_sql else ''}
+        FROM {nome_tabela}
+        {where}
+        ORDER BY d2n, d3n
+    """, params)
+
+    registros = []
+    for row in cursor.fetchall():
+        registros.append(RegistroPNAD(
+            periodo=str(row[0]),
+            localidade=str(row[1]),
+            nivel_geografico=row[2],
+            valores={v: (float(x) if x is not None else None) for v, x in zip(selecionadas, row[3:])},
+        ))
+    return RespostaPNAD(tabela_id=str(tabela_id), total=len(registros), registros=registros)
+
+
+def consultar_localidades(cursor, nivel=None, uf_sigla=None, regiao_sigla=None, limite=10000):
+    """Lê ibge_localidades_tratado com filtros opcionais"""
+    campos = list(LocalidadeTratada.model_fields)
+    condicoes, params = [], []
+    _filtro_in("nivel_geografico", [nivel] if nivel else None, condicoes, params)
+    _filtro_in("uf_sigla", [uf_sigla] if uf_sigla else None, condicoes, params)
+    _filtro_in("regiao_sigla", [regiao_sigla] if regiao_sigla else None, condicoes, params)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+    cursor.execute(f"""
+        SELECT TOP ({int(limite)}) {', '.join(campos)}
+        FROM ibge_localidades_tratado
+        {where}
+        ORDER BY nivel_geografico, codigo_ibge
+    """, params)
+    localidades = [LocalidadeTratada(**dict(zip(campos, row))) for row in cursor.fetchall()]
+    return RespostaLocalidades(total=len(localidades), localidades=localidades)
+
+
+def versoes_cargas(cursor):
+    """Último id de carga bem-sucedida por tabela em pnad_log_extracao"""
+    cursor.execute("""
+        SELECT tabela_id, MAX(id)
+        FROM pnad_log_extracao
+        WHERE status = 'SUCESSO'
+        GROUP BY tabela_id
+    """)
+    return {str(row[0]): row[1] for row in cursor.fetchall()}
+
+
+def versoes_cargas_ibge(cursor):
+    """Último id de carga bem-sucedida por tipo (LOCALIDADES, MALHAS, TRATAMENTO) em ibge_log_extracao"""
+    cursor.execute("""
+        SELECT tipo_extracao, MAX(id)
+        FROM ibge_log_extracao
+        WHERE status = 'SUCESSO'
+        GROUP BY tipo_extracao
+    """)
+    return {str(row[0]).upper(): row[1] for row in cursor.fetchall()}
@@ -94,6 +94,68 @@ BEGIN
 END
 GO
 
+-- Tabela de agregados (região, UF e RM) atualizada após cada carga
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='pnad_agregados' AND xtype='U')
+BEGIN
+    CREATE TABLE [dbo].[pnad_agregados](
+        [id] [int] IDENTITY(1,1) NOT NULL,
+        [tabela_id] [nvarchar](50) NULL,
+        [periodo] [nvarchar](100) NULL,
+        [nivel_agregacao] [nvarchar](20) NULL,
+        [codigo] [nvarchar](50) NULL,
+        [nome] [nvarchar](255) NULL,
+        [variavel] [nvarchar](128) NULL,
+        [soma] [float] NULL,
+        [media] [float] NULL,
+        [contagem] [int] NULL,
+        [data_atualizacao] [datetime] NULL DEFAULT (GETDATE()),
+        CONSTRAINT [PK_pnad_agregados] PRIMARY KEY CLUSTERED ([id] ASC)
+    )
+    CREATE NONCLUSTERED INDEX [IX_pnad_agregados_consulta] ON [dbo].[pnad_agregados]
+    ([tabela_id] ASC, [periodo] ASC, [nivel_agregacao] ASC, [codigo] ASC)
+    INCLUDE ([variavel], [soma], [media], [contagem])
+    PRINT 'Tabela pnad_agregados criada com sucesso!'
+END
+ELSE
+BEGIN
+    PRINT 'Tabela pnad_agregados já existe.'
+END
+GO
+
+-- Fila de trabalho compartilhada pelos workers de extração (fila_distribuida.py)
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='etl_fila_trabalho' AND xtype='U')
+BEGIN
+    CREATE TABLE [dbo].[etl_fila_trabalho](
+        [id] [bigint] IDENTITY(1,1) NOT NULL,
+        [tipo] [nvarchar](30) NOT NULL,
+        [alvo] [nvarchar](50) NOT NULL,
+        [parametro] [nvarchar](400) NOT NULL DEFAULT (''),
+        [prioridade] [int] NOT NULL DEFAULT (100),
+        [status] [nvarchar](20) NOT NULL DEFAULT ('PENDENTE'),
+        [tentativas] [int] NOT NULL DEFAULT (0),
+        [max_tentativas] [int] NOT NULL DEFAULT (3),
+        [worker] [nvarchar](200) NULL,
+        [lease_ate] [datetime2] NULL,
+        [mensagem] [nvarchar](1000) NULL,
+        [criado_em] [datetime2] NOT NULL DEFAULT (SYSUTCDATETIME()),
+        [iniciado_em] [datetime2] NULL,
+        [finalizado_em] [datetime2] NULL,
+        CONSTRAINT [PK_etl_fila_trabalho] PRIMARY KEY CLUSTERED ([id] ASC)
+    )
+    CREATE NONCLUSTERED INDEX [IX_etl_fila_trabalho_proximo] ON [dbo].[etl_fila_trabalho]
+    ([status] ASC, [prioridade] ASC, [id] ASC)
+    INCLUDE ([lease_ate], [tentativas], [max_tentativas])
+    CREATE UNIQUE NONCLUSTERED INDEX [UX_etl_fila_trabalho_ativo] ON [dbo].[etl_fila_trabalho]
+    ([tipo] ASC, [alvo] ASC, [parametro] ASC)
+    WHERE [status] IN ('PENDENTE', 'EXECUTANDO')
+    PRINT 'Tabela etl_fila_trabalho criada com sucesso!'
+END
+ELSE
+BEGIN
+    PRINT 'Tabela etl_fila_trabalho já existe.'
+END
+GO
+
 -- Índices para melhorar performance
 -- Índice na tabela de ocupação
 IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_pnad_ocupacao_localidade')
@@ -148,6 +210,8 @@ PRINT '  - pnad_ocupacao (Força de trabalho)'
 PRINT '  - pnad_rendimento (Rendimentos)'
 PRINT '  - pnad_domicilios (Domicílios)'
 PRINT '  - pnad_log_extracao (Log de extrações)'
+PRINT '  - pnad_agregados (Agregados por região, UF e RM)'
+PRINT '  - etl_fila_trabalho (Fila de extração distribuída)'
 PRINT ''
 PRINT 'Agora você pode executar o script Python para extrair os dados:'
 PRINT 'python api_PNAD.py'
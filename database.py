@@ -1,12 +1,22 @@
 import os
-import pyodbc
-from dotenv import load_dotenv
+import queue
+import threading
+from contextlib import contextmanager
 
-# Carrega as variáveis de ambiente
-load_dotenv('config.env')
+_config_carregada = False
+
+
+def carregar_config():
+    """Carrega o config.env uma única vez, seja qual for o primeiro módulo a pedir"""
+    global _config_carregada
+    if not _config_carregada:
+        from dotenv import load_dotenv
+        load_dotenv('config.env')
+        _config_carregada = True
 
 class DatabaseConnection:
     def __init__(self):
+        carregar_config()
         self.server = os.getenv('DB_SERVER', 'localhost')
         self.port = os.getenv('DB_PORT', '1433')
         self.database = os.getenv('DB_DATABASE', 'LOPES')
@@ -25,6 +35,7 @@ class DatabaseConnection:
     
     def get_connection(self, database='LOPES'):
         """Cria conexão usando pyodbc com autenticação Windows"""
+        import pyodbc
         try:
             connection = pyodbc.connect(self.get_connection_string(database))
             return connection
@@ -134,6 +145,74 @@ class DatabaseConnection:
             print(f"Erro ao criar tabelas: {e}")
             return False
 
+class PoolConexoes:
+    """
+    Pool de conexões pyodbc reutilizáveis entre threads.
+
+    No máximo `tamanho` conexões ficam em uso ao mesmo tempo; quem pede uma
+    conexão além disso espera até `timeout` segundos por uma devolução.
+    Conexões que falharam durante o uso são descartadas em vez de voltarem
+    para o pool.
+    """
+
+    def __init__(self, db=None, tamanho=None, database=None):
+        self.db = db or DatabaseConnection()
+        self.database = database or self.db.database
+        self.tamanho = tamanho or int(os.getenv('DB_POOL_SIZE', '8'))
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(self.tamanho)
+
+    def obter(self, timeout=None):
+        """Retorna uma conexão livre (ou cria uma nova se houver vaga)"""
+        if not self._vagas.acquire(timeout=timeout):
+            raise TimeoutError(f"Nenhuma conexão livre no pool após {timeout}s")
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            pass
+        conn = self.db.get_connection(self.database)
+        if not conn:
+            self._vagas.release()
+            raise ConnectionError("Não foi possível conectar ao banco de dados")
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        """Devolve a conexão ao pool (ou fecha, se descartar=True)"""
+        try:
+            if descartar:
+                conn.close()
+            else:
+                conn.rollback()
+                self._livres.put(conn)
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self, timeout=None):
+        """Context manager: obtém uma conexão e devolve ao final"""
+        conn = self.obter(timeout)
+        sucesso = False
+        try:
+            yield conn
+            sucesso = True
+        finally:
+            self.devolver(conn, descartar=not sucesso)
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas"""
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                break
+            except Exception:
+                continue
+
 # Exemplo de uso
 if __name__ == "__main__":
     db = DatabaseConnection()
@@ -0,0 +1,138 @@
+import os
+import json
+import logging
+from urllib.parse import quote
+from niveis_sidra import NIVEIS_PADRAO
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+# /f/ do SIDRA: a = códigos e nomes (padrão), u = códigos e nomes só das unidades
+# territoriais, n = só nomes. "c" (só códigos) não serve: o pivot usa D1N/D2N/D3N.
+FORMATOS = ("a", "u", "n")
+CAMPOS = ("variaveis", "classificacoes", "periodos", "niveis", "territorios", "formato", "cabecalho")
+
+
+def caminho_especificacoes():
+    return os.getenv('SIDRA_ESPECIFICACOES_PATH', 'extracoes_sidra.json')
+
+
+def _lista_url(valor):
+    """"all" / 4090 / [4090, 4092] → trecho de URL ("all", "4090", "4090,4092")"""
+    if isinstance(valor, (list, tuple)):
+        return ",".join(str(v) for v in valor)
+    return str(valor)
+
+
+# ------------------------------
+# Especificação de extração de uma tabela
+# ------------------------------
+class EspecificacaoSidra:
+    """
+    Recorte declarativo de uma tabela SIDRA, compilado na URL mais estreita
+    da API de valores: só as variáveis, categorias, períodos e unidades
+    territoriais pedidas, e opcionalmente sem códigos (/f/) e sem a linha
+    de cabeçalho (/h/n).
+
+    Params:
+        tabela (str): id da tabela SIDRA
+        variaveis: "all" ou lista de ids de variáveis
+        classificacoes (dict): {id da classificação: "all" | "allxt" | [categorias]};
+            sem a classificação na URL o SIDRA devolve só a categoria Total
+        periodos (str | list): "last 3", "all", "202301-202304" ou lista de códigos
+        niveis (list): níveis territoriais, em ordem de preferência
+        territorios (dict): {nível: [códigos]} para pedir só essas unidades (padrão: all)
+        formato (str): valor de /f/ ("a", "u" ou "n"); None = padrão do SIDRA ("a")
+        cabecalho (bool): False acrescenta /h/n (a resposta vem sem a linha de descrições)
+    """
+
+    def __init__(self, tabela, variaveis="all", classificacoes=None, periodos="last 3", niveis=None,
+                 territorios=None, formato=None, cabecalho=True):
+        if formato is not None and formato not in FORMATOS:
+            raise ValueError(f"Formato SIDRA inválido para a tabela {tabela}: {formato!r} (use {', '.join(FORMATOS)})")
+        self.tabela = str(tabela)
+        self.variaveis = variaveis
+        self.classificacoes = {str(c): v for c, v in (classificacoes or {}).items()}
+        self.periodos = periodos
+        self.niveis = [n.lower() for n in niveis] if niveis else list(NIVEIS_PADRAO)
+        self.territorios = {n.lower(): v for n, v in (territorios or {}).items()}
+        self.formato = formato
+        self.cabecalho = cabecalho
+
+    def com(self, **alteracoes):
+        """Cópia com os campos informados (None mantém o valor da especificação)"""
+        campos = {campo: getattr(self, campo) for campo in CAMPOS}
+        campos.update({campo: valor for campo, valor in alteracoes.items() if valor is not None})
+        return EspecificacaoSidra(self.tabela, **campos)
+
+    def variaveis_url(self):
+        return _lista_url(self.variaveis)
+
+    def caminho(self, nivel):
+        """Caminho da API de valores (sem a URL base) para um nível territorial"""
+        nivel = nivel.lower()
+        partes = [
+            f"/values/t/{self.tabela}",
+            f"/v/{self.variaveis_url()}",
+            f"/p/{quote(_lista_url(self.periodos), safe=',-')}",
+            f"/{nivel}/{_lista_url(self.territorios.get(nivel, 'all'))}",
+        ]
+        partes += [f"/c{classificacao}/{_lista_url(categorias)}" for classificacao, categorias in self.classificacoes.items()]
+        if self.formato:
+            partes.append(f"/f/{self.formato}")
+        if not self.cabecalho:
+            partes.append("/h/n")
+        return "".join(partes)
+
+    def como_dict(self):
+        return {"tabela": self.tabela, **{campo: getattr(self, campo) for campo in CAMPOS}}
+
+    def __repr__(self):
+        return f"EspecificacaoSidra({self.como_dict()})"
+
+
+# ------------------------------
+# Arquivo de especificações
+# ------------------------------
+def carregar_especificacoes(caminho=None):
+    """
+    Lê o arquivo JSON {tabela: {campo: valor}} (SIDRA_ESPECIFICACOES_PATH).
+    Tabelas ausentes do arquivo (ou arquivo inexistente) usam a
+    especificação padrão, que gera a mesma URL de sempre (v/all, last 3).
+    Os padrões de formato e cabeçalho vêm de SIDRA_FORMATO e SIDRA_CABECALHO.
+    """
+    caminho = caminho or caminho_especificacoes()
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+    except FileNotFoundError:
+        dados = {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Especificações SIDRA ilegíveis ({caminho}), usando o padrão: {e}")
+        dados = {}
+
+    especificacoes = {}
+    for tabela, campos in dados.items():
+        desconhecidos = set(campos) - set(CAMPOS)
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos na especificação da tabela {tabela}: {sorted(desconhecidos)}")
+        especificacoes[str(tabela)] = especificacao_padrao(tabela).com(**campos)
+    return especificacoes
+
+
+def especificacao_padrao(tabela):
+    formato = os.getenv('SIDRA_FORMATO', '') or None
+    return EspecificacaoSidra(tabela, formato=formato, cabecalho=os.getenv('SIDRA_CABECALHO', '1') == '1')
+
+
+_especificacoes = None
+
+
+def especificacao_tabela(tabela):
+    """Especificação declarada para a tabela (ou a padrão)"""
+    global _especificacoes
+    if _especificacoes is None:
+        _especificacoes = carregar_especificacoes()
+    return _especificacoes.get(str(tabela)) or especificacao_padrao(tabela)
@@ -0,0 +1,404 @@
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+from database import DatabaseConnection, carregar_config
+from assinatura_conteudo import STATUS_CONCLUIDOS
+
+logger = logging.getLogger(__name__)
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+TABELA_FILA = "etl_fila_trabalho"
+FILA_LEASE_SEGUNDOS = int(os.getenv('FILA_LEASE_SEGUNDOS', 300))
+FILA_MAX_TENTATIVAS = int(os.getenv('FILA_MAX_TENTATIVAS', 3))
+FILA_ESPERA_VAZIA = float(os.getenv('FILA_ESPERA_VAZIA', 10))
+
+PENDENTE = "PENDENTE"
+EXECUTANDO = "EXECUTANDO"
+CONCLUIDO = "CONCLUIDO"
+ERRO = "ERRO"
+
+
+# ------------------------------
+# Estrutura
+# ------------------------------
+def criar_tabela_fila(cursor):
+    """
+    Uma linha por unidade de trabalho: tipo + alvo + parâmetro
+    (pnad: tabela × lote de períodos; ibge_localidades/ibge_malhas: nível × código).
+    O índice filtrado impede duas unidades ativas iguais.
+    """
+    cursor.execute(f"""
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{TABELA_FILA}' AND xtype='U')
+    BEGIN
+        CREATE TABLE {TABELA_FILA} (
+            id BIGINT IDENTITY(1,1) PRIMARY KEY,
+            tipo NVARCHAR(30) NOT NULL,
+            alvo NVARCHAR(50) NOT NULL,
+            parametro NVARCHAR(400) NOT NULL DEFAULT '',
+            prioridade INT NOT NULL DEFAULT 100,
+            status NVARCHAR(20) NOT NULL DEFAULT 'PENDENTE',
+            tentativas INT NOT NULL DEFAULT 0,
+            max_tentativas INT NOT NULL DEFAULT 3,
+            worker NVARCHAR(200) NULL,
+            lease_ate DATETIME2 NULL,
+            mensagem NVARCHAR(1000) NULL,
+            criado_em DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+            iniciado_em DATETIME2 NULL,
+            finalizado_em DATETIME2 NULL
+        )
+        CREATE NONCLUSTERED INDEX IX_{TABELA_FILA}_proximo
+            ON {TABELA_FILA} (status, prioridade, id) INCLUDE (lease_ate, tentativas, max_tentativas)
+        CREATE UNIQUE NONCLUSTERED INDEX UX_{TABELA_FILA}_ativo
+            ON {TABELA_FILA} (tipo, alvo, parametro) WHERE status IN ('PENDENTE', 'EXECUTANDO')
+    END
+    """)
+
+
+def _conectar():
+    conn = DatabaseConnection().get_connection()
+    if not conn:
+        raise ConnectionError("Não foi possível conectar ao banco de dados")
+    return conn
+
+
+# ------------------------------
+# Produtores
+# ------------------------------
+def lotes_periodos(periodos, tamanho):
+    """Divide uma lista de períodos SIDRA em parâmetros "p1,p2,..." de até `tamanho` itens"""
+    periodos = [str(p).strip() for p in periodos if str(p).strip()]
+    return [",".join(periodos[i:i + tamanho]) for i in range(0, len(periodos), tamanho)]
+
+
+def enfileirar(unidades, prioridade=100, max_tentativas=FILA_MAX_TENTATIVAS):
+    """
+    Enfileira [(tipo, alvo, parametro)]. Unidades iguais a uma já pendente
+    ou em execução são ignoradas. Retorna quantas foram inseridas.
+    """
+    conn = _conectar()
+    try:
+        cursor = conn.cursor()
+        criar_tabela_fila(cursor)
+        conn.commit()
+        inseridas = 0
+        for tipo, alvo, parametro in unidades:
+            cursor.execute(f"""
+            IF NOT EXISTS (
+                SELECT 1 FROM {TABELA_FILA} WITH (UPDLOCK, HOLDLOCK)
+                WHERE tipo = ? AND alvo = ? AND parametro = ? AND status IN ('PENDENTE', 'EXECUTANDO')
+            )
+            INSERT INTO {TABELA_FILA} (tipo, alvo, parametro, prioridade, max_tentativas)
+            VALUES (?, ?, ?, ?, ?)
+            """, (tipo, str(alvo), parametro or '', tipo, str(alvo), parametro or '', prioridade, max_tentativas))
+            inseridas += max(cursor.rowcount, 0)
+            conn.commit()
+        logger.info(f"{inseridas} unidades de trabalho enfileiradas ({len(unidades)} pedidas)")
+        return inseridas
+    finally:
+        conn.close()
+
+
+def enfileirar_pnad(table_ids, periodos=None, tamanho_lote=12, prioridade=100):
+    """Uma unidade por tabela (últimos 3 períodos) ou por tabela × lote de períodos"""
+    parametros = lotes_periodos(periodos, tamanho_lote) if periodos else ["last 3"]
+    return enfileirar([("pnad", t, p) for t in table_ids for p in parametros], prioridade)
+
+
+def enfileirar_ibge(tipos=None, niveis=None, prioridade=100):
+    """Uma unidade por operação IBGE; malhas abaixo de N1 viram uma unidade por código"""
+    from api_IBGE import operacoes_ibge, codigos_malhas, create_ibge_tables
+
+    if not create_ibge_tables():
+        raise ConnectionError("Falha ao criar tabelas IBGE")
+    unidades = []
+    for op in operacoes_ibge(tipos, niveis):
+        if op['type'] == "malhas" and op['geo_level'] != "N1":
+            unidades += [("ibge_malhas", op['geo_level'], code) for code in codigos_malhas(op['geo_level'])]
+        else:
+            unidades.append((f"ibge_{op['type']}", op['geo_level'], ''))
+    return enfileirar(unidades, prioridade)
+
+
+# ------------------------------
+# Consumidores
+# ------------------------------
+class UnidadeTrabalho:
+    __slots__ = ("id", "tipo", "alvo", "parametro", "tentativas")
+
+    def __init__(self, id, tipo, alvo, parametro, tentativas):
+        self.id = id
+        self.tipo = tipo
+        self.alvo = alvo
+        self.parametro = parametro
+        self.tentativas = tentativas
+
+    def __repr__(self):
+        return f"{self.tipo}:{self.alvo}:{self.parametro or '-'} (#{self.id}, tentativa {self.tentativas})"
+
+
+class FilaDistribuida:
+    """
+    Fila de trabalho em SQL Server compartilhada por vários workers/nós.
+
+    Um worker reivindica a próxima unidade com UPDLOCK + READPAST (linhas
+    travadas por outro worker são puladas, sem esperar) e recebe um lease
+    de FILA_LEASE_SEGUNDOS, renovado por heartbeat enquanto processa.
+    Se o worker morrer, o lease expira e a unidade volta a ser reivindicável;
+    depois de max_tentativas ela fica com status ERRO. Todos os tempos vêm
+    do relógio do servidor (SYSUTCDATETIME), não dos nós.
+    """
+
+    def __init__(self, nome_worker=None, lease_segundos=FILA_LEASE_SEGUNDOS):
+        self.nome_worker = nome_worker or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_segundos = lease_segundos
+        self._conn = _conectar()
+        cursor = self._conn.cursor()
+        criar_tabela_fila(cursor)
+        self._conn.commit()
+
+    def fechar(self):
+        self._conn.close()
+
+    def encerrar_expiradas(self):
+        """Marca como ERRO as unidades com lease vencido que já esgotaram as tentativas"""
+        cursor = self._conn.cursor()
+        cursor.execute(f"""
+        UPDATE {TABELA_FILA}
+        SET status = 'ERRO', finalizado_em = SYSUTCDATETIME(),
+            mensagem = CONCAT('Lease expirado após ', tentativas, ' tentativas (', worker, ')')
+        WHERE status = 'EXECUTANDO' AND lease_ate < SYSUTCDATETIME() AND tentativas >= max_tentativas
+        """)
+        encerradas = max(cursor.rowcount, 0)
+        self._conn.commit()
+        return encerradas
+
+    def reivindicar(self):
+        """Retorna a próxima UnidadeTrabalho (pendente ou com lease expirado) ou None"""
+        self.encerrar_expiradas()
+        cursor = self._conn.cursor()
+        cursor.execute(f"""
+        WITH proxima AS (
+            SELECT TOP (1) *
+            FROM {TABELA_FILA} WITH (UPDLOCK, READPAST, ROWLOCK)
+            WHERE tentativas < max_tentativas
+              AND (status = 'PENDENTE' OR (status = 'EXECUTANDO' AND lease_ate < SYSUTCDATETIME()))
+            ORDER BY prioridade, id
+        )
+        UPDATE proxima
+        SET status = 'EXECUTANDO', worker = ?, tentativas = tentativas + 1,
+            lease_ate = DATEADD(SECOND, ?, SYSUTCDATETIME()), iniciado_em = SYSUTCDATETIME()
+        OUTPUT inserted.id, inserted.tipo, inserted.alvo, inserted.parametro, inserted.tentativas
+        """, (self.nome_worker, self.lease_segundos))
+        linha = cursor.fetchone()
+        self._conn.commit()
+        return UnidadeTrabalho(*linha) if linha else None
+
+    def _finalizar(self, unidade, status_sucesso, mensagem):
+        cursor = self._conn.cursor()
+        if status_sucesso:
+            cursor.execute(f"""
+            UPDATE {TABELA_FILA}
+            SET status = 'CONCLUIDO', lease_ate = NULL, finalizado_em = SYSUTCDATETIME(), mensagem = ?
+            WHERE id = ? AND worker = ? AND status = 'EXECUTANDO'
+            """, (mensagem[:1000], unidade.id, self.nome_worker))
+        else:
+            # Volta para a fila enquanto houver tentativas
+            cursor.execute(f"""
+            UPDATE {TABELA_FILA}
+            SET status = CASE WHEN tentativas >= max_tentativas THEN 'ERRO' ELSE 'PENDENTE' END,
+                finalizado_em = CASE WHEN tentativas >= max_tentativas THEN SYSUTCDATETIME() END,
+                lease_ate = NULL, mensagem = ?
+            WHERE id = ? AND worker = ? AND status = 'EXECUTANDO'
+            """, (mensagem[:1000], unidade.id, self.nome_worker))
+        atualizadas = cursor.rowcount
+        self._conn.commit()
+        if atualizadas == 0:
+            logger.warning(f"Lease de {unidade} perdido antes da conclusão; resultado não registrado na fila")
+        return atualizadas > 0
+
+    def concluir(self, unidade, mensagem=""):
+        return self._finalizar(unidade, True, mensagem)
+
+    def falhar(self, unidade, mensagem=""):
+        return self._finalizar(unidade, False, mensagem)
+
+    def estatisticas(self):
+        cursor = self._conn.cursor()
+        cursor.execute(f"SELECT tipo, status, COUNT(*) FROM {TABELA_FILA} GROUP BY tipo, status ORDER BY tipo, status")
+        return [(tipo, status, total) for tipo, status, total in cursor.fetchall()]
+
+
+class Heartbeat:
+    """Renova o lease de uma unidade em uma thread própria (com conexão própria)"""
+
+    def __init__(self, unidade, nome_worker, lease_segundos):
+        self.unidade = unidade
+        self.nome_worker = nome_worker
+        self.lease_segundos = lease_segundos
+        self.perdido = threading.Event()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+    def _executar(self):
+        intervalo = max(1.0, self.lease_segundos / 3)
+        conn = None
+        while not self._parar.wait(intervalo):
+            try:
+                conn = conn or _conectar()
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                UPDATE {TABELA_FILA}
+                SET lease_ate = DATEADD(SECOND, ?, SYSUTCDATETIME())
+                WHERE id = ? AND worker = ? AND status = 'EXECUTANDO'
+                """, (self.lease_segundos, self.unidade.id, self.nome_worker))
+                renovado = cursor.rowcount
+                conn.commit()
+                if renovado == 0:
+                    logger.warning(f"Lease de {self.unidade} foi reivindicado por outro worker")
+                    self.perdido.set()
+                    break
+            except Exception as e:
+                # Falha transitória: tenta de novo no próximo intervalo
+                logger.warning(f"Falha ao renovar lease de {self.unidade}: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+        if conn is not None:
+            conn.close()
+
+
+# ------------------------------
+# Processamento das unidades
+# ------------------------------
+def processar_unidade(unidade, hierarquia=None, pode_gravar=None):
+    """
+    Executa a unidade e retorna o status gravado no log de extração.
+    pode_gravar() é consultado antes da gravação (lease ainda válido).
+    """
+    if unidade.tipo == "pnad":
+        from api_PNDA import processar_tabela
+        # Cada lote substitui só os próprios períodos: lotes da mesma tabela
+        # podem rodar em nós diferentes sem TRUNCATE
+        return processar_tabela(
+            unidade.alvo, hierarquia, period=unidade.parametro or "last 3", modo="periodos", pode_gravar=pode_gravar
+        )
+    if unidade.tipo in ("ibge_localidades", "ibge_malhas"):
+        from api_IBGE import extract_ibge_unit
+        return extract_ibge_unit(
+            unidade.tipo[len("ibge_"):], unidade.alvo, unidade.parametro or None, pode_gravar=pode_gravar
+        )
+    raise ValueError(f"Tipo de unidade desconhecido: {unidade.tipo}")
+
+
+def executar_worker(nome_worker=None, continuar=False, max_unidades=None):
+    """
+    Reivindica e processa unidades até a fila esvaziar (ou indefinidamente
+    com continuar=True, aguardando FILA_ESPERA_VAZIA entre verificações).
+
+    Retorna:
+        int: número de unidades processadas
+    """
+    from hierarquia_territorial import carregar_ou_construir
+
+    fila = FilaDistribuida(nome_worker)
+    hierarquia = None
+    processadas = 0
+    try:
+        while max_unidades is None or processadas < max_unidades:
+            unidade = fila.reivindicar()
+            if unidade is None:
+                if not continuar:
+                    break
+                time.sleep(FILA_ESPERA_VAZIA)
+                continue
+
+            logger.info(f"[{fila.nome_worker}] Processando {unidade}")
+            if unidade.tipo == "pnad" and hierarquia is None:
+                hierarquia = carregar_ou_construir(DatabaseConnection().get_connection)
+
+            with Heartbeat(unidade, fila.nome_worker, fila.lease_segundos) as hb:
+                try:
+                    status = processar_unidade(unidade, hierarquia, lambda: not hb.perdido.is_set())
+                except Exception as e:
+                    logger.error(f"Erro ao processar {unidade}: {e}")
+                    status = f"ERRO: {e}"
+
+            processadas += 1
+            if hb.perdido.is_set():
+                # Outro worker reivindicou a unidade: o resultado é dele
+                logger.warning(f"[{fila.nome_worker}] Lease de {unidade} perdido; resultado ({status}) descartado")
+                continue
+            if status in STATUS_CONCLUIDOS:
+                fila.concluir(unidade, status)
+            else:
+                fila.falhar(unidade, status)
+    finally:
+        fila.fechar()
+    logger.info(f"[{fila.nome_worker}] {processadas} unidades processadas")
+    return processadas
+
+
+# ------------------------------
+# Linha de comando
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fila de extração distribuída (SQL Server)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_pnad = sub.add_parser("pnad", help="Enfileira tabelas SIDRA")
+    p_pnad.add_argument("tabelas", nargs="+")
+    p_pnad.add_argument("--periodos", help="Lista de períodos separados por vírgula (padrão: last 3)")
+    p_pnad.add_argument("--tamanho-lote", type=int, default=12, help="Períodos por unidade de trabalho")
+    p_pnad.add_argument("--prioridade", type=int, default=100)
+
+    p_ibge = sub.add_parser("ibge", help="Enfileira operações IBGE")
+    p_ibge.add_argument("--tipos", nargs="*", choices=["localidades", "malhas"])
+    p_ibge.add_argument("--niveis", nargs="*")
+    p_ibge.add_argument("--prioridade", type=int, default=100)
+
+    p_worker = sub.add_parser("worker", help="Processa unidades da fila")
+    p_worker.add_argument("--nome")
+    p_worker.add_argument("--continuar", action="store_true", help="Não encerra quando a fila esvazia")
+    p_worker.add_argument("--max-unidades", type=int)
+
+    sub.add_parser("status", help="Resumo da fila por tipo e status")
+
+    args = parser.parse_args(argv)
+    if args.comando == "pnad":
+        periodos = args.periodos.split(",") if args.periodos else None
+        enfileirar_pnad(args.tabelas, periodos, args.tamanho_lote, args.prioridade)
+    elif args.comando == "ibge":
+        enfileirar_ibge(args.tipos, args.niveis, args.prioridade)
+    elif args.comando == "worker":
+        executar_worker(args.nome, args.continuar, args.max_unidades)
+    else:
+        fila = FilaDistribuida()
+        try:
+            for tipo, status, total in fila.estatisticas():
+                print(f"{tipo:<20} {status:<12} {total}")
+        finally:
+            fila.fechar()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import os
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+EXTRACAO_WORKERS = int(os.getenv('EXTRACAO_WORKERS', 2))
+EXTRACAO_HISTORICO = int(os.getenv('EXTRACAO_HISTORICO', 100))
+TIPOS_EXTRACAO = ("pnad", "ibge", "tratamento")
+
+PENDENTE = "PENDENTE"
+EXECUTANDO = "EXECUTANDO"
+CONCLUIDO = "CONCLUIDO"
+ERRO = "ERRO"
+
+
+# ------------------------------
+# Modelos
+# ------------------------------
+class PedidoExtracao(BaseModel):
+    tipo: str
+    tabelas: List[str] = []
+    niveis: List[str] = []
+    tipos_ibge: List[str] = []
+
+
+class EstadoExtracao(BaseModel):
+    id: str
+    tipo: str
+    alvos: List[str]
+    status: str
+    concluidas: int
+    total: Optional[int] = None
+    resultados: Dict[str, str]
+    erro: Optional[str] = None
+    criado_em: datetime
+    iniciado_em: Optional[datetime] = None
+    finalizado_em: Optional[datetime] = None
+    duplicado: bool = False
+
+
+class ErroPedido(ValueError):
+    """Pedido de extração inválido"""
+
+
+# ------------------------------
+# Jobs
+# ------------------------------
+class JobExtracao:
+    def __init__(self, tipo, alvos, parametros):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.alvos = alvos
+        self.parametros = parametros
+        self.status = PENDENTE
+        self.concluidas = 0
+        self.total = len(alvos) if tipo == "pnad" else None
+        self.resultados = {}
+        self.erro = None
+        self.criado_em = datetime.now()
+        self.iniciado_em = None
+        self.finalizado_em = None
+
+    @property
+    def ativo(self):
+        return self.status in (PENDENTE, EXECUTANDO)
+
+    def progresso(self, concluidas, total, alvo, status):
+        self.concluidas = concluidas
+        self.total = total
+        self.resultados[str(alvo)] = status
+
+    def estado(self, duplicado=False):
+        return EstadoExtracao(
+            id=self.id, tipo=self.tipo, alvos=self.alvos, status=self.status,
+            concluidas=self.concluidas, total=self.total, resultados=dict(self.resultados),
+            erro=self.erro, criado_em=self.criado_em, iniciado_em=self.iniciado_em,
+            finalizado_em=self.finalizado_em, duplicado=duplicado,
+        )
+
+
+def _normalizar(valores, maiusculas=False):
+    vistos = []
+    for valor in valores or []:
+        valor = str(valor).strip()
+        valor = valor.upper() if maiusculas else valor
+        if valor and valor not in vistos:
+            vistos.append(valor)
+    return sorted(vistos)
+
+
+def chave_pedido(pedido):
+    """Normaliza o pedido e retorna (chave, alvos, parametros)"""
+    tipo = pedido.tipo.lower()
+    if tipo not in TIPOS_EXTRACAO:
+        raise ErroPedido(f"Tipo de extração inválido: {pedido.tipo} (use {', '.join(TIPOS_EXTRACAO)})")
+
+    if tipo == "pnad":
+        tabelas = _normalizar(pedido.tabelas)
+        if not tabelas:
+            raise ErroPedido("Informe ao menos uma tabela SIDRA")
+        invalidas = [t for t in tabelas if not t.isdigit()]
+        if invalidas:
+            raise ErroPedido(f"Ids de tabela inválidos: {', '.join(invalidas)}")
+        return (tipo, tuple(tabelas)), tabelas, {}
+
+    if tipo == "ibge":
+        niveis = _normalizar(pedido.niveis, maiusculas=True)
+        tipos_ibge = _normalizar([t.lower() for t in pedido.tipos_ibge])
+        desconhecidos = set(tipos_ibge) - {"localidades", "malhas"}
+        if desconhecidos:
+            raise ErroPedido(f"Tipos IBGE inválidos: {', '.join(sorted(desconhecidos))}")
+        alvos = [f"{t}_{n}" for t in (tipos_ibge or ["*"]) for n in (niveis or ["*"])]
+        return (tipo, tuple(tipos_ibge), tuple(niveis)), alvos, {"tipos": tipos_ibge or None, "niveis": niveis or None}
+
+    return (tipo,), ["ibge_localidades_tratado"], {}
+
+
+# ------------------------------
+# Execução (cada tipo chama o script de linha de comando correspondente)
+# ------------------------------
+def _executar_pnad(job):
+    from api_PNDA import extract_and_insert_data
+    extract_and_insert_data(job.alvos, progresso=job.progresso)
+
+
+def _executar_ibge(job):
+    from api_IBGE import extract_all_ibge_data
+    if not extract_all_ibge_data(progresso=job.progresso, **job.parametros):
+        raise RuntimeError("Nenhuma operação IBGE concluída com sucesso")
+
+
+def _executar_tratamento(job):
+    from tratamento_dados import TratamentoDadosIBGE
+    sucesso = TratamentoDadosIBGE().executar_tratamento()
+    job.progresso(1, 1, job.alvos[0], "SUCESSO" if sucesso else "FALHA")
+    if not sucesso:
+        raise RuntimeError("Falha no tratamento dos dados")
+
+
+EXECUTORES = {
+    "pnad": _executar_pnad,
+    "ibge": _executar_ibge,
+    "tratamento": _executar_tratamento,
+}
+
+
+class FilaExtracoes:
+    """
+    Fila de extrações em segundo plano com um número limitado de workers.
+
+    Pedidos idênticos a um job ainda pendente ou em execução devolvem o
+    mesmo job em vez de criar outro. Jobs PNAD que tocam a mesma tabela
+    SIDRA são serializados por tabela, já que cada carga trunca e regrava
+    a tabela de destino; jobs IBGE e de tratamento rodam um de cada vez.
+    """
+
+    def __init__(self, workers=EXTRACAO_WORKERS, historico=EXTRACAO_HISTORICO):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extracao")
+        self._jobs = OrderedDict()
+        self._ativos = {}
+        self._travas_alvo = {}
+        self._historico = historico
+        self._lock = threading.Lock()
+
+    def submeter(self, pedido):
+        """Retorna (job, novo); novo=False quando um job idêntico já está na fila"""
+        chave, alvos, parametros = chave_pedido(pedido)
+        with self._lock:
+            existente = self._ativos.get(chave)
+            if existente is not None and existente.ativo:
+                return existente, False
+            job = JobExtracao(chave[0], alvos, parametros)
+            self._jobs[job.id] = job
+            self._ativos[chave] = job
+            self._podar()
+        self._executor.submit(self._executar, chave, job)
+        logger.info(f"Extração {job.id} enfileirada: {job.tipo} {', '.join(alvos)}")
+        return job, True
+
+    def _podar(self):
+        finalizados = [i for i, j in self._jobs.items() if not j.ativo]
+        for job_id in finalizados[:max(0, len(self._jobs) - self._historico)]:
+            del self._jobs[job_id]
+
+    def _travas(self, job):
+        with self._lock:
+            if job.tipo == "pnad":
+                chaves = sorted(f"pnad:{alvo}" for alvo in job.alvos)
+            else:
+                # Extrações IBGE e o tratamento gravam nas mesmas tabelas: uma de cada vez
+                chaves = ["ibge"]
+            return [self._travas_alvo.setdefault(c, threading.Lock()) for c in chaves]
+
+    def _executar(self, chave, job):
+        travas = self._travas(job)
+        for trava in travas:
+            trava.acquire()
+        try:
+            job.status = EXECUTANDO
+            job.iniciado_em = datetime.now()
+            EXECUTORES[job.tipo](job)
+            job.status = CONCLUIDO
+        except Exception as e:
+            logger.error(f"Extração {job.id} falhou: {e}")
+            job.erro = str(e)
+            job.status = ERRO
+        finally:
+            job.finalizado_em = datetime.now()
+            for trava in reversed(travas):
+                trava.release()
+            with self._lock:
+                if self._ativos.get(chave) is job:
+                    del self._ativos[chave]
+            logger.info(f"Extração {job.id} finalizada: {job.status}")
+
+    def obter(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def listar(self, status=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [j for j in reversed(jobs) if status is None or j.status == status]
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,435 @@
+import os
+import json
+import logging
+import unicodedata
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+NIVEL_REGIAO = 0
+NIVEL_UF = 1
+NIVEL_RM = 2
+NIVEL_MUNICIPIO = 3
+
+NOMES_NIVEIS = {
+    "regiao": NIVEL_REGIAO,
+    "uf": NIVEL_UF,
+    "rm": NIVEL_RM,
+    "municipio": NIVEL_MUNICIPIO,
+}
+
+MAGIC = b"PNADHIER"
+VERSAO_FORMATO = 1
+ALINHAMENTO = 8
+CAMINHO_PADRAO = "hierarquia_territorial.bin"
+
+
+def caminho_hierarquia():
+    """Retorna o caminho do arquivo do índice (variável HIERARQUIA_PATH)"""
+    return os.getenv('HIERARQUIA_PATH', CAMINHO_PADRAO)
+
+
+# ------------------------------
+# Índice territorial em arrays
+# ------------------------------
+class HierarquiaTerritorial:
+    """
+    Índice compacto da hierarquia região → UF → RM → município.
+
+    Os nós ficam ordenados por (nível, código) em arrays inteiros. Cada nó
+    guarda um ponteiro para o pai e os filhos/membros de RM ficam em
+    listas CSR (offsets + índices), então:
+        - pai e filhos de um índice: O(1)
+        - localizar um código: O(log n) (busca binária dentro do nível)
+    Os arrays podem ser gravados em um único arquivo e reabertos via
+    memória mapeada, sem reconstruir nada a partir do SQL.
+    """
+
+    CAMPOS = (
+        "niveis", "codigos", "inicio_nivel", "indice_pai",
+        "filhos_offsets", "filhos_indices",
+        "membros_offsets", "membros_indices",
+        "rms_offsets", "rms_indices",
+        "nomes_offsets", "nomes",
+        "siglas_offsets", "siglas",
+    )
+
+    def __init__(self, arrays):
+        for campo in self.CAMPOS:
+            setattr(self, campo, arrays[campo])
+        self._indice_nomes = None
+
+    def __len__(self):
+        return len(self.codigos)
+
+    # --- localização -----------------------------------------------------
+    def indice(self, nivel, codigo):
+        """Retorna a posição do nó (nivel, codigo) ou -1 se não existir"""
+        inicio, fim = int(self.inicio_nivel[nivel]), int(self.inicio_nivel[nivel + 1])
+        codigo = int(codigo)
+        pos = inicio + int(np.searchsorted(self.codigos[inicio:fim], codigo))
+        if pos < fim and int(self.codigos[pos]) == codigo:
+            return pos
+        return -1
+
+    def contem(self, nivel, codigo):
+        return self.indice(nivel, codigo) >= 0
+
+    def codigos_do_nivel(self, nivel):
+        """Retorna os códigos (ordenados) de um nível"""
+        return self.codigos[int(self.inicio_nivel[nivel]):int(self.inicio_nivel[nivel + 1])]
+
+    # --- atributos -------------------------------------------------------
+    def _texto(self, offsets, blob, idx):
+        return bytes(blob[int(offsets[idx]):int(offsets[idx + 1])]).decode('utf-8')
+
+    def nome(self, nivel, codigo):
+        idx = self.indice(nivel, codigo)
+        return self._texto(self.nomes_offsets, self.nomes, idx) if idx >= 0 else None
+
+    def sigla(self, nivel, codigo):
+        idx = self.indice(nivel, codigo)
+        return self._texto(self.siglas_offsets, self.siglas, idx) if idx >= 0 else None
+
+    def _no(self, idx):
+        return (int(self.niveis[idx]), int(self.codigos[idx]))
+
+    def buscar_por_nome(self, nome, nivel=None):
+        """
+        Retorna [(nivel, codigo), ...] com o nome informado (comparação sem
+        acentos e sem caixa). O dicionário de nomes é montado na primeira
+        chamada, a partir do blob de nomes.
+        """
+        if self._indice_nomes is None:
+            indice = {}
+            for idx in range(len(self.codigos)):
+                chave = normalizar_nome(self._texto(self.nomes_offsets, self.nomes, idx))
+                indice.setdefault(chave, []).append(idx)
+            self._indice_nomes = indice
+        return [
+            self._no(idx) for idx in self._indice_nomes.get(normalizar_nome(nome), [])
+            if nivel is None or int(self.niveis[idx]) == nivel
+        ]
+
+    # --- navegação -------------------------------------------------------
+    def pai(self, nivel, codigo):
+        """Retorna (nivel, codigo) do pai ou None"""
+        idx = self.indice(nivel, codigo)
+        if idx < 0 or self.indice_pai[idx] < 0:
+            return None
+        return self._no(int(self.indice_pai[idx]))
+
+    def ancestral(self, nivel, codigo, nivel_ancestral):
+        """Sobe pelos ponteiros de pai até encontrar o nível pedido"""
+        idx = self.indice(nivel, codigo)
+        while idx >= 0:
+            if int(self.niveis[idx]) == nivel_ancestral:
+                return int(self.codigos[idx])
+            idx = int(self.indice_pai[idx])
+        return None
+
+    def filhos(self, nivel, codigo):
+        """Retorna os códigos dos filhos diretos (UFs de uma região, municípios de uma UF...)"""
+        idx = self.indice(nivel, codigo)
+        if idx < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.codigos[self.filhos_indices[self.filhos_offsets[idx]:self.filhos_offsets[idx + 1]]]
+
+    def municipios_da_rm(self, codigo_rm):
+        """Retorna os códigos dos municípios que compõem a RM"""
+        idx = self.indice(NIVEL_RM, codigo_rm)
+        if idx < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.codigos[self.membros_indices[self.membros_offsets[idx]:self.membros_offsets[idx + 1]]]
+
+    def rms_do_municipio(self, codigo_municipio):
+        """Retorna os códigos das RMs que contêm o município"""
+        idx = self.indice(NIVEL_MUNICIPIO, codigo_municipio)
+        if idx < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.codigos[self.rms_indices[self.rms_offsets[idx]:self.rms_offsets[idx + 1]]]
+
+    def dados_uf(self, codigo_uf):
+        """Retorna UF e região no mesmo formato usado por ibge_localidades_tratado"""
+        idx = self.indice(NIVEL_UF, codigo_uf)
+        if idx < 0:
+            return None
+        dados = {
+            'uf_id': int(self.codigos[idx]),
+            'uf_sigla': self._texto(self.siglas_offsets, self.siglas, idx),
+            'uf_nome': self._texto(self.nomes_offsets, self.nomes, idx),
+            'regiao_id': None,
+            'regiao_sigla': '',
+            'regiao_nome': '',
+        }
+        idx_regiao = int(self.indice_pai[idx])
+        if idx_regiao >= 0:
+            dados['regiao_id'] = int(self.codigos[idx_regiao])
+            dados['regiao_sigla'] = self._texto(self.siglas_offsets, self.siglas, idx_regiao)
+            dados['regiao_nome'] = self._texto(self.nomes_offsets, self.nomes, idx_regiao)
+        return dados
+
+    # --- serialização ----------------------------------------------------
+    def salvar(self, caminho=None):
+        """Grava todos os arrays em um único arquivo (escrita atômica)"""
+        caminho = caminho or caminho_hierarquia()
+        cabecalho = {"versao": VERSAO_FORMATO, "arrays": {}}
+        offset = 0
+        for campo in self.CAMPOS:
+            arr = np.ascontiguousarray(getattr(self, campo))
+            cabecalho["arrays"][campo] = {
+                "dtype": arr.dtype.str,
+                "shape": list(arr.shape),
+                "offset": offset,
+            }
+            offset += _alinhar(arr.nbytes)
+
+        cabecalho_bytes = json.dumps(cabecalho).encode('utf-8')
+        inicio_dados = _alinhar(len(MAGIC) + 4 + len(cabecalho_bytes))
+
+        temporario = f"{caminho}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(cabecalho_bytes).to_bytes(4, 'little'))
+            f.write(cabecalho_bytes)
+            f.write(b"\0" * (inicio_dados - f.tell()))
+            for campo in self.CAMPOS:
+                arr = np.ascontiguousarray(getattr(self, campo))
+                f.write(arr.tobytes())
+                f.write(b"\0" * (_alinhar(arr.nbytes) - arr.nbytes))
+        os.replace(temporario, caminho)
+        logger.info(f"Hierarquia territorial gravada em {caminho}: {len(self)} nós")
+        return caminho
+
+    @classmethod
+    def carregar(cls, caminho=None):
+        """Abre o arquivo via memória mapeada (sem copiar os arrays)"""
+        caminho = caminho or caminho_hierarquia()
+        with open(caminho, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Arquivo de hierarquia inválido: {caminho}")
+            tamanho = int.from_bytes(f.read(4), 'little')
+            cabecalho = json.loads(f.read(tamanho).decode('utf-8'))
+
+        if cabecalho.get("versao") != VERSAO_FORMATO:
+            raise ValueError(f"Versão de hierarquia não suportada: {cabecalho.get('versao')}")
+
+        inicio_dados = _alinhar(len(MAGIC) + 4 + tamanho)
+        arrays = {}
+        for campo, meta in cabecalho["arrays"].items():
+            shape = tuple(meta["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[campo] = np.empty(shape, dtype=np.dtype(meta["dtype"]))
+                continue
+            arrays[campo] = np.memmap(
+                caminho, dtype=np.dtype(meta["dtype"]), mode='r',
+                offset=inicio_dados + meta["offset"], shape=shape
+            )
+        return cls(arrays)
+
+
+def normalizar_nome(nome):
+    """Minúsculas e sem acentos, para comparar nomes de localidades"""
+    texto = unicodedata.normalize('NFKD', str(nome or '').strip().lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def _alinhar(n):
+    return (n + ALINHAMENTO - 1) // ALINHAMENTO * ALINHAMENTO
+
+
+# ------------------------------
+# Construção a partir de ibge_localidades
+# ------------------------------
+def _codigo_int(valor):
+    try:
+        return int(str(valor).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _uf_do_registro(props):
+    """Localiza o dicionário de UF nos diferentes formatos da API de localidades"""
+    if isinstance(props.get('UF'), dict):
+        return props['UF']
+    micro = props.get('microrregiao')
+    if isinstance(micro, dict) and isinstance(micro.get('mesorregiao'), dict):
+        return micro['mesorregiao'].get('UF')
+    imediata = props.get('regiao-imediata')
+    if isinstance(imediata, dict) and isinstance(imediata.get('regiao-intermediaria'), dict):
+        return imediata['regiao-intermediaria'].get('UF')
+    return None
+
+
+def construir_hierarquia(registros):
+    """
+    Constrói o índice a partir de pares (nivel_geografico, propriedades).
+
+    Params:
+        registros: iterável de (nivel_geografico, dict ou JSON) como gravado
+                   em ibge_localidades pela extração IBGE
+
+    Retorna:
+        HierarquiaTerritorial
+    """
+    # (nivel, codigo) -> [nome, sigla, (nivel_pai, codigo_pai) ou None]
+    nos = {}
+    membros_rm = {}
+
+    def registrar(nivel, codigo, nome='', sigla='', pai=None):
+        if codigo is None:
+            return
+        atual = nos.get((nivel, codigo))
+        if atual is None:
+            nos[(nivel, codigo)] = [nome or '', sigla or '', pai]
+        else:
+            atual[0] = atual[0] or nome or ''
+            atual[1] = atual[1] or sigla or ''
+            atual[2] = atual[2] or pai
+
+    def registrar_uf(uf):
+        if not isinstance(uf, dict):
+            return None
+        codigo_uf = _codigo_int(uf.get('id'))
+        pai = None
+        regiao = uf.get('regiao')
+        if isinstance(regiao, dict) and _codigo_int(regiao.get('id')) is not None:
+            pai = (NIVEL_REGIAO, _codigo_int(regiao.get('id')))
+            registrar(NIVEL_REGIAO, pai[1], regiao.get('nome'), regiao.get('sigla'))
+        registrar(NIVEL_UF, codigo_uf, uf.get('nome'), uf.get('sigla'), pai)
+        return codigo_uf
+
+    for nivel_geografico, propriedades in registros:
+        try:
+            props = json.loads(propriedades) if isinstance(propriedades, str) else propriedades
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(props, dict):
+            continue
+
+        nivel_geografico = nivel_geografico or props.get('geo_level', '')
+        codigo = _codigo_int(props.get('id'))
+
+        if nivel_geografico == 'N2':
+            registrar_uf(props)
+        elif nivel_geografico == 'N3' or props.get('municipios'):
+            codigo_uf = registrar_uf(props.get('UF'))
+            registrar(NIVEL_RM, codigo, props.get('nome'), '',
+                      (NIVEL_UF, codigo_uf) if codigo_uf is not None else None)
+            for municipio in props.get('municipios') or []:
+                codigo_mun = _codigo_int(municipio.get('id'))
+                if codigo_mun is None:
+                    continue
+                registrar(NIVEL_MUNICIPIO, codigo_mun, municipio.get('nome'))
+                membros_rm.setdefault(codigo, set()).add(codigo_mun)
+        elif nivel_geografico in ('N6', 'N7'):
+            codigo_uf = registrar_uf(_uf_do_registro(props))
+            registrar(NIVEL_MUNICIPIO, codigo, props.get('nome'), '',
+                      (NIVEL_UF, codigo_uf) if codigo_uf is not None else None)
+
+    # Municípios sem UF explícita: os 2 primeiros dígitos do código são a UF
+    for (nivel, codigo), dados in nos.items():
+        if nivel == NIVEL_MUNICIPIO and dados[2] is None and (NIVEL_UF, codigo // 100000) in nos:
+            dados[2] = (NIVEL_UF, codigo // 100000)
+
+    chaves = sorted(nos)
+    n = len(chaves)
+    posicao = {chave: i for i, chave in enumerate(chaves)}
+
+    niveis = np.array([c[0] for c in chaves], dtype=np.int8)
+    codigos = np.array([c[1] for c in chaves], dtype=np.int64)
+    inicio_nivel = np.searchsorted(niveis, np.arange(NIVEL_MUNICIPIO + 2)).astype(np.int64)
+    pai = np.array([posicao.get(nos[c][2], -1) for c in chaves], dtype=np.int32)
+
+    filhos_offsets, filhos = _csr(n, [(int(p), i) for i, p in enumerate(pai) if p >= 0])
+
+    pares_rm = [
+        (posicao[(NIVEL_RM, rm)], posicao[(NIVEL_MUNICIPIO, mun)])
+        for rm, municipios in membros_rm.items() if (NIVEL_RM, rm) in posicao
+        for mun in municipios
+    ]
+    membros_offsets, membros = _csr(n, pares_rm)
+    rms_offsets, rms = _csr(n, [(mun, rm) for rm, mun in pares_rm])
+
+    nomes_offsets, nomes = _blob([nos[c][0] for c in chaves])
+    siglas_offsets, siglas = _blob([nos[c][1] for c in chaves])
+
+    return HierarquiaTerritorial({
+        "niveis": niveis, "codigos": codigos, "inicio_nivel": inicio_nivel, "indice_pai": pai,
+        "filhos_offsets": filhos_offsets, "filhos_indices": filhos,
+        "membros_offsets": membros_offsets, "membros_indices": membros,
+        "rms_offsets": rms_offsets, "rms_indices": rms,
+        "nomes_offsets": nomes_offsets, "nomes": nomes,
+        "siglas_offsets": siglas_offsets, "siglas": siglas,
+    })
+
+
+def _csr(n, pares):
+    """Converte pares (origem, destino) em offsets + destinos ordenados"""
+    pares = sorted(pares)
+    contagem = np.bincount([o for o, _ in pares], minlength=n) if pares else np.zeros(n, dtype=np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(contagem, out=offsets[1:])
+    destinos = np.array([d for _, d in pares], dtype=np.int32)
+    return offsets, destinos
+
+
+def _blob(textos):
+    """Concatena textos UTF-8 em um único buffer com offsets"""
+    codificados = [t.encode('utf-8') for t in textos]
+    offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in codificados], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(codificados), dtype=np.uint8).copy()
+
+
+def construir_do_banco(conn):
+    """Lê ibge_localidades com uma única consulta e constrói o índice"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT nivel_geografico, propriedades
+        FROM ibge_localidades
+        ORDER BY id
+    ''')
+    hierarquia = construir_hierarquia(cursor.fetchall())
+    cursor.close()
+    logger.info(f"Hierarquia territorial construída: {len(hierarquia)} nós")
+    return hierarquia
+
+
+def carregar_ou_construir(conn_factory=None, caminho=None, reconstruir=False):
+    """
+    Carrega o índice do arquivo; se não existir (ou reconstruir=True),
+    constrói a partir do banco e grava o arquivo.
+
+    Params:
+        conn_factory: função sem argumentos que retorna uma conexão
+        caminho (str): arquivo do índice (padrão: HIERARQUIA_PATH)
+        reconstruir (bool): ignora o arquivo existente
+
+    Retorna:
+        HierarquiaTerritorial ou None se não for possível obter o índice
+    """
+    caminho = caminho or caminho_hierarquia()
+    if not reconstruir and os.path.exists(caminho):
+        try:
+            return HierarquiaTerritorial.carregar(caminho)
+        except Exception as e:
+            logger.warning(f"Falha ao carregar hierarquia de {caminho}: {e}")
+
+    if conn_factory is None:
+        return None
+    conn = conn_factory()
+    if not conn:
+        return None
+    try:
+        hierarquia = construir_do_banco(conn)
+        hierarquia.salvar(caminho)
+        return hierarquia
+    except Exception as e:
+        logger.error(f"Erro ao construir hierarquia territorial: {e}")
+        return None
+    finally:
+        conn.close()
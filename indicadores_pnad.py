@@ -0,0 +1,300 @@
+import os
+import ast
+import sys
+import json
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from armazenamento import armazenamento
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+TABELA_INDICADORES = "pnad_indicadores"
+CHAVES = ["d2n", "d3n"]  # Período e localidade, como nas tabelas pivotadas
+
+
+def caminho_registro():
+    return os.getenv('INDICADORES_PATH', 'indicadores_pnad.json')
+
+
+# ------------------------------
+# Registro declarativo
+# ------------------------------
+class Indicador:
+    """
+    Indicador derivado de variáveis SIDRA, calculado na carga.
+
+    Params:
+        nome (str): identificador gravado em pnad_indicadores
+        formula (str): expressão aritmética sobre os apelidos das variáveis
+            (avaliada com DataFrame.eval, vetorizada)
+        variaveis (dict): {apelido: nome da variável SIDRA (D1N)} ou
+            {apelido: {"tabela": id, "variavel": nome}} para outras tabelas
+        tabela (str): tabela das variáveis informadas só pelo nome
+
+    Exemplo no arquivo de registro (INDICADORES_PATH):
+        {"taxa_participacao": {
+            "tabela": "4093",
+            "formula": "forca_trabalho / idade_ativa * 100",
+            "variaveis": {"forca_trabalho": "Pessoas de 14 anos ou mais de idade, na força de trabalho",
+                          "idade_ativa": "Pessoas de 14 anos ou mais de idade"}}}
+    """
+
+    def __init__(self, nome, formula, variaveis, tabela=None, descricao=""):
+        from api_PNDA import normalize_column_names
+
+        self.nome = nome
+        self.formula = formula
+        self.descricao = descricao
+        self.variaveis = {}
+        for apelido, referencia in variaveis.items():
+            if isinstance(referencia, dict):
+                origem, variavel = str(referencia["tabela"]), referencia["variavel"]
+            elif tabela is not None:
+                origem, variavel = str(tabela), referencia
+            else:
+                raise ValueError(f"Indicador {nome}: variável {apelido} sem tabela")
+            # Mesma normalização das colunas das tabelas pivotadas
+            self.variaveis[apelido] = (origem, normalize_column_names([variavel])[0])
+        self._validar()
+
+    def _validar(self):
+        reservados = set(CHAVES) | {"nivel_geografico"}
+        if not all(apelido.isidentifier() and apelido not in reservados for apelido in self.variaveis):
+            raise ValueError(f"Indicador {self.nome}: apelidos devem ser identificadores válidos (exceto {sorted(reservados)})")
+        try:
+            arvore = ast.parse(self.formula, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Indicador {self.nome}: fórmula inválida ({e})")
+        funcoes = {id(no.func) for no in ast.walk(arvore) if isinstance(no, ast.Call)}
+        nomes = {no.id for no in ast.walk(arvore) if isinstance(no, ast.Name) and id(no) not in funcoes}
+        desconhecidos = nomes - set(self.variaveis)
+        if desconhecidos:
+            raise ValueError(f"Indicador {self.nome}: nomes sem variável na fórmula: {sorted(desconhecidos)}")
+
+    @property
+    def tabelas(self):
+        return {origem for origem, _ in self.variaveis.values()}
+
+
+def carregar_registro(caminho=None):
+    """Indicadores do arquivo JSON {nome: {formula, variaveis, tabela?, descricao?}}; vazio se não houver"""
+    caminho = caminho or caminho_registro()
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logger.warning(f"Registro de indicadores ilegível ({caminho}): {e}")
+        return []
+    return [Indicador(nome, **campos) for nome, campos in dados.items()]
+
+
+_registro = None
+
+
+def registro_indicadores():
+    global _registro
+    if _registro is None:
+        _registro = carregar_registro()
+    return _registro
+
+
+# ------------------------------
+# Cálculo
+# ------------------------------
+def calcular_indicadores(table_id, df_pivoted, indicadores, ler_variaveis=None):
+    """
+    Calcula os indicadores que usam a tabela recém-pivotada. Variáveis de
+    outras tabelas vêm de ler_variaveis(tabela, colunas, periodos), que
+    devolve um DataFrame com d2n, d3n e as colunas pedidas.
+
+    Retorna:
+        DataFrame com indicador, periodo, localidade, nivel_geografico, valor
+    """
+    colunas = ["indicador", "periodo", "localidade", "nivel_geografico", "valor"]
+    table_id = str(table_id)
+    periodos = [str(p) for p in df_pivoted["d2n"].dropna().unique()]
+    base = df_pivoted[CHAVES + [c for c in ("nivel_geografico",) if c in df_pivoted.columns]]
+    externas = {}
+    partes = []
+
+    for indicador in indicadores:
+        if table_id not in indicador.tabelas:
+            continue
+        quadro = base.copy()
+        faltantes = []
+        for apelido, (origem, coluna) in indicador.variaveis.items():
+            if origem == table_id:
+                if coluna in df_pivoted.columns:
+                    quadro[apelido] = pd.to_numeric(df_pivoted[coluna], errors='coerce').astype("float64")
+                else:
+                    faltantes.append(coluna)
+                continue
+            # Outra tabela: lida uma vez por tabela, só os períodos carregados agora
+            pedidas = sorted({c for i in indicadores for o, c in i.variaveis.values() if o == origem})
+            if origem not in externas:
+                externas[origem] = ler_variaveis(origem, pedidas, periodos) if ler_variaveis else None
+            externa = externas[origem]
+            if externa is None or coluna not in externa.columns:
+                faltantes.append(f"{origem}.{coluna}")
+                continue
+            valores = externa[CHAVES + [coluna]].rename(columns={coluna: apelido})
+            valores[apelido] = pd.to_numeric(valores[apelido], errors='coerce').astype("float64")
+            quadro = quadro.merge(valores, on=CHAVES, how="left")
+        if faltantes:
+            logger.warning(f"Indicador {indicador.nome} não calculado: variáveis ausentes {faltantes}")
+            continue
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valores = quadro.eval(indicador.formula)
+        resultado = quadro[CHAVES].assign(
+            indicador=indicador.nome,
+            valor=pd.Series(valores, index=quadro.index).replace([np.inf, -np.inf], np.nan),
+            nivel_geografico=quadro["nivel_geografico"] if "nivel_geografico" in quadro.columns else None,
+        ).dropna(subset=["valor"])
+        partes.append(resultado.rename(columns={"d2n": "periodo", "d3n": "localidade"})[colunas])
+
+    if not partes:
+        return pd.DataFrame(columns=colunas)
+    return pd.concat(partes, ignore_index=True)
+
+
+# ------------------------------
+# Gravação
+# ------------------------------
+def criar_tabela_indicadores(cursor, backend=None):
+    backend = backend or armazenamento()
+    backend.criar_tabela(cursor, TABELA_INDICADORES, [
+        ("indicador", "texto(100)"),
+        ("periodo", "texto(100)"),
+        ("localidade", "texto(255)"),
+        ("nivel_geografico", "texto(10)"),
+        ("valor", "real"),
+    ], coluna_criacao="data_atualizacao")
+    # Leituras por localidade e período, e por indicador (mapas de um período)
+    backend.criar_indice(
+        cursor, f"IX_{TABELA_INDICADORES}_localidade", TABELA_INDICADORES,
+        ["localidade", "periodo", "indicador"], incluir=["valor"]
+    )
+    backend.criar_indice(
+        cursor, f"IX_{TABELA_INDICADORES}_indicador", TABELA_INDICADORES,
+        ["indicador", "periodo"], incluir=["localidade", "valor"]
+    )
+
+
+def _leitor_variaveis(cursor, backend):
+    """ler_variaveis de calcular_indicadores a partir das tabelas pnad_pivoted_* já carregadas"""
+    def ler(tabela, colunas, periodos):
+        nome = f"pnad_pivoted_{tabela}"
+        if not backend.tabela_existe(cursor, nome):
+            return None
+        existentes = {c.lower() for c in backend.colunas_existentes(cursor, nome)}
+        colunas = [c for c in colunas if c in existentes]
+        partes = []
+        for i in range(0, len(periodos), 500):
+            lote = periodos[i:i + 500]
+            cursor.execute(
+                f"SELECT {', '.join(CHAVES + colunas)} FROM {nome} WHERE d2n IN ({', '.join('?' for _ in lote)})", lote
+            )
+            partes += [tuple(linha) for linha in cursor.fetchall()]
+        return pd.DataFrame(partes, columns=CHAVES + colunas)
+    return ler
+
+
+def atualizar_indicadores(table_id, df_pivoted, indicadores=None):
+    """
+    Recalcula pnad_indicadores dos indicadores que usam a tabela, apenas
+    para os períodos presentes em df_pivoted (os recém-carregados).
+    """
+    indicadores = registro_indicadores() if indicadores is None else indicadores
+    indicadores = [i for i in indicadores if str(table_id) in i.tabelas]
+    if not indicadores or df_pivoted is None or df_pivoted.empty:
+        return False
+
+    backend = armazenamento()
+    conn = backend.conectar()
+    if not conn:
+        logger.error("Não foi possível conectar ao banco de dados")
+        return False
+
+    try:
+        cursor = conn.cursor()
+        criar_tabela_indicadores(cursor, backend)
+        resultado = calcular_indicadores(table_id, df_pivoted, indicadores, _leitor_variaveis(cursor, backend))
+        periodos = [str(p) for p in df_pivoted["d2n"].dropna().unique()]
+        calculados = list(resultado["indicador"].unique())
+        # Todos os indicadores da tabela, mesmo os que não renderam valores agora
+        # (variável ausente, divisão por zero): o valor antigo do período não vale mais
+        for i in range(0, len(periodos), 500):
+            lote = periodos[i:i + 500]
+            for nome in (indicador.nome for indicador in indicadores):
+                cursor.execute(
+                    f"DELETE FROM {TABELA_INDICADORES} WHERE indicador = ? AND periodo IN ({', '.join('?' for _ in lote)})",
+                    (nome, *lote)
+                )
+        if not resultado.empty:
+            backend.inserir_dataframe(conn, TABELA_INDICADORES, resultado.astype({"periodo": str, "localidade": str}))
+        conn.commit()
+        logger.info(f"{len(resultado)} valores de {len(calculados)} indicadores atualizados para a tabela {table_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao atualizar indicadores da tabela {table_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def recalcular_tabela(table_id):
+    """Recalcula os indicadores de todos os períodos já carregados da tabela (ex.: após mudar o registro)"""
+    backend = armazenamento()
+    conn = backend.conectar()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        nome = f"pnad_pivoted_{table_id}"
+        if not backend.tabela_existe(cursor, nome):
+            logger.warning(f"Tabela {nome} não existe")
+            return False
+        cursor.execute(f"SELECT * FROM {nome}")
+        colunas = [descricao[0] for descricao in cursor.description]
+        df = pd.DataFrame([tuple(linha) for linha in cursor.fetchall()], columns=colunas)
+    finally:
+        conn.close()
+    return atualizar_indicadores(table_id, df)
+
+
+# ------------------------------
+# Linha de comando
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indicadores derivados das tabelas PNAD (pnad_indicadores)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("listar", help="Indicadores do registro e suas variáveis")
+    p_recalcular = sub.add_parser("recalcular", help="Recalcula a partir das tabelas pivotadas já carregadas")
+    p_recalcular.add_argument("tabelas", nargs="*", help="Padrão: todas as tabelas usadas pelo registro")
+    args = parser.parse_args(argv)
+
+    indicadores = registro_indicadores()
+    if args.comando == "listar":
+        for indicador in indicadores:
+            print(f"{indicador.nome}: {indicador.formula}")
+            for apelido, (tabela, coluna) in indicador.variaveis.items():
+                print(f"    {apelido:<20} {tabela}.{coluna}")
+        return 0
+
+    tabelas = args.tabelas or sorted({t for i in indicadores for t in i.tabelas})
+    falhas = [t for t in tabelas if not recalcular_tabela(t)]
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
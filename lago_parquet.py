@@ -0,0 +1,350 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from memoria_compacta import restaurar_valores
+from database import carregar_config
+
+logger = logging.getLogger(__name__)
+# As constantes abaixo vêm do config.env
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+LAGO_DIR = os.getenv('LAGO_DIR', 'lago')
+LAGO_COMPRESSAO = os.getenv('LAGO_COMPRESSAO', 'zstd')
+LAGO_LINHAS_GRUPO = int(os.getenv('LAGO_LINHAS_GRUPO', 50000))  # Row groups menores = estatísticas mais seletivas
+ARQUIVO_MANIFESTO = "manifesto.json"
+
+# Conjuntos e suas chaves de partição (na ordem dos diretórios)
+PARTICOES = {
+    "sidra": ("tabela", "periodo", "nivel"),
+    "localidades": ("nivel",),
+    "malhas": ("nivel", "codigo"),
+}
+
+# Colunas que o pivot usa (D4N+ = categorias das classificações, MN = unidade
+# de medida para os agregados): o reprocessamento lê só essas do Parquet
+COLUNAS_PIVOT = ["V", "D1N", "D2N", "D3N", "MN", "Tabela_ID", "Data_Extracao", "Nivel_Geografico"] + [f"D{i}N" for i in range(4, 10)]
+
+
+def lago_ativo():
+    """Gravação das extrações brutas ligada (LAGO_GRAVAR=1)"""
+    return os.getenv('LAGO_GRAVAR', '0') == '1'
+
+
+def _valor_particao(valor):
+    return re.sub(r"[^\w\-]", "_", str(valor)) or "_"
+
+
+# ------------------------------
+# Lago de staging
+# ------------------------------
+class LagoParquet:
+    """
+    Extrações brutas em Parquet comprimido, particionadas no estilo Hive:
+
+        sidra/tabela=4094/periodo=202301/nivel=n3/parte-<ts>.parquet
+        localidades/nivel=N6/parte-<ts>.parquet
+        malhas/nivel=N3/codigo=BR/parte-<ts>.parquet
+
+    Cada partição tem um único arquivo vigente, registrado no manifesto
+    (linhas, bytes, colunas, data da extração). Uma nova extração da mesma
+    partição grava outro arquivo, troca o manifesto e só então apaga o
+    anterior: quem lê pelo manifesto nunca vê arquivo pela metade.
+    """
+
+    def __init__(self, diretorio=None):
+        self.diretorio = diretorio or LAGO_DIR
+        self._lock = threading.Lock()
+        self._manifesto = self._ler_manifesto()
+
+    def _caminho_manifesto(self):
+        return os.path.join(self.diretorio, ARQUIVO_MANIFESTO)
+
+    def _ler_manifesto(self):
+        try:
+            with open(self._caminho_manifesto(), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"versao": 1, "particoes": {}}
+        except ValueError as e:
+            logger.warning(f"Manifesto do lago ilegível ({self._caminho_manifesto()}), começando vazio: {e}")
+            return {"versao": 1, "particoes": {}}
+
+    def _salvar_manifesto(self):
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = f"{self._caminho_manifesto()}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self._manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporario, self._caminho_manifesto())
+
+    def _particao(self, conjunto, chaves):
+        partes = [conjunto] + [f"{nome}={_valor_particao(chaves[nome])}" for nome in PARTICOES[conjunto]]
+        return "/".join(partes)
+
+    def _registrar(self, conjunto, chaves, gravar, linhas, colunas, extras=None):
+        """Grava um arquivo novo da partição com gravar(caminho) e troca o vigente"""
+        particao = self._particao(conjunto, chaves)
+        relativo = f"{particao}/parte-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        caminho = os.path.join(self.diretorio, relativo)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        gravar(caminho)
+
+        with self._lock:
+            anterior = self._manifesto["particoes"].get(particao)
+            self._manifesto["particoes"][particao] = dict(
+                extras or {},
+                conjunto=conjunto,
+                chaves={nome: str(chaves[nome]) for nome in PARTICOES[conjunto]},
+                arquivo=relativo,
+                linhas=int(linhas),
+                bytes=os.path.getsize(caminho),
+                colunas=list(colunas),
+                extraido_em=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                gravacoes=(anterior or {}).get("gravacoes", 0) + 1,
+            )
+            self._salvar_manifesto()
+        if anterior and anterior["arquivo"] != relativo:
+            try:
+                os.remove(os.path.join(self.diretorio, anterior["arquivo"]))
+            except FileNotFoundError:
+                pass
+        return relativo
+
+    def particoes(self, conjunto, **filtros):
+        """
+        Entradas do manifesto do conjunto, filtradas pelas chaves de partição
+        (valor único ou lista). É aqui que acontece a poda de partições:
+        nenhum diretório é listado e nenhum arquivo fora do filtro é aberto.
+        """
+        aceitos = {
+            nome: {str(v) for v in (valor if isinstance(valor, (list, tuple, set)) else [valor])}
+            for nome, valor in filtros.items() if valor is not None
+        }
+        with self._lock:
+            entradas = [e for e in self._manifesto["particoes"].values() if e["conjunto"] == conjunto]
+        return sorted(
+            (e for e in entradas if all(e["chaves"][nome] in valores for nome, valores in aceitos.items())),
+            key=lambda e: e["arquivo"],
+        )
+
+    # ------------------------------
+    # Gravação
+    # ------------------------------
+    def _gravar_parquet(self, df):
+        def gravar(caminho):
+            df.to_parquet(
+                caminho, engine="pyarrow", compression=LAGO_COMPRESSAO, index=False,
+                row_group_size=LAGO_LINHAS_GRUPO,
+            )
+        return gravar
+
+    def gravar_sidra(self, df, tabela, nivel):
+        """
+        Uma partição por período (D2C, ou D2N se o código não vier). As
+        linhas ficam ordenadas por território e variável, o que deixa as
+        estatísticas de cada row group úteis para filtros em D3C/D1C.
+        Frames compactos (MEMORIA_COMPACTA=1) chegam com as dimensões
+        categóricas, gravadas como colunas dicionário, e as constantes em
+        df.attrs, que voltam a ser colunas em cada partição.
+        """
+        coluna_periodo = "D2C" if "D2C" in df.columns else "D2N"
+        ordem = [c for c in ("D3C", "D1C") if c in df.columns]
+        constantes = df.attrs.get("constantes", {})
+        arquivos = []
+        for periodo, parte in df.groupby(coluna_periodo, sort=True, observed=True):
+            if ordem:
+                parte = parte.sort_values(ordem, kind="stable")
+            if constantes:
+                parte = parte.assign(**{coluna: valor for coluna, valor in constantes.items() if coluna not in parte.columns})
+            if "V" in parte.columns and str(parte["V"].dtype) in ("float32", "Int32"):
+                # No lago o valor fica com a precisão da fonte, não com o float32 de trabalho
+                parte = restaurar_valores(parte.copy(), ["V"], df.attrs.get("casas_decimais") or 0, "float64")
+            # O pyarrow gravaria df.attrs nos metadados do arquivo (e não serializa Timestamp)
+            parte.attrs = {}
+            chaves = {"tabela": tabela, "periodo": periodo, "nivel": nivel}
+            arquivos.append(self._registrar(
+                "sidra", chaves, self._gravar_parquet(parte), len(parte), parte.columns,
+                {"periodo_nome": str(parte["D2N"].iloc[0]) if "D2N" in parte.columns else str(periodo)},
+            ))
+        logger.info(f"Tabela {tabela} ({nivel}) gravada no lago: {len(arquivos)} partições, {len(df)} linhas")
+        return arquivos
+
+    def gravar_localidades(self, df, nivel):
+        # Campos aninhados (regiao, UF, microrregiao...) viram JSON em texto
+        colunas_json = [
+            c for c in df.columns
+            if df[c].map(lambda v: isinstance(v, (dict, list))).any()
+        ]
+        df = df.copy()
+        for coluna in colunas_json:
+            df[coluna] = df[coluna].map(
+                lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+            )
+        return self._registrar(
+            "localidades", {"nivel": nivel}, self._gravar_parquet(df), len(df), df.columns,
+            {"colunas_json": colunas_json},
+        )
+
+    def gravar_malha(self, gdf, nivel, codigo=None):
+        # GeoParquet: a geometria vai em WKB e o CRS nos metadados
+        def gravar(caminho):
+            gdf.to_parquet(caminho, compression=LAGO_COMPRESSAO, index=False, row_group_size=LAGO_LINHAS_GRUPO)
+        return self._registrar("malhas", {"nivel": nivel, "codigo": codigo or "BR"}, gravar, len(gdf), gdf.columns)
+
+    # ------------------------------
+    # Leitura
+    # ------------------------------
+    def _conjunto_arrow(self, entradas):
+        import pyarrow.dataset as ds
+        return ds.dataset([os.path.join(self.diretorio, e["arquivo"]) for e in entradas], format="parquet")
+
+    def ler_sidra(self, tabela, periodos=None, niveis=None, colunas=None, filtros=None):
+        """
+        Lê a forma longa de uma tabela SIDRA do lago.
+
+        Params:
+            tabela (str): id da tabela SIDRA
+            periodos (list): códigos de período (D2C) a ler; None = todos
+            niveis (list): níveis geográficos a ler; None = todos
+            colunas (list): projeção (só essas colunas são lidas do disco)
+            filtros (list): predicados no formato do pyarrow/pandas, ex.
+                [("D3C", "in", ["33", "35"])], avaliados contra as
+                estatísticas de cada row group antes de ler os dados
+
+        Retorna:
+            DataFrame (vazio se nada no lago casar com o pedido)
+        """
+        import pandas as pd
+        entradas = self.particoes("sidra", tabela=tabela, periodo=periodos, nivel=niveis)
+        if not entradas:
+            return pd.DataFrame(columns=colunas or [])
+        return self._ler(entradas, colunas, filtros)
+
+    def _ler(self, entradas, colunas=None, filtros=None):
+        import pyarrow.parquet as pq
+        conjunto = self._conjunto_arrow(entradas)
+        if colunas:
+            colunas = [c for c in colunas if c in conjunto.schema.names]
+        expressao = pq.filters_to_expression(filtros) if filtros else None
+        return conjunto.to_table(columns=colunas, filter=expressao).to_pandas()
+
+    def ler_localidades(self, niveis=None, colunas=None, filtros=None):
+        import pandas as pd
+        entradas = self.particoes("localidades", nivel=niveis)
+        if not entradas:
+            return pd.DataFrame(columns=colunas or [])
+        df = self._ler(entradas, colunas, filtros)
+        for coluna in {c for e in entradas for c in e.get("colunas_json", [])} & set(df.columns):
+            df[coluna] = df[coluna].map(lambda v: json.loads(v) if isinstance(v, str) else v)
+        return df
+
+    def ler_malhas(self, niveis=None, codigos=None, colunas=None):
+        import pandas as pd
+        import geopandas as gpd
+        entradas = self.particoes("malhas", nivel=niveis, codigo=codigos)
+        if not entradas:
+            return None
+        partes = [gpd.read_parquet(os.path.join(self.diretorio, e["arquivo"]), columns=colunas) for e in entradas]
+        return gpd.GeoDataFrame(pd.concat(partes, ignore_index=True), crs=partes[0].crs)
+
+
+_lago = None
+_lock_lago = threading.Lock()
+
+
+def lago():
+    global _lago
+    with _lock_lago:
+        if _lago is None:
+            _lago = LagoParquet()
+        return _lago
+
+
+def registrar_extracao(conjunto, dados, **chaves):
+    """
+    Grava uma extração bruta no lago quando LAGO_GRAVAR=1. Falhas só geram
+    aviso: o lago é uma cópia, não pode derrubar a extração.
+    """
+    if not lago_ativo() or dados is None or len(dados) == 0:
+        return None
+    gravadores = {
+        "sidra": lambda: lago().gravar_sidra(dados, chaves["tabela"], chaves["nivel"]),
+        "localidades": lambda: lago().gravar_localidades(dados, chaves["nivel"]),
+        "malhas": lambda: lago().gravar_malha(dados, chaves["nivel"], chaves.get("codigo")),
+    }
+    try:
+        return gravadores[conjunto]()
+    except Exception as e:
+        logger.warning(f"Não foi possível gravar a extração {conjunto} {chaves} no lago: {e}")
+        return None
+
+
+# ------------------------------
+# Reprocessamento a partir do lago
+# ------------------------------
+def reprocessar_tabela(tabela, periodos=None, niveis=None, hierarquia=None):
+    """
+    Refaz pivot, carga e agregados de uma tabela SIDRA a partir do lago,
+    sem chamar a API. Com `periodos`, só esses períodos são substituídos
+    no banco; sem, a tabela inteira é recarregada.
+
+    Retorna:
+        str: status gravado em pnad_log_extracao (ou "SEM_DADOS")
+    """
+    from api_PNDA import processar_tabela
+
+    df = lago().ler_sidra(tabela, periodos, niveis, colunas=COLUNAS_PIVOT)
+    if df.empty:
+        logger.warning(f"Nada no lago para a tabela {tabela} (períodos {periodos or 'todos'}, níveis {niveis or 'todos'})")
+        return "SEM_DADOS"
+    logger.info(f"Reprocessando tabela {tabela} a partir do lago: {len(df)} linhas")
+    return processar_tabela(
+        tabela, hierarquia, modo="periodos" if periodos else "substituir", df_sidra=df,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lago Parquet das extrações brutas SIDRA/IBGE")
+    parser.add_argument("--diretorio", default=None, help=f"Raiz do lago (padrão: {LAGO_DIR})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_listar = sub.add_parser("listar", help="Partições registradas no manifesto")
+    p_listar.add_argument("conjunto", choices=list(PARTICOES))
+    p_listar.add_argument("--tabela")
+
+    p_reprocessar = sub.add_parser("reprocessar", help="Pivota e carrega tabelas SIDRA a partir do lago")
+    p_reprocessar.add_argument("tabelas", nargs="+")
+    p_reprocessar.add_argument("--periodos", nargs="*", help="Códigos de período (D2C); padrão: todos")
+    p_reprocessar.add_argument("--niveis", nargs="*", help="Níveis geográficos; padrão: todos")
+
+    args = parser.parse_args(argv)
+    global _lago
+    if args.diretorio:
+        _lago = LagoParquet(args.diretorio)
+
+    if args.comando == "listar":
+        filtros = {"tabela": args.tabela} if args.conjunto == "sidra" else {}
+        for entrada in lago().particoes(args.conjunto, **filtros):
+            print(f"{entrada['arquivo']}  {entrada['linhas']:>9} linhas  {entrada['bytes'] / 1024:>9.1f} KiB  {entrada['extraido_em']}")
+        return 0
+
+    from armazenamento import armazenamento
+    from hierarquia_territorial import carregar_ou_construir
+    hierarquia = carregar_ou_construir(armazenamento().conectar)
+    resultados = {t: reprocessar_tabela(t, args.periodos, args.niveis, hierarquia) for t in args.tabelas}
+    for tabela, status in resultados.items():
+        print(f"{tabela}: {status}")
+    return 0 if all(s == "SUCESSO" for s in resultados.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import os
+import json
+import math
+import shutil
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from database import DatabaseConnection, carregar_config
+
+logger = logging.getLogger(__name__)
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+ZOOM_MAX = int(os.getenv('TILES_ZOOM_MAX', 12))
+EXTENT = 4096
+BUFFER_PIXELS = 64
+TAMANHO_TILE = 256
+RAIO_TERRA = 6378137.0
+LIMITE_MERCATOR = math.pi * RAIO_TERRA
+TABELA_SIMPLIFICADAS = "ibge_malhas_simplificadas"
+NIVEIS_MALHAS = ("N1", "N2", "N3", "N6")
+
+
+def diretorio_cache_tiles():
+    return os.getenv('TILES_CACHE_DIR', 'cache_tiles')
+
+
+def tolerancia_zoom(zoom):
+    """Tamanho de um pixel (em graus) no zoom dado: abaixo disso o detalhe é invisível"""
+    return 360.0 / (TAMANHO_TILE * 2 ** zoom)
+
+
+# ------------------------------
+# Geometria de tiles (XYZ / Web Mercator)
+# ------------------------------
+def limites_tile_mercator(z, x, y):
+    """Retorna (minx, miny, maxx, maxy) do tile em metros (EPSG:3857)"""
+    tamanho = 2 * LIMITE_MERCATOR / 2 ** z
+    minx = -LIMITE_MERCATOR + x * tamanho
+    maxy = LIMITE_MERCATOR - y * tamanho
+    return minx, maxy - tamanho, minx + tamanho, maxy
+
+
+def _lonlat_para_mercator(coords):
+    lat = np.clip(coords[:, 1], -85.05112878, 85.05112878)
+    x = np.radians(coords[:, 0]) * RAIO_TERRA
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * RAIO_TERRA
+    return np.column_stack([x, y])
+
+
+def para_mercator(geometrias):
+    import shapely
+    return shapely.transform(geometrias, _lonlat_para_mercator)
+
+
+# ------------------------------
+# Pré-cálculo das simplificações
+# ------------------------------
+def _codigo_malha(codigo_ibge, propriedades):
+    if codigo_ibge:
+        return str(codigo_ibge)
+    try:
+        props = json.loads(propriedades) if propriedades else {}
+    except (TypeError, ValueError):
+        props = {}
+    return str(props.get('codarea') or props.get('ibge_code') or '')
+
+
+def simplificar_nivel(geometrias, zoom):
+    """
+    Simplifica as geometrias de um mesmo nível para o zoom.
+
+    Com GEOS >= 3.12 usa coverage_simplify, que simplifica as fronteiras
+    compartilhadas uma única vez (vizinhos continuam encaixados). Caso
+    contrário, ou se a malha não for uma cobertura válida, cai para
+    simplify(preserve_topology=True) geometria a geometria.
+    """
+    import shapely
+    tolerancia = tolerancia_zoom(zoom)
+    if hasattr(shapely, 'coverage_simplify') and len(geometrias) > 1:
+        try:
+            return shapely.coverage_simplify(geometrias, tolerancia)
+        except Exception as e:
+            logger.warning(f"coverage_simplify falhou no zoom {zoom}, usando simplify: {e}")
+    return shapely.simplify(geometrias, tolerancia, preserve_topology=True)
+
+
+def criar_tabela_simplificadas(cursor):
+    cursor.execute(f"""
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{TABELA_SIMPLIFICADAS}' AND xtype='U')
+    BEGIN
+        CREATE TABLE {TABELA_SIMPLIFICADAS} (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            malha_id INT,
+            codigo_ibge NVARCHAR(50),
+            nome NVARCHAR(255),
+            nivel_geografico NVARCHAR(10),
+            zoom INT,
+            min_lon FLOAT, min_lat FLOAT, max_lon FLOAT, max_lat FLOAT,
+            geometria VARBINARY(MAX),
+            data_criacao DATETIME DEFAULT GETDATE()
+        )
+        CREATE NONCLUSTERED INDEX IX_{TABELA_SIMPLIFICADAS}_zoom
+            ON {TABELA_SIMPLIFICADAS} (zoom, nivel_geografico)
+    END
+    """)
+
+
+def precomputar_simplificacoes(zoom_max=ZOOM_MAX):
+    """
+    Lê ibge_malhas, gera uma versão simplificada por nível de zoom
+    (0..zoom_max) e grava em ibge_malhas_simplificadas. O cache de tiles
+    em disco é apagado, já que os tiles antigos ficam desatualizados, e a
+    carga é registrada em ibge_log_extracao (tipo SIMPLIFICACAO) para a API
+    descartar as camadas e respostas em memória.
+    """
+    import shapely
+    from shapely import wkt, wkb
+    db = DatabaseConnection()
+    conn = db.get_connection()
+    if not conn:
+        logger.error("Não foi possível conectar ao banco de dados")
+        return False
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, codigo_ibge, nome, nivel_geografico, geometria, propriedades
+            FROM ibge_malhas
+            WHERE geometria IS NOT NULL AND geometria <> ''
+        """)
+        linhas = cursor.fetchall()
+        if not linhas:
+            logger.warning("Nenhuma malha encontrada em ibge_malhas")
+            return False
+
+        criar_tabela_simplificadas(cursor)
+        cursor.execute(f"TRUNCATE TABLE {TABELA_SIMPLIFICADAS}")
+
+        por_nivel = {}
+        for malha_id, codigo_ibge, nome, nivel, geometria, propriedades in linhas:
+            try:
+                geom = wkt.loads(geometria)
+            except Exception as e:
+                logger.warning(f"Geometria inválida na malha {malha_id}: {e}")
+                continue
+            por_nivel.setdefault(nivel, []).append(
+                (malha_id, _codigo_malha(codigo_ibge, propriedades), nome or '', geom)
+            )
+
+        insert_query = f"""
+        INSERT INTO {TABELA_SIMPLIFICADAS}
+        (malha_id, codigo_ibge, nome, nivel_geografico, zoom, min_lon, min_lat, max_lon, max_lat, geometria)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        cursor.fast_executemany = True
+        total = 0
+        for nivel, itens in por_nivel.items():
+            geometrias = np.array([item[3] for item in itens], dtype=object)
+            for zoom in range(zoom_max + 1):
+                simplificadas = simplificar_nivel(geometrias, zoom)
+                limites = shapely.bounds(simplificadas)
+                registros = [
+                    (item[0], item[1], item[2], nivel, zoom, *map(float, limites[i]), wkb.dumps(simplificadas[i]))
+                    for i, item in enumerate(itens)
+                    if not shapely.is_empty(simplificadas[i])
+                ]
+                cursor.executemany(insert_query, registros)
+                total += len(registros)
+            logger.info(f"Nível {nivel}: {len(itens)} malhas simplificadas em {zoom_max + 1} zooms")
+
+        cursor.execute("""
+            INSERT INTO ibge_log_extracao
+            (tipo_extracao, nivel_geografico, codigo_ibge, registros_extraidos, status, mensagem, data_extracao)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            "SIMPLIFICACAO", "ALL", "ALL", total, "SUCESSO",
+            f"{total} geometrias simplificadas em {zoom_max + 1} zooms", datetime.now()
+        ))
+        conn.commit()
+        limpar_cache_tiles()
+        logger.info(f"{total} geometrias simplificadas gravadas em {TABELA_SIMPLIFICADAS}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao pré-calcular simplificações: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def limpar_cache_tiles():
+    shutil.rmtree(diretorio_cache_tiles(), ignore_errors=True)
+
+
+# ------------------------------
+# Leitura e geração de tiles
+# ------------------------------
+class CamadaZoom:
+    """Geometrias simplificadas de um zoom, com índice espacial STRtree"""
+
+    def __init__(self, registros):
+        import shapely
+        from shapely import wkb
+        self.codigos = [r[0] for r in registros]
+        self.nomes = [r[1] for r in registros]
+        self.niveis = [r[2] for r in registros]
+        self.geometrias = np.array([wkb.loads(bytes(r[3])) for r in registros], dtype=object)
+        self.mercator = para_mercator(self.geometrias) if len(registros) else self.geometrias
+        self.arvore = shapely.STRtree(self.mercator)
+
+    def consultar(self, caixa, nivel=None):
+        indices = self.arvore.query(caixa) if len(self.mercator) else []
+        return [i for i in indices if nivel is None or self.niveis[i] == nivel]
+
+
+class ServidorMalhas:
+    """
+    Serve tiles MVT e GeoJSON simplificado a partir de
+    ibge_malhas_simplificadas. As camadas de cada zoom são carregadas sob
+    demanda e os tiles gerados ficam em disco (TILES_CACHE_DIR).
+    """
+
+    def __init__(self, conn_factory):
+        self.conn_factory = conn_factory
+        self._camadas = {}
+        self._lock = threading.Lock()
+
+    def camada(self, zoom):
+        zoom = min(max(int(zoom), 0), ZOOM_MAX)
+        with self._lock:
+            if zoom in self._camadas:
+                return self._camadas[zoom]
+        conn = self.conn_factory()
+        if not conn:
+            raise ConnectionError("Não foi possível conectar ao banco de dados")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT codigo_ibge, nome, nivel_geografico, geometria
+                FROM {TABELA_SIMPLIFICADAS}
+                WHERE zoom = ?
+            """, (zoom,))
+            camada = CamadaZoom(cursor.fetchall())
+        finally:
+            conn.close()
+        with self._lock:
+            self._camadas[zoom] = camada
+        return camada
+
+    def recarregar(self):
+        """Descarta as camadas em memória e os tiles em disco (simplificações refeitas)"""
+        with self._lock:
+            self._camadas.clear()
+            limpar_cache_tiles()
+
+    def _caminho_tile(self, z, x, y, nivel):
+        if nivel is not None and nivel not in NIVEIS_MALHAS:
+            raise ValueError(f"Nível geográfico inválido: {nivel!r}")
+        base = os.path.realpath(diretorio_cache_tiles())
+        caminho = os.path.realpath(os.path.join(base, nivel or 'todos', str(int(z)), str(int(x)), f"{int(y)}.mvt"))
+        if os.path.commonpath([base, caminho]) != base:
+            raise ValueError(f"Caminho de tile fora do cache: {caminho}")
+        return caminho
+
+    def tile(self, z, x, y, nivel=None):
+        """
+        Retorna os bytes do tile MVT (do cache em disco ou gerado agora).
+        Só zooms até ZOOM_MAX; tiles sem feições não são gravados em disco.
+        """
+        if not 0 <= z <= ZOOM_MAX:
+            raise ValueError(f"Zoom fora do intervalo 0..{ZOOM_MAX}: {z}")
+        caminho = self._caminho_tile(z, x, y, nivel)
+        if os.path.exists(caminho):
+            with open(caminho, 'rb') as f:
+                return f.read()
+
+        conteudo, quantidade = self._gerar_tile(z, x, y, nivel)
+        if not quantidade:
+            return conteudo
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+        return conteudo
+
+    def _gerar_tile(self, z, x, y, nivel):
+        import shapely
+        import mapbox_vector_tile
+
+        minx, miny, maxx, maxy = limites_tile_mercator(z, x, y)
+        margem = (maxx - minx) * BUFFER_PIXELS / EXTENT
+        caixa = shapely.box(minx - margem, miny - margem, maxx + margem, maxy + margem)
+
+        camada = self.camada(z)
+        features = []
+        for i in camada.consultar(caixa, nivel):
+            recortada = shapely.clip_by_rect(camada.mercator[i], *caixa.bounds)
+            if recortada.is_empty:
+                continue
+            features.append({
+                "geometry": recortada,
+                "properties": {
+                    "codigo_ibge": camada.codigos[i],
+                    "nome": camada.nomes[i],
+                    "nivel_geografico": camada.niveis[i],
+                },
+            })
+
+        conteudo = mapbox_vector_tile.encode(
+            [{"name": "malhas", "features": features}],
+            default_options={"quantize_bounds": (minx, miny, maxx, maxy), "extents": EXTENT},
+        )
+        return conteudo, len(features)
+
+    def geojson(self, zoom, nivel=None, codigos=None):
+        """FeatureCollection com a geometria simplificada do zoom pedido"""
+        from shapely.geometry import mapping
+        camada = self.camada(zoom)
+        codigos = set(codigos) if codigos else None
+        features = []
+        for i, geometria in enumerate(camada.geometrias):
+            if nivel and camada.niveis[i] != nivel:
+                continue
+            if codigos and camada.codigos[i] not in codigos:
+                continue
+            features.append({
+                "type": "Feature",
+                "id": camada.codigos[i],
+                "geometry": mapping(geometria),
+                "properties": {
+                    "codigo_ibge": camada.codigos[i],
+                    "nome": camada.nomes[i],
+                    "nivel_geografico": camada.niveis[i],
+                },
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print("🗺️ Pré-calculando simplificações das malhas...")
+    if precomputar_simplificacoes():
+        print("✅ Simplificações gravadas com sucesso!")
+    else:
+        print("❌ Falha ao pré-calcular simplificações. Verifique os logs.")
@@ -0,0 +1,135 @@
+import logging
+import functools
+import threading
+from metricas import REGISTRO
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------
+# Memoização com coalescência (single-flight)
+# ------------------------------
+class _Voo:
+    """Busca em andamento: quem chega depois espera o evento e reaproveita o resultado"""
+    __slots__ = ("evento", "resultado", "erro")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class MemoExecucao:
+    """
+    Resultados de buscas (localidades, malhas...) guardados durante uma
+    execução. Pedidos repetidos do mesmo recurso devolvem o resultado já
+    interpretado; pedidos simultâneos esperam a busca em andamento em vez
+    de repeti-la. Resultados None (falha) não são guardados: o próximo
+    pedido tenta de novo.
+    """
+
+    def __init__(self, nome):
+        self.nome = nome
+        self._lock = threading.Lock()
+        self._resultados = {}
+        self._em_voo = {}
+        self.estatisticas = {}  # recurso → {"acertos", "faltas", "coalescidos"}
+
+    def _contar(self, chave, tipo):
+        recurso = chave[0] if isinstance(chave, tuple) else str(chave)
+        contagem = self.estatisticas.setdefault(recurso, {"acertos": 0, "faltas": 0, "coalescidos": 0})
+        contagem[tipo] += 1
+
+    def obter(self, chave, carregar):
+        with self._lock:
+            if chave in self._resultados:
+                self._contar(chave, "acertos")
+                return self._resultados[chave]
+            voo = self._em_voo.get(chave)
+            dono = voo is None
+            if dono:
+                voo = self._em_voo[chave] = _Voo()
+                self._contar(chave, "faltas")
+            else:
+                self._contar(chave, "coalescidos")
+
+        if not dono:
+            voo.evento.wait()
+            if voo.erro is not None:
+                raise voo.erro
+            return voo.resultado
+
+        try:
+            voo.resultado = carregar()
+            return voo.resultado
+        except BaseException as e:
+            voo.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._em_voo[chave]
+                if voo.erro is None and voo.resultado is not None:
+                    self._resultados[chave] = voo.resultado
+            voo.evento.set()
+
+    def relatorio(self):
+        """Loga e exporta (Prometheus) acertos, faltas e pedidos coalescidos por recurso"""
+        for recurso, contagem in sorted(self.estatisticas.items()):
+            total = sum(contagem.values())
+            reaproveitados = contagem["acertos"] + contagem["coalescidos"]
+            logger.info(
+                f"Memoização ({self.nome}) {recurso}: {contagem['acertos']} acertos, {contagem['faltas']} faltas, "
+                f"{contagem['coalescidos']} coalescidos ({reaproveitados / total:.0%} reaproveitados)"
+            )
+            for tipo, valor in contagem.items():
+                REGISTRO.incrementar(
+                    f"pnad_memo_{tipo}_total", valor, {"execucao": self.nome, "recurso": recurso},
+                    f"Pedidos memoizados por execução: {tipo}",
+                )
+
+
+# ------------------------------
+# Escopo da execução
+# ------------------------------
+_ativa = None
+_profundidade = 0
+_lock_ativa = threading.Lock()
+
+
+def memoizar(chave, carregar):
+    """
+    Devolve o resultado de `carregar()` memoizado pela `chave` na execução
+    ativa. Fora de uma execução (ex.: API em processo longo) apenas chama
+    `carregar`, para não servir dados antigos.
+    """
+    with _lock_ativa:
+        memo = _ativa
+    return memo.obter(chave, carregar) if memo is not None else carregar()
+
+
+def execucao_memoizada(nome):
+    """
+    Decorador: a função delimita uma execução memoizada. Execuções aninhadas
+    (ex.: extract_all_ibge_data dentro do pipeline) compartilham a de fora,
+    que ao terminar reporta as estatísticas e descarta os resultados.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            global _ativa, _profundidade
+            with _lock_ativa:
+                if _ativa is None:
+                    _ativa = MemoExecucao(nome)
+                _profundidade += 1
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                with _lock_ativa:
+                    _profundidade -= 1
+                    memo = _ativa if _profundidade == 0 else None
+                    if memo is not None:
+                        _ativa = None
+                if memo is not None:
+                    memo.relatorio()
+        return envolvida
+    return decorador
@@ -0,0 +1,167 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+MEMORIA_ORCAMENTO_MB = float(os.getenv('MEMORIA_ORCAMENTO_MB', 0))  # 0 = sem orçamento
+
+# Dimensões do SIDRA: nível (NC/NN), unidade (MC/MN) e D1..D9 (código/nome)
+PADRAO_DIMENSAO = re.compile(r"^(NC|NN|MC|MN|D\dC|D\dN)$")
+# Valor numérico do SIDRA; marcadores ("..", "...", "-", "X") não contam casas decimais
+PADRAO_NUMERO = r"^\s*[-+]?\d+(\.\d+)?\s*$"
+# Metadados que get_sidra_table acrescenta: iguais em todas as linhas do frame
+CONSTANTES_SIDRA = ("Tabela_ID", "Data_Extracao", "Nivel_Geografico")
+# Metadados repetidos por linha nas localidades e malhas do IBGE
+COLUNAS_METADADOS_GEO = ("geo_level", "ibge_code")
+
+
+def memoria_compacta():
+    """Modo de memória compacta ligado (MEMORIA_COMPACTA=1)"""
+    return os.getenv('MEMORIA_COMPACTA', '0') == '1'
+
+
+def medir_pegada():
+    # memory_usage(deep=True) percorre as colunas de objetos: só quando alguém vai usar
+    return memoria_compacta() or MEMORIA_ORCAMENTO_MB > 0 or os.getenv('METRICAS_MEMORIA', '0') == '1'
+
+
+def pegada_bytes(df):
+    """Memória ocupada pelo DataFrame (inclusive strings), ou 0 se a medição estiver desligada"""
+    if df is None or not medir_pegada():
+        return 0
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+# ------------------------------
+# Valores
+# ------------------------------
+def _casas_decimais(textos):
+    """Maior número de casas decimais entre os textos numéricos da série"""
+    textos = textos[textos.map(type) == str]
+    textos = textos[textos.str.match(PADRAO_NUMERO)].str.strip()
+    ponto = textos.str.find(".")
+    casas = (textos.str.len() - ponto - 1)[ponto >= 0]
+    return int(casas.max()) if len(casas) else 0
+
+
+def compactar_valores(serie):
+    """
+    Converte a coluna V (texto) para o menor tipo numérico sem perda em
+    relação à precisão publicada pelo SIDRA:
+
+    - inteiros que cabem em 32 bits → Int32 (nulo = marcador "..", "-", "X"...);
+    - decimais → float32, se arredondar o float32 às casas decimais da
+      fonte devolve exatamente o float64; senão float64.
+
+    Retorna:
+        (série, casas decimais, dtype que o pd.to_numeric original teria dado)
+    """
+    import numpy as np
+    import pandas as pd
+
+    numeros = pd.to_numeric(serie, errors='coerce')
+    tipo_original = str(numeros.dtype)
+    if not pd.api.types.is_numeric_dtype(serie):
+        casas = _casas_decimais(serie.dropna())
+    else:
+        casas = 0 if pd.api.types.is_integer_dtype(numeros) else None
+
+    validos = numeros.dropna()
+    if casas == 0 and (validos.empty or (validos.abs().max() < 2 ** 31 and (validos % 1 == 0).all())):
+        return numeros.astype("Int32"), 0, tipo_original
+    if casas is not None:
+        reduzidos = numeros.astype("float32")
+        if np.array_equal(np.round(reduzidos.to_numpy(dtype="float64"), casas), numeros.to_numpy(), equal_nan=True):
+            return reduzidos, casas, tipo_original
+    return numeros.astype("float64"), casas, tipo_original
+
+
+def restaurar_valores(df, colunas, casas, tipo_original):
+    """Volta as colunas de valores ao dtype que o caminho sem compactação produziria"""
+    import numpy as np
+
+    for coluna in colunas:
+        serie = df[coluna]
+        if tipo_original.startswith("int") and not serie.isna().any():
+            df[coluna] = serie.astype(tipo_original)
+        else:
+            valores = serie.astype("float64")
+            df[coluna] = np.round(valores, casas) if casas else valores
+    return df
+
+
+# ------------------------------
+# Frames do SIDRA
+# ------------------------------
+def dataframe_sidra(dados, constantes, cabecalho=True):
+    """
+    Monta a forma longa direto da resposta do SIDRA (lista de dicts,
+    a primeira é o cabeçalho, exceto com /h/n) sem passar por um frame de objetos: cada
+    coluna vira categórica (dimensões) ou numérica (V) assim que é lida,
+    e as constantes (Tabela_ID, Data_Extracao, Nivel_Geografico) ficam em
+    df.attrs em vez de repetidas em cada linha.
+    """
+    import pandas as pd
+
+    linhas = dados[1:] if cabecalho else dados
+    colunas = {}
+    atributos = {}
+    for coluna in linhas[0].keys():
+        valores = [linha.get(coluna) for linha in linhas]
+        if coluna == "V":
+            serie, casas, tipo_original = compactar_valores(pd.Series(valores, dtype=object))
+            colunas[coluna] = serie
+            atributos = {"casas_decimais": casas, "tipo_valores": tipo_original}
+        else:
+            colunas[coluna] = pd.Categorical(valores)
+        del valores
+    df = pd.DataFrame(colunas)
+    df.attrs.update(atributos, constantes=dict(constantes))
+    return df
+
+
+def compactar_sidra(df):
+    """Mesma compactação de dataframe_sidra para um frame já montado (ex.: lido do lago)"""
+    import pandas as pd
+
+    if df is None or df.empty or "constantes" in df.attrs:
+        return df
+    df = df.copy()
+    constantes = {}
+    for coluna in CONSTANTES_SIDRA:
+        if coluna in df.columns and df[coluna].nunique(dropna=False) == 1:
+            constantes[coluna] = df[coluna].iloc[0]
+            df = df.drop(columns=coluna)
+    for coluna in df.columns:
+        if PADRAO_DIMENSAO.match(coluna) and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype("category")
+    if "V" in df.columns:
+        df["V"], casas, tipo_original = compactar_valores(df["V"])
+        df.attrs.update(casas_decimais=casas, tipo_valores=tipo_original)
+    df.attrs["constantes"] = constantes
+    return df
+
+
+def expandir_constantes(df, constantes, ordem):
+    """Devolve as constantes como colunas, nas posições de `ordem`"""
+    for posicao, coluna in enumerate(ordem):
+        if coluna in constantes and coluna not in df.columns:
+            df.insert(min(posicao, len(df.columns)), coluna, constantes[coluna])
+    return df
+
+
+# ------------------------------
+# Frames do IBGE
+# ------------------------------
+def compactar_geo(df):
+    """Metadados repetidos por linha (nível, código) das localidades e malhas viram categóricos"""
+    if df is None or df.empty:
+        return df
+    for coluna in COLUNAS_METADADOS_GEO:
+        if coluna in df.columns and df[coluna].dtype == object:
+            df[coluna] = df[coluna].astype("category")
+    return df
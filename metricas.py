@@ -0,0 +1,267 @@
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from perfilamento import perfilar
+from memoria_compacta import MEMORIA_ORCAMENTO_MB
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+ETAPAS = ("fetch", "decode", "pivot", "create_table", "insert", "tratamento")
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Colunas de métricas acrescentadas a pnad_log_extracao e ibge_log_extracao
+# (tipos lógicos de armazenamento.py)
+COLUNAS_LOG = [(f"tempo_{etapa}_ms", "real") for etapa in ETAPAS] + [
+    ("duracao_total_ms", "real"),
+    ("bytes_transferidos", "inteiro_grande"),
+    ("pico_memoria_mb", "real"),
+    ("memoria_dados_mb", "real"),
+    ("hash_conteudo", "texto(64)"),
+]
+
+
+# ------------------------------
+# Registro de métricas no formato Prometheus
+# ------------------------------
+class RegistroMetricas:
+    """Contadores e histogramas em memória, exportados em texto Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}
+        self._medidores = {}
+        self._ajuda = {}
+
+    @staticmethod
+    def _chave(rotulos):
+        return tuple(sorted((rotulos or {}).items()))
+
+    def incrementar(self, nome, valor=1, rotulos=None, ajuda=""):
+        with self._lock:
+            self._ajuda.setdefault(nome, ("counter", ajuda))
+            serie = self._contadores.setdefault(nome, {})
+            chave = self._chave(rotulos)
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def definir(self, nome, valor, rotulos=None, ajuda=""):
+        with self._lock:
+            self._ajuda.setdefault(nome, ("gauge", ajuda))
+            self._medidores.setdefault(nome, {})[self._chave(rotulos)] = valor
+
+    def observar(self, nome, valor, rotulos=None, ajuda=""):
+        with self._lock:
+            self._ajuda.setdefault(nome, ("histogram", ajuda))
+            serie = self._histogramas.setdefault(nome, {})
+            chave = self._chave(rotulos)
+            if chave not in serie:
+                serie[chave] = {"baldes": [0] * len(LIMITES_HISTOGRAMA), "soma": 0.0, "total": 0}
+            dados = serie[chave]
+            for i, limite in enumerate(LIMITES_HISTOGRAMA):
+                if valor <= limite:
+                    dados["baldes"][i] += 1
+            dados["soma"] += valor
+            dados["total"] += 1
+
+    @staticmethod
+    def _rotulos(chave, extra=()):
+        itens = list(chave) + list(extra)
+        if not itens:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v)}"' for k, v in itens) + "}"
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)"""
+        linhas = []
+        with self._lock:
+            for nome, (tipo, ajuda) in sorted(self._ajuda.items()):
+                if ajuda:
+                    linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                if tipo == "counter":
+                    for chave, valor in self._contadores.get(nome, {}).items():
+                        linhas.append(f"{nome}{self._rotulos(chave)} {valor}")
+                elif tipo == "gauge":
+                    for chave, valor in self._medidores.get(nome, {}).items():
+                        linhas.append(f"{nome}{self._rotulos(chave)} {valor}")
+                else:
+                    for chave, dados in self._histogramas.get(nome, {}).items():
+                        for limite, quantidade in zip(LIMITES_HISTOGRAMA, dados["baldes"]):
+                            linhas.append(f"{nome}_bucket{self._rotulos(chave, [('le', limite)])} {quantidade}")
+                        linhas.append(f"{nome}_bucket{self._rotulos(chave, [('le', '+Inf')])} {dados['total']}")
+                        linhas.append(f"{nome}_sum{self._rotulos(chave)} {dados['soma']}")
+                        linhas.append(f"{nome}_count{self._rotulos(chave)} {dados['total']}")
+        return "\n".join(linhas) + "\n"
+
+
+REGISTRO = RegistroMetricas()
+
+
+# ------------------------------
+# Medição por etapa
+# ------------------------------
+def iniciar_rastreamento_memoria():
+    """Liga o tracemalloc quando METRICAS_MEMORIA=1 (pico de memória por etapa)"""
+    if os.getenv('METRICAS_MEMORIA', '0') == '1' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _pico_memoria_bytes():
+    """Pico da etapa (desde o reset_peak); None sem o tracemalloc ligado"""
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return None
+
+
+def _pico_processo_bytes():
+    if resource is not None:
+        # ru_maxrss: KB no Linux; é o pico do processo inteiro, não o da etapa
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+class MedicaoEtapa:
+    __slots__ = ("bytes", "linhas", "memoria")
+
+    def __init__(self):
+        self.bytes = 0
+        self.linhas = 0
+        self.memoria = 0  # Bytes do frame que a etapa produziu (memoria_compacta.pegada_bytes)
+
+
+class MedicaoExecucao:
+    """
+    Métricas de uma extração (uma tabela SIDRA ou uma operação IBGE).
+    Etapas repetidas (ex.: várias tentativas de fetch) são somadas.
+    """
+
+    def __init__(self, pipeline, alvo=""):
+        self.pipeline = pipeline
+        self.alvo = alvo
+        self.etapas = {}
+        self.inicio = time.perf_counter()
+        self.hash_conteudo = None  # SHA-256 do payload (assinatura_conteudo.py)
+
+    def registrar(self, etapa, duracao, bytes_=0, linhas=0, pico=None, memoria=0):
+        dados = self.etapas.setdefault(
+            etapa, {"duracao_s": 0.0, "bytes": 0, "linhas": 0, "pico_memoria_bytes": None, "memoria_dados_bytes": 0}
+        )
+        dados["duracao_s"] += duracao
+        dados["bytes"] += bytes_
+        dados["linhas"] = max(dados["linhas"], linhas)
+        dados["memoria_dados_bytes"] = max(dados["memoria_dados_bytes"], memoria)
+        if pico is not None:
+            dados["pico_memoria_bytes"] = max(dados["pico_memoria_bytes"] or 0, pico)
+
+    @property
+    def bytes_transferidos(self):
+        return sum(d["bytes"] for d in self.etapas.values())
+
+    @property
+    def pico_memoria_bytes(self):
+        picos = [d["pico_memoria_bytes"] for d in self.etapas.values() if d["pico_memoria_bytes"] is not None]
+        return max(picos) if picos else None
+
+    def valores_log(self):
+        """Valores das COLUNAS_LOG para gravar junto com o log de extração"""
+        valores = {}
+        for etapa in ETAPAS:
+            dados = self.etapas.get(etapa)
+            valores[f"tempo_{etapa}_ms"] = round(dados["duracao_s"] * 1000, 3) if dados else None
+        valores["duracao_total_ms"] = round((time.perf_counter() - self.inicio) * 1000, 3)
+        valores["bytes_transferidos"] = self.bytes_transferidos
+        pico = self.pico_memoria_bytes
+        valores["pico_memoria_mb"] = round(pico / 1024 / 1024, 3) if pico is not None else None
+        memoria = max((d["memoria_dados_bytes"] for d in self.etapas.values()), default=0)
+        valores["memoria_dados_mb"] = round(memoria / 1024 / 1024, 3) if memoria else None
+        valores["hash_conteudo"] = self.hash_conteudo
+        return valores
+
+    def pegada_por_etapa(self):
+        """{etapa: MB do frame produzido} das etapas que mediram a pegada"""
+        return {
+            etapa: round(d["memoria_dados_bytes"] / 1024 / 1024, 3)
+            for etapa, d in self.etapas.items() if d["memoria_dados_bytes"]
+        }
+
+    def finalizar(self, status):
+        REGISTRO.incrementar(
+            "pnad_extracoes_total", rotulos={"pipeline": self.pipeline, "status": status},
+            ajuda="Extrações finalizadas por status"
+        )
+        REGISTRO.observar(
+            "pnad_extracao_duracao_segundos", time.perf_counter() - self.inicio,
+            rotulos={"pipeline": self.pipeline}, ajuda="Duração total de cada extração"
+        )
+
+
+@contextmanager
+def medir_etapa(medicao, etapa):
+    """
+    Mede tempo de parede, bytes, linhas e pico de memória de uma etapa.
+    O bloco pode preencher `.bytes` e `.linhas` do objeto retornado.
+    Com PERFIL_MODO ligado, a etapa também é perfilada (perfilamento.py).
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    dados = MedicaoEtapa()
+    inicio = time.perf_counter()
+    try:
+        with perfilar(etapa):
+            yield dados
+    finally:
+        duracao = time.perf_counter() - inicio
+        pico = _pico_memoria_bytes()
+        pipeline = medicao.pipeline if medicao else "desconhecido"
+        rotulos = {"pipeline": pipeline, "etapa": etapa}
+        REGISTRO.observar("pnad_etapa_duracao_segundos", duracao, rotulos, "Tempo de parede por etapa")
+        REGISTRO.incrementar("pnad_etapa_bytes_total", dados.bytes, rotulos, "Bytes transferidos por etapa")
+        REGISTRO.incrementar("pnad_etapa_linhas_total", dados.linhas, rotulos, "Linhas processadas por etapa")
+        if pico is not None:
+            REGISTRO.definir("pnad_etapa_pico_memoria_bytes", pico, rotulos, "Pico de memória da última execução da etapa")
+        pico_processo = _pico_processo_bytes()
+        if pico_processo is not None:
+            REGISTRO.definir(
+                "pnad_processo_pico_memoria_bytes", pico_processo, {"pipeline": pipeline}, "Pico de memória do processo (ru_maxrss)"
+            )
+        if dados.memoria:
+            REGISTRO.definir(
+                "pnad_etapa_memoria_dados_bytes", dados.memoria, rotulos, "Memória do frame produzido na última execução da etapa"
+            )
+            _verificar_orcamento(medicao, etapa, dados.memoria, rotulos)
+        if medicao is not None:
+            medicao.registrar(etapa, duracao, dados.bytes, dados.linhas, pico, dados.memoria)
+
+
+def _verificar_orcamento(medicao, etapa, memoria, rotulos):
+    if MEMORIA_ORCAMENTO_MB <= 0 or memoria <= MEMORIA_ORCAMENTO_MB * 1024 * 1024:
+        return
+    alvo = f"{medicao.pipeline} {medicao.alvo}" if medicao else "desconhecido"
+    logger.warning(
+        f"Etapa {etapa} de {alvo} ocupa {memoria / 1024 / 1024:.1f} MB, acima do orçamento de "
+        f"{MEMORIA_ORCAMENTO_MB:.0f} MB (MEMORIA_COMPACTA=1 reduz a forma longa do SIDRA)"
+    )
+    REGISTRO.incrementar("pnad_orcamento_memoria_excedido_total", rotulos=rotulos, ajuda="Etapas acima de MEMORIA_ORCAMENTO_MB")
+
+
+_tabelas_log_verificadas = set()
+
+
+def garantir_colunas_log(cursor, tabela):
+    """Acrescenta as colunas de métricas à tabela de log, se ainda não existirem"""
+    if tabela in _tabelas_log_verificadas:
+        return
+    from armazenamento import armazenamento
+    armazenamento().garantir_colunas(cursor, tabela, COLUNAS_LOG)
+    _tabelas_log_verificadas.add(tabela)
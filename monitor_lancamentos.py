@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from database import carregar_config
+from metricas import REGISTRO
+from assinatura_conteudo import STATUS_CONCLUIDOS
+from politica_retry import get_com_retry, PoliticaRetry, ErroRequisicao, URL_SERVICOS_IBGE
+
+logger = logging.getLogger(__name__)
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+URL_PERIODOS = URL_SERVICOS_IBGE + "/api/v3/agregados/{tabela}/periodos"
+LANCAMENTOS_INTERVALO = float(os.getenv('LANCAMENTOS_INTERVALO', 3600))
+LANCAMENTOS_JANELA_INICIAL = int(os.getenv('LANCAMENTOS_JANELA_INICIAL', 3))  # Como o "last 3" das cargas
+
+
+def caminho_estado():
+    return os.getenv('LANCAMENTOS_PATH', 'lancamentos_sidra.json')
+
+
+# ------------------------------
+# Estado: períodos já entregues por tabela
+# ------------------------------
+class EstadoLancamentos:
+    """
+    Guarda, por tabela SIDRA, os períodos já entregues para carga e a data
+    de modificação de cada um quando foram entregues. Regravado inteiro a
+    cada mudança (tmp + replace), como o cache de níveis.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or caminho_estado()
+        self._lock = threading.Lock()
+        self._dados = self._ler()
+
+    def _ler(self):
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Estado dos lançamentos ilegível ({self.caminho}), recomeçando: {e}")
+            return {}
+
+    def _gravar(self):
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self._dados, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporario, self.caminho)
+
+    def periodos(self, tabela):
+        """{período: modificação} já entregues, ou None se a tabela nunca foi verificada"""
+        with self._lock:
+            entrada = self._dados.get(str(tabela))
+            return dict(entrada["periodos"]) if entrada else None
+
+    def registrar(self, tabela, periodos):
+        with self._lock:
+            entrada = self._dados.setdefault(str(tabela), {"periodos": {}})
+            entrada["periodos"].update(periodos)
+            entrada["atualizado_em"] = datetime.now().isoformat(timespec='seconds')
+            self._gravar()
+
+
+# ------------------------------
+# Comparação com o publicado
+# ------------------------------
+def periodos_publicados(tabela):
+    """{período: data de modificação} publicados pelo IBGE para a tabela, ou None"""
+    try:
+        resposta = get_com_retry(URL_PERIODOS.format(tabela=tabela), timeout=30, politica=PoliticaRetry(tentativas=2))
+        return {str(p["id"]): p.get("modificacao") for p in resposta.json()}
+    except (ErroRequisicao, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Períodos da tabela {tabela} indisponíveis: {e}")
+        return None
+
+
+def novidades(publicados, conhecidos, janela_inicial=LANCAMENTOS_JANELA_INICIAL):
+    """
+    Períodos a carregar: os novos e os revisados (data de modificação
+    diferente da entregue). Na primeira verificação da tabela não há com o
+    que comparar: entram os `janela_inicial` períodos mais recentes e os
+    demais ficam registrados como já vistos.
+
+    Retorna:
+        (novos, revisados, vistos) — listas ordenadas e o dict a registrar
+    """
+    if conhecidos is None:
+        recentes = sorted(publicados)[-janela_inicial:] if janela_inicial > 0 else []
+        return recentes, [], dict(publicados)
+    novos = sorted(p for p in publicados if p not in conhecidos)
+    revisados = sorted(p for p in publicados if p in conhecidos and publicados[p] != conhecidos[p])
+    return novos, revisados, {p: publicados[p] for p in novos + revisados}
+
+
+# ------------------------------
+# Entrega: fila distribuída ou carga local
+# ------------------------------
+def carregar_local(tabela, periodos, hierarquia=None):
+    """Carrega só os períodos indicados, sem a fila; True se a carga foi concluída"""
+    from api_PNDA import processar_tabela
+    return processar_tabela(tabela, hierarquia, period=",".join(periodos), modo="periodos") in STATUS_CONCLUIDOS
+
+
+def verificar(tabelas, local=False, estado=None, tamanho_lote=12):
+    """
+    Uma rodada do monitor: consulta os períodos de cada tabela e entrega
+    para carga só os novos ou revisados (fila distribuída ou, com
+    local=True, processar_tabela direto). O estado só avança para os
+    períodos efetivamente entregues: um lote igual a uma unidade já
+    pendente ou em execução na fila não é inserido e fica para a próxima
+    rodada (a unidade em execução pode ter lido os dados antes da revisão).
+
+    Retorna:
+        dict {tabela: [períodos entregues]}
+    """
+    estado = estado or EstadoLancamentos()
+    hierarquia = None
+    entregues = {}
+    for tabela in tabelas:
+        publicados = periodos_publicados(tabela)
+        if not publicados:
+            continue
+        novos, revisados, vistos = novidades(publicados, estado.periodos(tabela))
+        periodos = sorted(set(novos) | set(revisados))
+        if not periodos:
+            # Primeira verificação sem janela: só registra o que já existe
+            if vistos:
+                estado.registrar(tabela, vistos)
+            logger.info(f"Tabela {tabela}: nenhum período novo ou revisado")
+            continue
+
+        logger.info(f"Tabela {tabela}: novos {novos or '-'}, revisados {revisados or '-'}")
+        try:
+            if local:
+                if hierarquia is None:
+                    from armazenamento import armazenamento
+                    from hierarquia_territorial import carregar_ou_construir
+                    hierarquia = carregar_ou_construir(armazenamento().conectar)
+                if not carregar_local(tabela, periodos, hierarquia):
+                    logger.error(f"Carga dos períodos {periodos} da tabela {tabela} falhou; nova tentativa na próxima rodada")
+                    continue
+                entregues_tabela = periodos
+            else:
+                from fila_distribuida import enfileirar, lotes_periodos
+                entregues_tabela = []
+                for lote in lotes_periodos(periodos, tamanho_lote):
+                    # Um lote por vez: enfileirar só diz quantas unidades inseriu
+                    if enfileirar([("pnad", tabela, lote)]):
+                        entregues_tabela += lote.split(",")
+                    else:
+                        logger.warning(
+                            f"Tabela {tabela}: períodos {lote} já estão na fila (pendentes ou em execução); "
+                            "nova tentativa na próxima rodada"
+                        )
+        except Exception as e:
+            logger.error(f"Não foi possível entregar os períodos da tabela {tabela}: {e}")
+            continue
+
+        # Os não entregues continuam com a modificação antiga no estado: voltam na próxima rodada
+        nao_entregues = set(periodos) - set(entregues_tabela)
+        estado.registrar(tabela, {p: m for p, m in vistos.items() if p not in nao_entregues})
+        if not entregues_tabela:
+            continue
+        entregues[tabela] = entregues_tabela
+        rotulos = {"tabela": tabela}
+        REGISTRO.incrementar(
+            "pnad_lancamentos_novos_total", len(set(novos) - nao_entregues), rotulos, "Períodos novos detectados pelo monitor"
+        )
+        REGISTRO.incrementar(
+            "pnad_lancamentos_revisados_total", len(set(revisados) - nao_entregues), rotulos,
+            "Períodos revisados detectados pelo monitor"
+        )
+    return entregues
+
+
+# ------------------------------
+# Linha de comando
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitor de lançamentos SIDRA: carrega só períodos novos ou revisados")
+    parser.add_argument("tabelas", nargs="*", help="Tabelas SIDRA (padrão: TABLE_IDS_TO_FETCH do api_PNDA.py)")
+    parser.add_argument("--local", action="store_true", help="Carrega direto em vez de enfileirar na fila distribuída")
+    parser.add_argument("--continuar", action="store_true", help="Repete a verificação a cada --intervalo segundos")
+    parser.add_argument("--intervalo", type=float, default=LANCAMENTOS_INTERVALO)
+    parser.add_argument("--tamanho-lote", type=int, default=12, help="Períodos por unidade de trabalho na fila")
+    args = parser.parse_args(argv)
+
+    tabelas = args.tabelas
+    if not tabelas:
+        from api_PNDA import TABLE_IDS_TO_FETCH
+        tabelas = TABLE_IDS_TO_FETCH
+
+    estado = EstadoLancamentos()
+    while True:
+        entregues = verificar(tabelas, args.local, estado, args.tamanho_lote)
+        logger.info(f"{len(entregues)} de {len(tabelas)} tabelas com lançamentos entregues")
+        if not args.continuar:
+            return 0
+        time.sleep(args.intervalo)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
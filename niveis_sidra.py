@@ -0,0 +1,187 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from politica_retry import (
+    get, get_com_retry, PoliticaRetry, ErroRequisicao, ErroPermanente, erro_nivel_territorial, URL_SIDRA, URL_SERVICOS_IBGE,
+)
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+URL_METADADOS = URL_SERVICOS_IBGE + "/api/v3/agregados/{tabela}/metadados"
+URL_SONDA = URL_SIDRA + "/values/t/{tabela}/v/{variaveis}/p/last%201/{nivel}/all"
+NIVEIS_PADRAO = ["n3", "n1", "n2", "n6"]
+
+
+def caminho_cache_niveis():
+    return os.getenv('NIVEIS_SIDRA_PATH', 'niveis_sidra.json')
+
+
+# ------------------------------
+# Cache persistente tabela → níveis territoriais
+# ------------------------------
+class CacheNiveis:
+    """
+    Guarda, por tabela SIDRA, os níveis territoriais publicados (dos
+    metadados ou da sondagem) e os descartados: os que responderam com 400
+    territorial ou payload vazio. Falhas transitórias não mexem no cache. O
+    arquivo é regravado inteiro a cada mudança (tmp + replace), então
+    leitores nunca veem um JSON pela metade.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or caminho_cache_niveis()
+        self._lock = threading.Lock()
+        self._dados = self._ler()
+
+    def _ler(self):
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cache de níveis SIDRA ilegível ({self.caminho}), ignorando: {e}")
+            return {}
+
+    def _gravar(self):
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self._dados, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporario, self.caminho)
+
+    def obter(self, tabela):
+        with self._lock:
+            return dict(self._dados.get(str(tabela), {}))
+
+    def atualizar(self, tabela, **campos):
+        with self._lock:
+            entrada = self._dados.setdefault(str(tabela), {})
+            if all(entrada.get(k) == v for k, v in campos.items()):
+                return
+            entrada.update(campos)
+            entrada["atualizado_em"] = datetime.now().isoformat(timespec='seconds')
+            try:
+                self._gravar()
+            except OSError as e:
+                logger.warning(f"Não foi possível gravar o cache de níveis SIDRA: {e}")
+
+    def registrar_sucesso(self, tabela, nivel):
+        """O nível devolveu dados: volta a valer, se estava descartado"""
+        descartados = self.obter(tabela).get("descartados") or []
+        if nivel.lower() in descartados:
+            self.atualizar(tabela, descartados=[n for n in descartados if n != nivel.lower()])
+
+    def registrar_falha(self, tabela, nivel):
+        """
+        O nível não serve para a tabela (400 territorial ou payload vazio):
+        passa para o fim da ordem. Não chamar para falhas transitórias.
+        """
+        descartados = self.obter(tabela).get("descartados") or []
+        if nivel.lower() not in descartados:
+            self.atualizar(tabela, descartados=descartados + [nivel.lower()])
+
+
+_cache = None
+_lock_cache = threading.Lock()
+
+
+def cache_niveis():
+    global _cache
+    with _lock_cache:
+        if _cache is None:
+            _cache = CacheNiveis()
+        return _cache
+
+
+# ------------------------------
+# Descoberta dos níveis
+# ------------------------------
+def niveis_por_metadados(tabela):
+    """Níveis territoriais publicados pela tabela (ex: ["n1", "n2", "n6"]) ou None"""
+    try:
+        resposta = get_com_retry(URL_METADADOS.format(tabela=tabela), timeout=30, politica=PoliticaRetry(tentativas=2))
+        metadados = resposta.json()
+    except (ErroRequisicao, ValueError) as e:
+        logger.warning(f"Metadados da tabela {tabela} indisponíveis: {e}")
+        return None
+    niveis = []
+    for grupo in (metadados.get("nivelTerritorial") or {}).values():
+        niveis += [str(n).lower() for n in grupo or []]
+    return niveis or None
+
+
+def _sondar(tabela, variaveis, nivel):
+    """
+    True se o nível devolve dados para o período mais recente, False se
+    não tem (400 territorial ou vazio), None se não deu para saber (falha
+    transitória)
+    """
+    try:
+        resposta = get(URL_SONDA.format(tabela=tabela, variaveis=variaveis, nivel=nivel), timeout=30)
+        dados = resposta.json()
+        return bool(dados) and len(dados) > 1
+    except ErroPermanente as e:
+        if not erro_nivel_territorial(e):
+            raise
+        return False
+    except (ErroRequisicao, ValueError):
+        return None
+
+
+def sondar_niveis(tabela, candidatos, variaveis="all"):
+    """
+    Consulta todos os candidatos em paralelo (só o último período) e
+    retorna os níveis publicados na ordem de preferência, ou None se
+    nenhum pôde ser confirmado. Níveis com falha transitória na sondagem
+    continuam na lista: só um 400 territorial ou um vazio os exclui.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(candidatos), thread_name_prefix="sonda-sidra")
+    try:
+        futuros = [(nivel, executor.submit(_sondar, tabela, variaveis, nivel)) for nivel in candidatos]
+        resultados = {}
+        for nivel, futuro in futuros:
+            try:
+                resultados[nivel] = futuro.result()
+            except ErroPermanente as e:
+                logger.error(f"Tabela {tabela} rejeitada pelo SIDRA durante a sondagem: {e}")
+                return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if not any(resultados.values()):
+        return None
+    return [nivel for nivel in candidatos if resultados[nivel] is not False]
+
+
+def ordenar_niveis(tabela, preferencia=None, variaveis="all", cache=None):
+    """
+    Ordem em que get_sidra_table deve tentar os níveis da tabela: os
+    níveis publicados (cache local, senão metadados, senão sondagem em
+    paralelo), sempre na ordem de preferência. Os descartados (400
+    territorial ou vazio) vão para o fim; uma falha transitória num nível
+    não muda a ordem das próximas execuções.
+    """
+    cache = cache or cache_niveis()
+    preferencia = list(dict.fromkeys(n.lower() for n in (preferencia or NIVEIS_PADRAO)))
+    entrada = cache.obter(tabela)
+
+    if not entrada.get("niveis"):
+        niveis = niveis_por_metadados(tabela)
+        origem = "metadados"
+        if niveis is None and len(preferencia) > 1:
+            niveis, origem = sondar_niveis(tabela, preferencia, variaveis), "sondagem"
+        if niveis is not None:
+            cache.atualizar(tabela, niveis=niveis, origem=origem)
+            entrada = cache.obter(tabela)
+
+    candidatos = preferencia
+    if entrada.get("niveis"):
+        candidatos = [n for n in preferencia if n in entrada["niveis"]] or preferencia
+
+    descartados = entrada.get("descartados") or []
+    return [n for n in candidatos if n not in descartados] + [n for n in candidatos if n in descartados]
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import runpy
+import logging
+import argparse
+import cProfile
+import pstats
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from database import carregar_config
+
+logger = logging.getLogger(__name__)
+# As constantes abaixo (e PERFIL_MODO) vêm do config.env
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+MODOS_VALIDOS = ("cprofile", "memoria", "amostragem")
+PERFIL_DIR = os.getenv('PERFIL_DIR', 'perfis')
+PERFIL_INTERVALO_MS = float(os.getenv('PERFIL_INTERVALO_MS', 10))
+PERFIL_TOP = int(os.getenv('PERFIL_TOP', 30))
+QUADROS_MEMORIA = 1  # Só a linha que alocou: relatório por linha e snapshots baratos
+IGNORAR_ALOCACOES = {tracemalloc.__file__, __file__}
+
+_NULO = nullcontext()
+
+
+def _ler_modos(valor):
+    modos = tuple(m.strip().lower() for m in (valor or "").split(",") if m.strip())
+    invalidos = [m for m in modos if m not in MODOS_VALIDOS]
+    if invalidos:
+        raise ValueError(f"Modos de perfil inválidos: {', '.join(invalidos)} (use {', '.join(MODOS_VALIDOS)})")
+    return modos
+
+
+# Modos ativos; vazio = perfilamento desligado
+_modos = _ler_modos(os.getenv('PERFIL_MODO', ''))
+_diretorio_base = PERFIL_DIR
+
+
+def configurar_perfil(modos=None, diretorio=None):
+    """
+    Liga (ou desliga, com modos vazio) o perfilamento em tempo de execução.
+
+    Params:
+        modos (str | list): "cprofile", "memoria" e/ou "amostragem"
+        diretorio (str): onde criar os diretórios de cada execução
+    """
+    global _modos, _diretorio_base
+    _modos = _ler_modos(",".join(modos) if isinstance(modos, (list, tuple)) else modos)
+    if diretorio:
+        _diretorio_base = diretorio
+
+
+def perfil_ativo():
+    return bool(_modos)
+
+
+# ------------------------------
+# Sessão de perfilamento (uma execução de pipeline)
+# ------------------------------
+class SessaoPerfil:
+    """
+    Coleta os perfis de todas as etapas de uma execução e grava os
+    relatórios em um diretório próprio ao final:
+
+    - cprofile_<etapa>.pstats / .txt: perfil determinístico acumulado da etapa;
+    - memoria_<etapa>.txt: linhas que mais alocaram durante a etapa;
+    - amostragem_<etapa>.collapsed: pilhas amostradas no formato do
+      flamegraph.pl / speedscope;
+    - resumo.json: ocorrências e tempo de cada etapa.
+    """
+
+    def __init__(self, nome, modos, diretorio_base):
+        self.nome = nome
+        self.modos = modos
+        self.diretorio = os.path.join(diretorio_base, f"{nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        self.inicio = time.perf_counter()
+        self._lock = threading.Lock()
+        self.etapas = {}
+
+        # cProfile: um perfil ativo por vez (o interpretador não suporta
+        # perfis simultâneos em threads diferentes a partir do 3.12)
+        self._lock_cprofile = threading.Lock()
+        self._perfis = {}
+
+        self._alocacoes = {}
+        self._iniciou_tracemalloc = False
+        if "memoria" in modos and not tracemalloc.is_tracing():
+            tracemalloc.start(QUADROS_MEMORIA)
+            self._iniciou_tracemalloc = True
+
+        self._pilhas = {}
+        self._etapas_por_thread = {}
+        self._parar = threading.Event()
+        self._amostrador = None
+        if "amostragem" in modos:
+            self._amostrador = threading.Thread(target=self._amostrar, name="perfil-amostragem", daemon=True)
+            self._amostrador.start()
+
+    def _estatistica(self, etapa):
+        return self.etapas.setdefault(etapa, {"ocorrencias": 0, "duracao_s": 0.0, "cprofile_ignoradas": 0})
+
+    @contextmanager
+    def etapa(self, etapa):
+        thread = threading.get_ident()
+        with self._lock:
+            self._etapas_por_thread.setdefault(thread, []).append(etapa)
+
+        perfil = None
+        if "cprofile" in self.modos and self._lock_cprofile.acquire(blocking=False):
+            perfil = self._perfis.setdefault(etapa, cProfile.Profile())
+        elif "cprofile" in self.modos:
+            with self._lock:
+                self._estatistica(etapa)["cprofile_ignoradas"] += 1
+
+        antes = tracemalloc.take_snapshot() if "memoria" in self.modos else None
+        inicio = time.perf_counter()
+        if perfil is not None:
+            perfil.enable()
+        try:
+            yield
+        finally:
+            if perfil is not None:
+                perfil.disable()
+                self._lock_cprofile.release()
+            duracao = time.perf_counter() - inicio
+            if antes is not None:
+                self._acumular_alocacoes(etapa, antes, tracemalloc.take_snapshot())
+            with self._lock:
+                estatistica = self._estatistica(etapa)
+                estatistica["ocorrencias"] += 1
+                estatistica["duracao_s"] += duracao
+                self._etapas_por_thread[thread].pop()
+
+    def _acumular_alocacoes(self, etapa, antes, depois):
+        # Sem filter_traces: em Python puro, ele custa mais que a própria etapa
+        diferencas = depois.compare_to(antes, "lineno")
+        with self._lock:
+            alocacoes = self._alocacoes.setdefault(etapa, {})
+            for diferenca in diferencas:
+                quadro = diferenca.traceback[0]
+                if diferenca.size_diff <= 0 or quadro.filename in IGNORAR_ALOCACOES:
+                    continue
+                chave = f"{quadro.filename}:{quadro.lineno}"
+                tamanho, quantidade = alocacoes.get(chave, (0, 0))
+                alocacoes[chave] = (tamanho + diferenca.size_diff, quantidade + max(0, diferenca.count_diff))
+
+    def _amostrar(self):
+        intervalo = PERFIL_INTERVALO_MS / 1000
+        proprio = threading.get_ident()
+        while not self._parar.wait(intervalo):
+            with self._lock:
+                ativas = {t: pilha[-1] for t, pilha in self._etapas_por_thread.items() if pilha}
+            if not ativas:
+                continue
+            for thread, quadro in sys._current_frames().items():
+                if thread == proprio or thread not in ativas:
+                    continue
+                chamadas = []
+                while quadro is not None:
+                    codigo = quadro.f_code
+                    chamadas.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{quadro.f_lineno})")
+                    quadro = quadro.f_back
+                pilha = ";".join(reversed(chamadas))
+                contagem = self._pilhas.setdefault(ativas[thread], {})
+                contagem[pilha] = contagem.get(pilha, 0) + 1
+
+    # ------------------------------
+    # Relatórios
+    # ------------------------------
+    def encerrar(self):
+        if self._amostrador is not None:
+            self._parar.set()
+            self._amostrador.join()
+        if self._iniciou_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        for etapa, perfil in self._perfis.items():
+            perfil.dump_stats(self._arquivo("cprofile", etapa, "pstats"))
+            with open(self._arquivo("cprofile", etapa, "txt"), 'w', encoding='utf-8') as f:
+                pstats.Stats(perfil, stream=f).sort_stats("cumulative").print_stats(PERFIL_TOP)
+
+        for etapa, alocacoes in self._alocacoes.items():
+            maiores = sorted(alocacoes.items(), key=lambda item: item[1][0], reverse=True)[:PERFIL_TOP]
+            with open(self._arquivo("memoria", etapa, "txt"), 'w', encoding='utf-8') as f:
+                f.write(f"# Alocações retidas durante a etapa {etapa} (soma das ocorrências)\n")
+                for local, (tamanho, quantidade) in maiores:
+                    f.write(f"{tamanho / 1024:>12.1f} KiB {quantidade:>9} blocos  {local}\n")
+
+        for etapa, pilhas in self._pilhas.items():
+            with open(self._arquivo("amostragem", etapa, "collapsed"), 'w', encoding='utf-8') as f:
+                for pilha, contagem in sorted(pilhas.items(), key=lambda item: -item[1]):
+                    f.write(f"{etapa};{pilha} {contagem}\n")
+
+        resumo = {
+            "execucao": self.nome,
+            "modos": list(self.modos),
+            "duracao_s": round(time.perf_counter() - self.inicio, 3),
+            "intervalo_amostragem_ms": PERFIL_INTERVALO_MS if "amostragem" in self.modos else None,
+            "etapas": {etapa: dict(e, duracao_s=round(e["duracao_s"], 3)) for etapa, e in self.etapas.items()},
+        }
+        with open(os.path.join(self.diretorio, "resumo.json"), 'w', encoding='utf-8') as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+        logger.info(f"Perfis da execução {self.nome} gravados em {self.diretorio}")
+
+    def _arquivo(self, tipo, etapa, extensao):
+        return os.path.join(self.diretorio, f"{tipo}_{etapa}.{extensao}")
+
+
+_sessao = None
+_profundidade = 0
+_lock_sessao = threading.Lock()
+
+
+def perfilar(etapa):
+    """Context manager de uma etapa; sem perfilamento ligado é um nullcontext compartilhado"""
+    if not _modos:
+        return _NULO
+    sessao = _sessao
+    if sessao is None:
+        return _NULO
+    return sessao.etapa(etapa)
+
+
+@contextmanager
+def _sessao_perfil(nome):
+    global _sessao, _profundidade
+    with _lock_sessao:
+        # Execuções aninhadas (ex.: pipeline chamando extrações) entram na sessão externa
+        if _profundidade == 0:
+            _sessao = SessaoPerfil(nome, _modos, _diretorio_base)
+        _profundidade += 1
+    try:
+        yield _sessao
+    finally:
+        with _lock_sessao:
+            _profundidade -= 1
+            sessao = _sessao if _profundidade == 0 else None
+            if sessao is not None:
+                _sessao = None
+        if sessao is not None:
+            sessao.encerrar()
+
+
+def sessao_perfil(nome):
+    if not _modos:
+        return _NULO
+    return _sessao_perfil(nome)
+
+
+def com_perfil(nome):
+    """Decorador: a função vira uma execução perfilada quando o perfilamento está ligado"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if not _modos:
+                return funcao(*args, **kwargs)
+            with _sessao_perfil(nome):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+# ------------------------------
+# Linha de comando: roda um script do projeto com perfilamento
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Roda um script do projeto com perfilamento por etapa",
+        epilog="Exemplo: python perfilamento.py --modos cprofile,amostragem api_PNDA.py",
+    )
+    parser.add_argument("--modos", default="cprofile", help=f"Lista separada por vírgula: {', '.join(MODOS_VALIDOS)}")
+    parser.add_argument("--diretorio", default=PERFIL_DIR)
+    parser.add_argument("script")
+    parser.add_argument("argumentos", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    configurar_perfil(args.modos, args.diretorio)
+    sys.argv = [args.script] + args.argumentos
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name="__main__")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Os módulos do projeto importam "perfilamento", não "__main__": configura aquele
+    import perfilamento
+    sys.exit(perfilamento.main())
@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metricas import REGISTRO, iniciar_rastreamento_memoria
+from perfilamento import com_perfil
+from assinatura_conteudo import STATUS_CONCLUIDOS
+from memo_execucao import execucao_memoizada
+from database import carregar_config
+
+logger = logging.getLogger(__name__)
+# As constantes abaixo vêm do config.env
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 4))
+PIPELINE_TENTATIVAS = int(os.getenv('PIPELINE_TENTATIVAS', 2))
+PIPELINE_ESPERA_RETRY = float(os.getenv('PIPELINE_ESPERA_RETRY', 30))
+LIMITES_GRUPOS = {
+    "ibge": int(os.getenv('PIPELINE_LIMITE_IBGE', 2)),
+    "sidra": int(os.getenv('PIPELINE_LIMITE_SIDRA', 3)),
+}
+
+AGUARDANDO = "AGUARDANDO"
+EXECUTANDO = "EXECUTANDO"
+SUCESSO = "SUCESSO"
+FALHA = "FALHA"
+IGNORADO = "IGNORADO"
+
+
+class ErroPipeline(ValueError):
+    """Grafo inválido (dependência inexistente ou ciclo)"""
+
+
+# ------------------------------
+# Nós do grafo
+# ------------------------------
+class No:
+    def __init__(self, nome, funcao, dependencias=(), grupo=None, tentativas=PIPELINE_TENTATIVAS,
+                 espera_retry=PIPELINE_ESPERA_RETRY):
+        self.nome = nome
+        self.funcao = funcao
+        self.dependencias = list(dependencias)
+        self.grupo = grupo
+        self.tentativas = max(1, tentativas)
+        self.espera_retry = espera_retry
+        self.status = AGUARDANDO
+        self.tentativas_feitas = 0
+        self.inicio = None
+        self.fim = None
+        self.erro = None
+
+    @property
+    def duracao(self):
+        if self.inicio is None or self.fim is None:
+            return 0.0
+        return self.fim - self.inicio
+
+
+def _sucesso(resultado):
+    """Funções dos nós retornam None/True/"SUCESSO"/"SEM_ALTERACAO" (ou um dict de status) em caso de sucesso"""
+    if resultado is None or resultado is True:
+        return True
+    if isinstance(resultado, str):
+        return resultado in STATUS_CONCLUIDOS
+    if isinstance(resultado, dict):
+        return all(v in STATUS_CONCLUIDOS for v in resultado.values())
+    return bool(resultado)
+
+
+class Pipeline:
+    """
+    Executor de um grafo acíclico de etapas.
+
+    Cada nó começa assim que todas as dependências terminam com sucesso,
+    respeitando o limite de nós simultâneos do seu grupo (ex.: quantas
+    tabelas SIDRA baixam ao mesmo tempo). Falhas são repetidas até
+    `tentativas` vezes; se um nó falhar de vez, os dependentes são ignorados
+    e o restante do grafo continua.
+    """
+
+    def __init__(self, workers=PIPELINE_WORKERS, limites=None):
+        self.workers = workers
+        self.limites = dict(LIMITES_GRUPOS if limites is None else limites)
+        self.nos = {}
+        self.inicio = None
+        self.fim = None
+
+    def adicionar(self, nome, funcao, depende_de=(), grupo=None, **opcoes):
+        if nome in self.nos:
+            raise ErroPipeline(f"Nó duplicado: {nome}")
+        self.nos[nome] = No(nome, funcao, depende_de, grupo, **opcoes)
+        return self.nos[nome]
+
+    def validar(self):
+        """Confere dependências e detecta ciclos; retorna a ordem topológica"""
+        for no in self.nos.values():
+            faltando = [d for d in no.dependencias if d not in self.nos]
+            if faltando:
+                raise ErroPipeline(f"{no.nome} depende de nós inexistentes: {', '.join(faltando)}")
+        ordem, visitados, pilha = [], set(), set()
+
+        def visitar(nome):
+            if nome in pilha:
+                raise ErroPipeline(f"Ciclo no grafo envolvendo {nome}")
+            if nome in visitados:
+                return
+            pilha.add(nome)
+            for dep in self.nos[nome].dependencias:
+                visitar(dep)
+            pilha.discard(nome)
+            visitados.add(nome)
+            ordem.append(nome)
+
+        for nome in self.nos:
+            visitar(nome)
+        return ordem
+
+    def _executar_no(self, no):
+        for tentativa in range(1, no.tentativas + 1):
+            no.tentativas_feitas = tentativa
+            try:
+                if _sucesso(no.funcao()):
+                    return SUCESSO
+                no.erro = "etapa retornou falha"
+            except Exception as e:
+                no.erro = str(e)
+                logger.error(f"[{no.nome}] tentativa {tentativa}/{no.tentativas} falhou: {e}")
+            if tentativa < no.tentativas:
+                time.sleep(no.espera_retry)
+        return FALHA
+
+    def _pronto(self, no):
+        return all(self.nos[d].status == SUCESSO for d in no.dependencias)
+
+    def _bloqueado(self, no):
+        return any(self.nos[d].status in (FALHA, IGNORADO) for d in no.dependencias)
+
+    @com_perfil("pipeline")
+    @execucao_memoizada("pipeline")
+    def executar(self):
+        """Executa o grafo; retorna True se todos os nós terminaram com sucesso"""
+        self.validar()
+        self.inicio = time.perf_counter()
+        em_execucao = {}
+        por_grupo = {}
+
+        def rodar(no):
+            no.inicio = time.perf_counter()
+            status = self._executar_no(no)
+            no.fim = time.perf_counter()
+            return status
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline") as executor:
+            while True:
+                for no in self.nos.values():
+                    if no.status != AGUARDANDO:
+                        continue
+                    if self._bloqueado(no):
+                        no.status = IGNORADO
+                        logger.warning(f"[{no.nome}] ignorado: dependência falhou")
+                        continue
+                    if not self._pronto(no):
+                        continue
+                    limite = self.limites.get(no.grupo)
+                    if limite is not None and por_grupo.get(no.grupo, 0) >= limite:
+                        continue
+                    no.status = EXECUTANDO
+                    por_grupo[no.grupo] = por_grupo.get(no.grupo, 0) + 1
+                    logger.info(f"[{no.nome}] iniciado")
+                    em_execucao[executor.submit(rodar, no)] = no
+
+                if not em_execucao:
+                    # Nós ignorados podem liberar outros ignorados: repete até estabilizar
+                    if any(no.status == AGUARDANDO and self._bloqueado(no) for no in self.nos.values()):
+                        continue
+                    break
+
+                concluidos, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    no = em_execucao.pop(futuro)
+                    por_grupo[no.grupo] -= 1
+                    no.status = futuro.result()
+                    logger.info(f"[{no.nome}] {no.status} em {no.duracao:.1f}s ({no.tentativas_feitas} tentativa(s))")
+                    REGISTRO.observar(
+                        "pnad_pipeline_no_duracao_segundos", no.duracao,
+                        {"no": no.nome, "status": no.status}, "Duração de cada nó do pipeline"
+                    )
+
+        self.fim = time.perf_counter()
+        return all(no.status == SUCESSO for no in self.nos.values())
+
+    # ------------------------------
+    # Relatório
+    # ------------------------------
+    def caminho_critico(self):
+        """
+        Cadeia de nós que determinou o tempo total: parte do último nó a
+        terminar e volta sempre pela dependência que terminou por último.
+        """
+        executados = [no for no in self.nos.values() if no.fim is not None]
+        if not executados:
+            return []
+        atual = max(executados, key=lambda no: no.fim)
+        caminho = [atual]
+        while True:
+            deps = [self.nos[d] for d in atual.dependencias if self.nos[d].fim is not None]
+            if not deps:
+                break
+            atual = max(deps, key=lambda no: no.fim)
+            caminho.append(atual)
+        return list(reversed(caminho))
+
+    def relatorio(self):
+        if self.inicio is None:
+            return "Pipeline não executado"
+        critico = {no.nome for no in self.caminho_critico()}
+        total = (self.fim or time.perf_counter()) - self.inicio
+        linhas = [
+            f"{'nó':<24} {'status':<10} {'início':>8} {'espera':>8} {'duração':>9} {'tent.':>5}  crítico",
+        ]
+        for nome in self.validar():
+            no = self.nos[nome]
+            if no.inicio is None:
+                linhas.append(f"{nome:<24} {no.status:<10} {'-':>8} {'-':>8} {'-':>9} {'-':>5}")
+                continue
+            prontidao = max([self.nos[d].fim for d in no.dependencias] or [self.inicio])
+            linhas.append(
+                f"{nome:<24} {no.status:<10} {no.inicio - self.inicio:>7.1f}s {no.inicio - prontidao:>7.1f}s "
+                f"{no.duracao:>8.1f}s {no.tentativas_feitas:>5}  {'*' if nome in critico else ''}"
+            )
+        soma = sum(no.duracao for no in self.nos.values())
+        linhas.append("")
+        linhas.append(f"Tempo total: {total:.1f}s | soma das etapas: {soma:.1f}s | paralelismo médio: {soma / total if total else 0:.2f}x")
+        linhas.append(f"Caminho crítico: {' → '.join(no.nome for no in self.caminho_critico())}")
+        return "\n".join(linhas)
+
+
+# ------------------------------
+# Pipeline padrão: IBGE → tratamento → PNAD, malhas em paralelo
+# ------------------------------
+def pipeline_padrao(table_ids, workers=PIPELINE_WORKERS):
+    """
+    localidades ─→ tratamento ─→ pnad_<tabela> (uma por tabela, grupo "sidra")
+    malhas (independente, roda em paralelo com o resto)
+    """
+    from api_IBGE import extract_all_ibge_data
+    from api_PNDA import processar_tabela
+    from tratamento_dados import TratamentoDadosIBGE
+    from hierarquia_territorial import carregar_ou_construir
+    from armazenamento import armazenamento
+
+    hierarquia = {}
+    lock_hierarquia = threading.Lock()
+
+    def obter_hierarquia():
+        # Carregada uma vez, depois que o tratamento regravou o índice territorial
+        with lock_hierarquia:
+            if "indice" not in hierarquia:
+                hierarquia["indice"] = carregar_ou_construir(armazenamento().conectar)
+            return hierarquia["indice"]
+
+    pipeline = Pipeline(workers)
+    pipeline.adicionar("localidades", lambda: extract_all_ibge_data(tipos=["localidades"]), grupo="ibge")
+    pipeline.adicionar("malhas", lambda: extract_all_ibge_data(tipos=["malhas"]), grupo="ibge")
+    pipeline.adicionar("tratamento", lambda: TratamentoDadosIBGE().executar_tratamento(), ["localidades"])
+    for table_id in table_ids:
+        pipeline.adicionar(
+            f"pnad_{table_id}",
+            # Só os períodos baixados são substituídos: o histórico de um backfill fica
+            lambda table_id=table_id: processar_tabela(table_id, obter_hierarquia(), modo="periodos"),
+            ["tratamento"], grupo="sidra",
+        )
+    return pipeline
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Executa IBGE, tratamento e PNAD como um grafo de dependências")
+    parser.add_argument("tabelas", nargs="*", help="Tabelas SIDRA (padrão: TABLE_IDS_TO_FETCH do api_PNDA.py)")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS)
+    args = parser.parse_args()
+
+    iniciar_rastreamento_memoria()
+    if args.tabelas:
+        tabelas = args.tabelas
+    else:
+        from api_PNDA import TABLE_IDS_TO_FETCH
+        tabelas = TABLE_IDS_TO_FETCH
+    pipeline = pipeline_padrao(tabelas, args.workers)
+    sucesso = pipeline.executar()
+    print(pipeline.relatorio())
+    sys.exit(0 if sucesso else 1)
@@ -0,0 +1,52 @@
+import sys
+import runpy
+import argparse
+
+# ------------------------------
+# Comandos: nome → (módulo, descrição)
+# ------------------------------
+# Só a biblioteca padrão é importada aqui: o módulo do comando (e com ele
+# pandas, geopandas, fastapi...) é carregado depois de escolhido o comando.
+COMANDOS = {
+    "pnad": ("api_PNDA", "Extrai e carrega as tabelas SIDRA da PNAD"),
+    "backfill": ("backfill_pnad", "Carrega o histórico completo de tabelas SIDRA em lotes paralelos"),
+    "indicadores": ("indicadores_pnad", "Indicadores derivados (listar, recalcular)"),
+    "ibge": ("api_IBGE", "Extrai localidades e malhas do IBGE"),
+    "tratamento": ("tratamento_dados", "Trata ibge_localidades em ibge_localidades_tratado"),
+    "pipeline": ("pipeline", "IBGE → tratamento → PNAD como grafo de dependências"),
+    "fila": ("fila_distribuida", "Fila de trabalho distribuída (enfileirar, worker, status)"),
+    "lancamentos": ("monitor_lancamentos", "Monitora os períodos SIDRA e carrega só lançamentos novos"),
+    "lago": ("lago_parquet", "Lago Parquet das extrações brutas (listar, reprocessar)"),
+    "tiles": ("malhas_tiles", "Pré-calcula as simplificações das malhas"),
+    "replay": ("replay_ibge", "Grava e serve respostas das APIs SIDRA/IBGE"),
+    "api": ("app", "Sobe a API FastAPI"),
+    "benchmark": ("benchmark_pnad", "Benchmarks de decode, pivot, tratamento e inserts"),
+    "importacao": ("benchmark_importacao", "Tempo de importação dos pontos de entrada"),
+    "perfil": ("perfilamento", "Roda um script com perfilamento por etapa"),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(
+        prog="pnad",
+        description="Ponto de entrada único do projeto",
+        epilog="\n".join(f"  {nome:<12} {descricao}" for nome, (_, descricao) in COMANDOS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("comando", choices=list(COMANDOS), metavar="comando")
+    parser.add_argument("argumentos", nargs=argparse.REMAINDER, help="Repassados ao comando")
+    args = parser.parse_args(argv[:1])
+
+    modulo, _ = COMANDOS[args.comando]
+    # O comando vê a linha de comando como se tivesse sido chamado direto
+    sys.argv = [f"{modulo}.py"] + argv[1:]
+    try:
+        runpy.run_module(modulo, run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        return e.code
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import os
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlparse
+from metricas import REGISTRO, medir_etapa
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Constantes
+# ------------------------------
+RETRY_TENTATIVAS = int(os.getenv('RETRY_TENTATIVAS', 3))
+RETRY_BASE = float(os.getenv('RETRY_BASE', 1))
+RETRY_TETO = float(os.getenv('RETRY_TETO', 30))
+DISJUNTOR_FALHAS = int(os.getenv('DISJUNTOR_FALHAS', 5))
+DISJUNTOR_ABERTURA = float(os.getenv('DISJUNTOR_ABERTURA', 60))
+SIDRA_PRAZO_TABELA = float(os.getenv('SIDRA_PRAZO_TABELA', 300))  # Orçamento de tempo por tabela (s)
+
+# Bases das APIs (apontáveis para o replay local do replay_ibge.py)
+URL_SIDRA = os.getenv('SIDRA_BASE_URL', 'https://apisidra.ibge.gov.br').rstrip('/')
+URL_SERVICOS_IBGE = os.getenv('IBGE_SERVICOS_URL', 'https://servicodados.ibge.gov.br').rstrip('/')
+
+# Respostas que costumam passar sozinhas (sobrecarga, manutenção, gateway)
+STATUS_RETENTAVEIS = {408, 425, 429, 500, 502, 503, 504}
+
+
+# ------------------------------
+# Erros
+# ------------------------------
+class ErroRequisicao(Exception):
+    def __init__(self, mensagem, status=None, resposta=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.resposta = resposta
+
+
+class ErroRetentavel(ErroRequisicao):
+    """Falha transitória: vale tentar de novo"""
+
+
+class ErroPermanente(ErroRequisicao):
+    """Falha que não muda com novas tentativas (ex.: 400 do SIDRA para tabela inexistente)"""
+
+
+class CircuitoAberto(ErroRequisicao):
+    """O host falhou demais recentemente; a requisição nem foi feita"""
+
+
+class PrazoEsgotado(ErroRequisicao):
+    """O orçamento de tempo da operação acabou"""
+
+
+# ------------------------------
+# Prazo (orçamento de tempo total de uma operação)
+# ------------------------------
+class Prazo:
+    def __init__(self, segundos=None):
+        self.limite = time.monotonic() + segundos if segundos else None
+
+    def restante(self):
+        if self.limite is None:
+            return float('inf')
+        return max(0.0, self.limite - time.monotonic())
+
+    def esgotado(self):
+        return self.restante() <= 0
+
+    def timeout(self, padrao):
+        """Timeout de uma requisição sem ultrapassar o prazo"""
+        return max(0.1, min(padrao, self.restante()))
+
+
+# ------------------------------
+# Disjuntor (circuit breaker) por host
+# ------------------------------
+class Disjuntor:
+    """
+    FECHADO: requisições passam. Após `limite_falhas` falhas retentáveis
+    seguidas, ABRE e recusa tudo por `abertura` segundos. Depois disso fica
+    SEMIABERTO e deixa passar uma requisição de teste: sucesso fecha,
+    falha abre de novo.
+    """
+
+    FECHADO = "FECHADO"
+    ABERTO = "ABERTO"
+    SEMIABERTO = "SEMIABERTO"
+
+    def __init__(self, host, limite_falhas=DISJUNTOR_FALHAS, abertura=DISJUNTOR_ABERTURA):
+        self.host = host
+        self.limite_falhas = limite_falhas
+        self.abertura = abertura
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.ABERTO and time.monotonic() - self.aberto_em >= self.abertura:
+                self.estado = self.SEMIABERTO
+                self._teste_em_andamento = False
+            if self.estado == self.SEMIABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            if self.estado != self.FECHADO:
+                logger.info(f"Disjuntor de {self.host} fechado")
+            self.estado = self.FECHADO
+            self.falhas = 0
+            self._teste_em_andamento = False
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.estado == self.SEMIABERTO or self.falhas >= self.limite_falhas:
+                if self.estado != self.ABERTO:
+                    logger.warning(f"Disjuntor de {self.host} aberto após {self.falhas} falhas")
+                    REGISTRO.incrementar(
+                        "pnad_disjuntor_aberturas_total", rotulos={"host": self.host},
+                        ajuda="Vezes que o disjuntor de um host abriu"
+                    )
+                self.estado = self.ABERTO
+                self.aberto_em = time.monotonic()
+                self._teste_em_andamento = False
+
+    def segundos_para_teste(self):
+        with self._lock:
+            if self.estado != self.ABERTO:
+                return 0.0
+            return max(0.0, self.abertura - (time.monotonic() - self.aberto_em))
+
+
+_disjuntores = {}
+_lock_disjuntores = threading.Lock()
+
+
+def disjuntor_para(url):
+    host = urlparse(url).netloc
+    with _lock_disjuntores:
+        if host not in _disjuntores:
+            _disjuntores[host] = Disjuntor(host)
+        return _disjuntores[host]
+
+
+# ------------------------------
+# Política de retry
+# ------------------------------
+class PoliticaRetry:
+    """
+    Tentativas com backoff "decorrelated jitter":
+    espera = min(teto, aleatório entre base e 3 × espera anterior).
+    Não dorme depois da última tentativa nem além do prazo.
+    """
+
+    def __init__(self, tentativas=RETRY_TENTATIVAS, base=RETRY_BASE, teto=RETRY_TETO):
+        self.tentativas = max(1, tentativas)
+        self.base = base
+        self.teto = teto
+
+    def proxima_espera(self, anterior):
+        return min(self.teto, random.uniform(self.base, max(self.base, anterior * 3)))
+
+    def executar(self, funcao, prazo=None, descricao="requisição"):
+        """
+        Chama funcao() até dar certo. ErroPermanente, CircuitoAberto e
+        PrazoEsgotado sobem na hora; ErroRetentavel é repetido.
+        """
+        prazo = prazo or Prazo()
+        espera = self.base
+        for tentativa in range(1, self.tentativas + 1):
+            if prazo.esgotado():
+                raise PrazoEsgotado(f"Prazo esgotado antes da tentativa {tentativa} de {descricao}")
+            try:
+                return funcao()
+            except ErroRetentavel as e:
+                if tentativa == self.tentativas:
+                    raise
+                espera = self.proxima_espera(espera)
+                retry_after = _retry_after(e.resposta)
+                if retry_after is not None:
+                    espera = max(espera, retry_after)
+                if espera >= prazo.restante():
+                    raise PrazoEsgotado(f"Sem tempo para nova tentativa de {descricao}: {e}", e.status, e.resposta)
+                logger.warning(f"Tentativa {tentativa}/{self.tentativas} de {descricao} falhou ({e}); nova tentativa em {espera:.1f}s")
+                REGISTRO.incrementar("pnad_retry_total", ajuda="Tentativas repetidas após falha retentável")
+                time.sleep(espera)
+
+
+def _retry_after(resposta):
+    if resposta is None:
+        return None
+    valor = resposta.headers.get("Retry-After")
+    try:
+        return float(valor) if valor is not None else None
+    except ValueError:
+        return None
+
+
+POLITICA_PADRAO = PoliticaRetry()
+
+
+# ------------------------------
+# GET com classificação de erros
+# ------------------------------
+def get(url, timeout=60, prazo=None, medicao=None):
+    """
+    Um GET (sem retry) passando pelo disjuntor do host. Retorna a resposta
+    200; levanta ErroRetentavel, ErroPermanente ou CircuitoAberto.
+    """
+    import requests
+
+    disjuntor = disjuntor_para(url)
+    if not disjuntor.permitir():
+        raise CircuitoAberto(
+            f"Circuito aberto para {disjuntor.host} (novo teste em {disjuntor.segundos_para_teste():.0f}s)"
+        )
+    prazo = prazo or Prazo()
+    try:
+        with medir_etapa(medicao, "fetch") as etapa:
+            resposta = requests.get(url, timeout=prazo.timeout(timeout))
+            etapa.bytes = len(resposta.content)
+    except requests.RequestException as e:
+        # Timeout, conexão, corpo truncado...: libera o teste do circuito meio aberto
+        disjuntor.falha()
+        raise ErroRetentavel(f"{type(e).__name__}: {e}")
+
+    from replay_ibge import gravador_configurado
+    gravador = gravador_configurado()
+    if gravador is not None:
+        gravador.gravar(url, resposta.status_code, resposta.headers.get("Content-Type"), resposta.content)
+
+    if resposta.status_code == 200:
+        disjuntor.sucesso()
+        return resposta
+    mensagem = f"HTTP {resposta.status_code}: {resposta.text[:300]}"
+    if resposta.status_code in STATUS_RETENTAVEIS:
+        disjuntor.falha()
+        raise ErroRetentavel(mensagem, resposta.status_code, resposta)
+    # O host respondeu: erro do pedido, não do serviço
+    disjuntor.sucesso()
+    raise ErroPermanente(mensagem, resposta.status_code, resposta)
+
+
+def erro_nivel_territorial(erro):
+    """O SIDRA responde 400 tanto para tabela inválida quanto para nível territorial que a tabela não tem"""
+    texto = str(erro).lower()
+    return any(termo in texto for termo in ("nível", "nivel", "territorial"))
+
+
+def get_com_retry(url, timeout=60, politica=None, prazo=None, medicao=None):
+    politica = politica or POLITICA_PADRAO
+    return politica.executar(lambda: get(url, timeout, prazo, medicao), prazo, url)
@@ -0,0 +1,316 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from database import carregar_config
+
+logger = logging.getLogger(__name__)
+# As constantes abaixo vêm do config.env
+carregar_config()
+
+# ------------------------------
+# Constantes
+# ------------------------------
+FIXTURES_DIR = os.getenv('FIXTURES_DIR', 'fixtures_ibge')
+ARQUIVO_INDICE = "indice.json"
+TAMANHO_BLOCO = 16 * 1024
+
+
+def chave_requisicao(url):
+    """Chave da fixture: caminho + query (o host não entra, SIDRA e serviços não colidem)"""
+    partes = urlsplit(url)
+    caminho = partes.path + (f"?{partes.query}" if partes.query else "")
+    return hashlib.sha1(caminho.encode('utf-8')).hexdigest(), caminho
+
+
+# ------------------------------
+# Armazém de fixtures
+# ------------------------------
+class ArmazemFixtures:
+    """
+    Respostas gravadas: um índice JSON (caminho, status, content-type,
+    tamanho) e o corpo de cada resposta em corpos/<sha1>.gz.
+    """
+
+    def __init__(self, diretorio=None):
+        self.diretorio = diretorio or FIXTURES_DIR
+        self._lock = threading.Lock()
+        self._indice = self._ler_indice()
+
+    def _caminho_indice(self):
+        return os.path.join(self.diretorio, ARQUIVO_INDICE)
+
+    def _caminho_corpo(self, chave):
+        return os.path.join(self.diretorio, "corpos", f"{chave}.gz")
+
+    def _ler_indice(self):
+        try:
+            with open(self._caminho_indice(), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def gravar(self, url, status, content_type, corpo):
+        chave, caminho = chave_requisicao(url)
+        os.makedirs(os.path.dirname(self._caminho_corpo(chave)), exist_ok=True)
+        with gzip.open(self._caminho_corpo(chave), 'wb') as f:
+            f.write(corpo)
+        with self._lock:
+            self._indice[chave] = {
+                "caminho": caminho,
+                "host": urlsplit(url).netloc,
+                "status": status,
+                "content_type": content_type,
+                "bytes": len(corpo),
+                "gravado_em": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            temporario = f"{self._caminho_indice()}.{os.getpid()}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump(self._indice, f, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(temporario, self._caminho_indice())
+        logger.info(f"Fixture gravada: {caminho} ({len(corpo)} bytes, HTTP {status})")
+
+    def obter(self, caminho):
+        """Retorna (metadados, corpo) da fixture do caminho, ou None"""
+        chave = hashlib.sha1(caminho.encode('utf-8')).hexdigest()
+        metadados = self._indice.get(chave)
+        if metadados is None:
+            return None
+        with gzip.open(self._caminho_corpo(chave), 'rb') as f:
+            return metadados, f.read()
+
+    def __len__(self):
+        return len(self._indice)
+
+
+_gravador = None
+_gravador_verificado = False
+_lock_gravador = threading.Lock()
+
+
+def gravador_configurado():
+    """ArmazemFixtures quando FIXTURES_GRAVAR=1 (usado por politica_retry.get), senão None"""
+    global _gravador, _gravador_verificado
+    with _lock_gravador:
+        if not _gravador_verificado:
+            _gravador_verificado = True
+            if os.getenv('FIXTURES_GRAVAR', '0') == '1':
+                _gravador = ArmazemFixtures()
+                logger.info(f"Gravando respostas das APIs do IBGE em {_gravador.diretorio}")
+        return _gravador
+
+
+def ativar_gravacao(diretorio=None):
+    global _gravador, _gravador_verificado
+    with _lock_gravador:
+        _gravador = ArmazemFixtures(diretorio)
+        _gravador_verificado = True
+    return _gravador
+
+
+# ------------------------------
+# Escala de payload
+# ------------------------------
+def escalar_payload(corpo, escala, caminho):
+    """
+    Multiplica as linhas do payload por `escala` (só JSON): linhas de
+    valores SIDRA (mantendo o cabeçalho), listas de localidades e features
+    de GeoJSON. Cópias recebem um sufixo no nome da localidade para não
+    colapsarem no pivot.
+    """
+    if escala <= 1:
+        return corpo
+    try:
+        dados = json.loads(corpo)
+    except ValueError:
+        return corpo
+
+    def copias(itens, campo_nome, campo_codigo):
+        resultado = list(itens)
+        for k in range(1, int(escala)):
+            for item in itens:
+                if isinstance(item, dict):
+                    item = dict(item)
+                    if campo_nome in item:
+                        item[campo_nome] = f"{item[campo_nome]} #{k}"
+                    if campo_codigo in item:
+                        item[campo_codigo] = f"{item[campo_codigo]}{k:03d}"
+                resultado.append(item)
+        return resultado
+
+    if isinstance(dados, list) and dados and caminho.startswith("/values"):
+        dados = dados[:1] + copias(dados[1:], "D3N", "D3C")
+    elif isinstance(dados, list):
+        dados = copias(dados, "nome", "id")
+    elif isinstance(dados, dict) and isinstance(dados.get("features"), list):
+        dados["features"] = copias(dados["features"], "__nenhum__", "__nenhum__")
+    else:
+        return corpo
+    return json.dumps(dados, ensure_ascii=False).encode('utf-8')
+
+
+# ------------------------------
+# Servidor de replay
+# ------------------------------
+class ConfiguracaoReplay:
+    def __init__(self, latencia_ms=0, variacao_ms=0, banda_kbps=0, taxa_erro=0.0,
+                 status_erro=503, escala=1, semente=None, status_ausente=404):
+        self.latencia_ms = latencia_ms
+        self.variacao_ms = variacao_ms
+        self.banda_kbps = banda_kbps
+        self.taxa_erro = taxa_erro
+        self.status_erro = status_erro
+        self.escala = escala
+        self.status_ausente = status_ausente
+        self.aleatorio = random.Random(semente)
+        self.lock = threading.Lock()
+        self.contadores = {"requisicoes": 0, "servidas": 0, "erros_injetados": 0, "ausentes": 0}
+
+    def sortear(self):
+        """(atraso em segundos, injetar erro?) com o gerador compartilhado (reprodutível por semente)"""
+        with self.lock:
+            atraso = (self.latencia_ms + self.aleatorio.uniform(-self.variacao_ms, self.variacao_ms)) / 1000
+            erro = self.aleatorio.random() < self.taxa_erro
+            return max(0.0, atraso), erro
+
+    def contar(self, nome):
+        with self.lock:
+            self.contadores[nome] += 1
+
+
+def criar_manipulador(armazem, config):
+    cache_escalado = {}
+
+    class ManipuladorReplay(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, formato, *args):
+            logger.debug(formato % args)
+
+        def _responder(self, status, corpo, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            if config.banda_kbps <= 0:
+                self.wfile.write(corpo)
+                return
+            # Limita a banda escrevendo em blocos com pausa proporcional
+            bytes_por_segundo = config.banda_kbps * 1024
+            for i in range(0, len(corpo), TAMANHO_BLOCO):
+                bloco = corpo[i:i + TAMANHO_BLOCO]
+                time.sleep(len(bloco) / bytes_por_segundo)
+                self.wfile.write(bloco)
+                self.wfile.flush()
+
+        def do_GET(self):
+            config.contar("requisicoes")
+            atraso, injetar_erro = config.sortear()
+            if atraso:
+                time.sleep(atraso)
+
+            if self.path == "/_replay/estatisticas":
+                with config.lock:
+                    corpo = json.dumps(dict(config.contadores, fixtures=len(armazem))).encode('utf-8')
+                return self._responder(200, corpo)
+
+            if injetar_erro:
+                config.contar("erros_injetados")
+                return self._responder(config.status_erro, b'{"erro": "falha injetada pelo replay"}')
+
+            fixture = armazem.obter(self.path)
+            if fixture is None:
+                config.contar("ausentes")
+                return self._responder(config.status_ausente, f"Sem fixture para {self.path}".encode('utf-8'), "text/plain")
+
+            metadados, corpo = fixture
+            if config.escala > 1 and metadados["status"] == 200:
+                if self.path not in cache_escalado:
+                    cache_escalado[self.path] = escalar_payload(corpo, config.escala, self.path)
+                corpo = cache_escalado[self.path]
+            config.contar("servidas")
+            self._responder(metadados["status"], corpo, metadados.get("content_type") or "application/json")
+
+    return ManipuladorReplay
+
+
+def servir(porta=8765, diretorio=None, config=None, host="127.0.0.1"):
+    """Cria o servidor de replay (chame serve_forever() ou rode em uma thread)"""
+    armazem = ArmazemFixtures(diretorio)
+    servidor = ThreadingHTTPServer((host, porta), criar_manipulador(armazem, config or ConfiguracaoReplay()))
+    servidor.daemon_threads = True
+    logger.info(f"Replay de {len(armazem)} fixtures em http://{host}:{servidor.server_port}")
+    return servidor
+
+
+# ------------------------------
+# Gravação a partir dos extratores
+# ------------------------------
+def gravar_fixtures(tabelas, niveis_localidades=("N1", "N2", "N3", "N6"), malhas=("N1",), diretorio=None):
+    """Chama os extratores de verdade com a gravação ligada"""
+    from api_PNDA import get_sidra_table
+    from api_IBGE import get_location_info, get_geo
+
+    ativar_gravacao(diretorio)
+    for tabela in tabelas:
+        get_sidra_table(tabela)
+    for nivel in niveis_localidades:
+        get_location_info(geo_level=nivel)
+    for nivel in malhas:
+        get_geo(geo_level=nivel)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gravação e replay local das APIs SIDRA/IBGE")
+    parser.add_argument("--diretorio", default=None, help=f"Armazém de fixtures (padrão: {FIXTURES_DIR})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_gravar = sub.add_parser("gravar", help="Grava respostas reais das APIs")
+    p_gravar.add_argument("tabelas", nargs="*")
+    p_gravar.add_argument("--niveis", nargs="*", default=["N1", "N2", "N3", "N6"])
+    p_gravar.add_argument("--malhas", nargs="*", default=["N1"])
+
+    p_servir = sub.add_parser("servir", help="Serve as fixtures gravadas")
+    p_servir.add_argument("--porta", type=int, default=8765)
+    p_servir.add_argument("--latencia", type=float, default=0, help="Latência por requisição (ms)")
+    p_servir.add_argument("--variacao", type=float, default=0, help="Variação da latência (± ms)")
+    p_servir.add_argument("--banda", type=float, default=0, help="Banda por conexão (KB/s, 0 = ilimitada)")
+    p_servir.add_argument("--erros", type=float, default=0.0, help="Fração de requisições com erro injetado")
+    p_servir.add_argument("--status-erro", type=int, default=503)
+    p_servir.add_argument("--escala", type=int, default=1, help="Multiplica as linhas dos payloads")
+    p_servir.add_argument("--semente", type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.comando == "gravar":
+        if not args.tabelas:
+            from api_PNDA import TABLE_IDS_TO_FETCH
+            args.tabelas = TABLE_IDS_TO_FETCH
+        gravar_fixtures(args.tabelas, args.niveis, args.malhas, args.diretorio)
+        return 0
+
+    config = ConfiguracaoReplay(
+        latencia_ms=args.latencia, variacao_ms=args.variacao, banda_kbps=args.banda,
+        taxa_erro=args.erros, status_erro=args.status_erro, escala=args.escala, semente=args.semente,
+    )
+    servidor = servir(args.porta, args.diretorio, config)
+    print(f"Use SIDRA_BASE_URL=http://127.0.0.1:{args.porta} e IBGE_SERVICOS_URL=http://127.0.0.1:{args.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -1,35 +1,41 @@
 import json
-import pyodbc
-import os
-from dotenv import load_dotenv
+import pandas as pd
 from datetime import datetime
+from database import carregar_config
+from armazenamento import armazenamento
+from hierarquia_territorial import carregar_ou_construir, NIVEL_RM
+from perfilamento import com_perfil
+from metricas import MedicaoExecucao, medir_etapa, garantir_colunas_log, COLUNAS_LOG
 
 # Carrega as variáveis de ambiente
-load_dotenv('config.env')
+carregar_config()
+
+# Colunas gravadas em ibge_localidades_tratado (tipos lógicos de armazenamento.py)
+COLUNAS_TRATADO = [
+    ("codigo_ibge", "texto(50)"),
+    ("nome", "texto(255)"),
+    ("nivel_geografico", "texto(10)"),
+    ("sigla", "texto(10)"),
+    ("regiao_id", "inteiro"),
+    ("regiao_sigla", "texto(10)"),
+    ("regiao_nome", "texto(255)"),
+    ("uf_id", "inteiro"),
+    ("uf_sigla", "texto(10)"),
+    ("uf_nome", "texto(255)"),
+    ("municipio_id", "inteiro"),
+    ("municipio_nome", "texto(255)"),
+    ("regiao_metropolitana", "texto(500)"),
+    ("data_extracao", "data_hora"),
+]
 
 class TratamentoDadosIBGE:
     def __init__(self):
-        self.server = os.getenv('DB_SERVER', 'localhost')
-        self.database = 'LOPES'  # Mudando para master onde estão as tabelas IBGE
-        self.trusted_connection = os.getenv('DB_TRUSTED_CONNECTION', 'True').lower() == 'true'
-        
-    def get_connection_string(self):
-        """Retorna a string de conexão para pyodbc"""
-        if self.trusted_connection:
-            return f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={self.server};DATABASE={self.database};Trusted_Connection=yes;"
-        else:
-            user = os.getenv('DB_USER', '')
-            password = os.getenv('DB_PASSWORD', '')
-            return f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={self.server};DATABASE={self.database};UID={user};PWD={password}"
+        # Banco configurado em DB_BACKEND (SQL Server por padrão)
+        self.backend = armazenamento()
     
     def get_connection(self):
-        """Cria conexão usando pyodbc"""
-        try:
-            connection = pyodbc.connect(self.get_connection_string())
-            return connection
-        except Exception as e:
-            print(f"Erro ao conectar com pyodbc: {e}")
-            return None
+        """Cria conexão com o banco configurado"""
+        return self.backend.conectar()
     
     def criar_tabela_tratada(self):
         """Cria a tabela ibge_localidades_tratado"""
@@ -40,38 +46,8 @@ class TratamentoDadosIBGE:
                 
             cursor = conn.cursor()
             
-            # Script para criar a nova tabela
-            create_table_sql = '''
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='ibge_localidades_tratado' AND xtype='U')
-            BEGIN
-                CREATE TABLE [dbo].[ibge_localidades_tratado](
-                    [id] [int] IDENTITY(1,1) NOT NULL,
-                    [codigo_ibge] [nvarchar](50) NULL,
-                    [nome] [nvarchar](255) NULL,
-                    [nivel_geografico] [nvarchar](10) NULL,
-                    [sigla] [nvarchar](10) NULL,
-                    [regiao_id] [int] NULL,
-                    [regiao_sigla] [nvarchar](10) NULL,
-                    [regiao_nome] [nvarchar](255) NULL,
-                    [uf_id] [int] NULL,
-                    [uf_sigla] [nvarchar](10) NULL,
-                    [uf_nome] [nvarchar](255) NULL,
-                    [municipio_id] [int] NULL,
-                    [municipio_nome] [nvarchar](255) NULL,
-                    [regiao_metropolitana] [nvarchar](500) NULL,
-                    [data_extracao] [datetime] NULL,
-                    [data_criacao] [datetime] NOT NULL DEFAULT (GETDATE()),
-                    CONSTRAINT [PK_ibge_localidades_tratado] PRIMARY KEY CLUSTERED ([id] ASC)
-                )
-                PRINT 'Tabela ibge_localidades_tratado criada com sucesso!'
-            END
-            ELSE
-            BEGIN
-                PRINT 'Tabela ibge_localidades_tratado já existe.'
-            END
-            '''
-            
-            cursor.execute(create_table_sql)
+            # Cria a nova tabela (se ainda não existir)
+            self.backend.criar_tabela(cursor, "ibge_localidades_tratado", COLUNAS_TRATADO)
             conn.commit()
             cursor.close()
             conn.close()
@@ -152,121 +128,33 @@ class TratamentoDadosIBGE:
             print(f"Erro ao processar propriedades: {e}")
             return None
     
-    def mapear_regioes_metropolitanas(self):
-        """Cria um mapeamento de municípios para suas regiões metropolitanas"""
-        try:
-            conn = self.get_connection()
-            if not conn:
-                return {}
-                
-            cursor = conn.cursor()
-            
-            # Buscar todas as regiões metropolitanas
-            cursor.execute('''
-                SELECT propriedades 
-                FROM ibge_localidades 
-                WHERE propriedades LIKE '%"municipios"%'
-            ''')
-            
-            mapeamento = {}
-            for row in cursor.fetchall():
-                try:
-                    props = json.loads(row[0])
-                    if 'municipios' in props:
-                        regiao_metropolitana = props.get('nome', '')
-                        for municipio in props['municipios']:
-                            municipio_id = str(municipio.get('id', ''))
-                            if municipio_id:
-                                mapeamento[municipio_id] = regiao_metropolitana
-                except:
-                    continue
-            
-            cursor.close()
-            conn.close()
-            
-            print(f"Mapeamento criado com {len(mapeamento)} municípios")
-            return mapeamento
-            
-        except Exception as e:
-            print(f"Erro ao mapear regiões metropolitanas: {e}")
-            return {}
-    
-    def buscar_informacoes_uf_regiao(self):
-        """Busca informações de UF e região para preencher dados faltantes"""
+    def construir_hierarquia(self):
+        """Constrói (e grava em disco) o índice territorial a partir de ibge_localidades"""
         try:
-            conn = self.get_connection()
-            if not conn:
-                return {}
-                
-            cursor = conn.cursor()
-            
-            # Buscar todas as informações de UF e região dos registros que contêm essas informações
-            cursor.execute('''
-                SELECT propriedades 
-                FROM ibge_localidades 
-                WHERE propriedades LIKE '%"UF"%' AND propriedades LIKE '%"regiao"%'
-            ''')
-            
-            mapeamento_uf = {}
-            for row in cursor.fetchall():
-                try:
-                    props = json.loads(row[0])
-                    if 'UF' in props and 'id' in props['UF']:
-                        uf_id = props['UF']['id']
-                        uf_sigla = props['UF'].get('sigla', '')
-                        uf_nome = props['UF'].get('nome', '')
-                        
-                        regiao_id = None
-                        regiao_sigla = ''
-                        regiao_nome = ''
-                        
-                        # Procurar região dentro da UF
-                        if 'regiao' in props['UF']:
-                            regiao = props['UF']['regiao']
-                            regiao_id = regiao.get('id')
-                            regiao_sigla = regiao.get('sigla', '')
-                            regiao_nome = regiao.get('nome', '')
-                        
-                        # Usar o ID da UF como chave (convertendo para string para facilitar a busca)
-                        if uf_id not in mapeamento_uf:
-                            mapeamento_uf[str(uf_id)] = {
-                                'uf_id': uf_id,
-                                'uf_sigla': uf_sigla,
-                                'uf_nome': uf_nome,
-                                'regiao_id': regiao_id,
-                                'regiao_sigla': regiao_sigla,
-                                'regiao_nome': regiao_nome
-                            }
-                except:
-                    continue
-            
-            cursor.close()
-            conn.close()
-            
-            print(f"Mapeamento de UFs criado com {len(mapeamento_uf)} UFs")
-            return mapeamento_uf
-            
+            hierarquia = carregar_ou_construir(self.get_connection, reconstruir=True)
+            if hierarquia is None:
+                return None
+            print(f"Hierarquia territorial criada com {len(hierarquia)} localidades")
+            return hierarquia
         except Exception as e:
-            print(f"Erro ao mapear UFs: {e}")
-            return {}
+            print(f"Erro ao construir hierarquia territorial: {e}")
+            return None
     
+    @com_perfil("tratamento")
     def processar_dados(self):
         """Processa todos os dados da tabela ibge_localidades"""
+        medicao = MedicaoExecucao("tratamento", "ibge_localidades_tratado")
+        # Índice territorial (RMs, UFs e regiões) construído uma única vez, antes
+        # de mexer na tabela de destino: se falhar, o tratamento anterior fica intacto
+        hierarquia = self.construir_hierarquia()
+        if hierarquia is None:
+            return False
+
+        conn = self.get_connection()
+        if not conn:
+            return False
         try:
-            conn = self.get_connection()
-            if not conn:
-                return False
-            
-            # Primeiro, limpar a tabela de destino
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM ibge_localidades_tratado")
-            conn.commit()
-            
-            # Criar mapeamento de regiões metropolitanas
-            mapeamento_rm = self.mapear_regioes_metropolitanas()
-            
-            # Criar mapeamento de UFs e regiões
-            mapeamento_uf = self.buscar_informacoes_uf_regiao()
             
             # Buscar todos os dados da tabela original
             cursor.execute('''
@@ -276,28 +164,29 @@ class TratamentoDadosIBGE:
             ''')
             
             registros_processados = 0
-            for row in cursor.fetchall():
-                codigo_ibge, nome, nivel_geografico, sigla, propriedades, data_extracao = row
+            linhas_tratadas = []
+            with medir_etapa(medicao, "tratamento") as etapa:
+                for row in cursor.fetchall():
+                    codigo_ibge, nome, nivel_geografico, sigla, propriedades, data_extracao = row
                 
-                # Processar propriedades JSON
-                dados_processados = self.processar_propriedades(propriedades)
+                    # Processar propriedades JSON
+                    dados_processados = self.processar_propriedades(propriedades)
                 
-                if dados_processados:
-                    # Verificar se é município e se pertence a uma região metropolitana
-                    if dados_processados['municipio_id']:
-                        municipio_id_str = str(dados_processados['municipio_id'])
-                        if municipio_id_str in mapeamento_rm:
-                            dados_processados['regiao_metropolitana'] = mapeamento_rm[municipio_id_str]
+                    if dados_processados:
+                        # Verificar se é município e se pertence a uma região metropolitana
+                        if dados_processados['municipio_id'] and str(dados_processados['municipio_id']).isdigit():
+                            rms = hierarquia.rms_do_municipio(int(dados_processados['municipio_id']))
+                            if len(rms):
+                                dados_processados['regiao_metropolitana'] = hierarquia.nome(NIVEL_RM, rms[0])
                     
-                    # Preencher informações de UF e região se estiverem faltando
-                    if not dados_processados['uf_id'] or not dados_processados['regiao_id']:
-                        # Tentar extrair código da UF do código do município
-                        codigo_municipio = str(dados_processados['codigo_ibge'])
-                        if len(codigo_municipio) >= 2:
-                            codigo_uf = codigo_municipio[:2]
-                            # Procurar UF correspondente no mapeamento
-                            for uf_key, info_uf in mapeamento_uf.items():
-                                if str(info_uf['uf_id']) == codigo_uf:
+                        # Preencher informações de UF e região se estiverem faltando
+                        if not dados_processados['uf_id'] or not dados_processados['regiao_id']:
+                            # Tentar extrair código da UF do código do município
+                            codigo_municipio = str(dados_processados['codigo_ibge'])
+                            if len(codigo_municipio) >= 2 and codigo_municipio[:2].isdigit():
+                                # Procurar UF correspondente no índice territorial
+                                info_uf = hierarquia.dados_uf(int(codigo_municipio[:2]))
+                                if info_uf:
                                     if not dados_processados['uf_id']:
                                         dados_processados['uf_id'] = info_uf['uf_id']
                                         dados_processados['uf_sigla'] = info_uf['uf_sigla']
@@ -306,66 +195,84 @@ class TratamentoDadosIBGE:
                                         dados_processados['regiao_id'] = info_uf['regiao_id']
                                         dados_processados['regiao_sigla'] = info_uf['regiao_sigla']
                                         dados_processados['regiao_nome'] = info_uf['regiao_nome']
-                                    break
-                    
-                    # Tratar data de extração
-                    data_extracao_tratada = None
-                    if dados_processados['data_extracao']:
-                        try:
-                            # Tentar converter a data
-                            if isinstance(dados_processados['data_extracao'], str):
-                                # Assumir formato ISO: "2025-08-22 10:22:16.203997"
-                                data_str = dados_processados['data_extracao']
-                                if '.' in data_str:
-                                    # Remover microssegundos se existirem
-                                    data_str = data_str.split('.')[0]
-                                data_extracao_tratada = datetime.strptime(data_str, '%Y-%m-%d %H:%M:%S')
-                            else:
-                                data_extracao_tratada = dados_processados['data_extracao']
-                        except:
-                            # Se não conseguir converter, deixar como None
-                            data_extracao_tratada = None
                     
-                    # Inserir na nova tabela
-                    insert_sql = '''
-                    INSERT INTO ibge_localidades_tratado 
-                    (codigo_ibge, nome, nivel_geografico, sigla, regiao_id, regiao_sigla, regiao_nome,
-                     uf_id, uf_sigla, uf_nome, municipio_id, municipio_nome, regiao_metropolitana, data_extracao)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    '''
+                        # Tratar data de extração
+                        data_extracao_tratada = None
+                        if dados_processados['data_extracao']:
+                            try:
+                                # Tentar converter a data
+                                if isinstance(dados_processados['data_extracao'], str):
+                                    # Assumir formato ISO: "2025-08-22 10:22:16.203997"
+                                    data_str = dados_processados['data_extracao']
+                                    if '.' in data_str:
+                                        # Remover microssegundos se existirem
+                                        data_str = data_str.split('.')[0]
+                                    data_extracao_tratada = datetime.strptime(data_str, '%Y-%m-%d %H:%M:%S')
+                                else:
+                                    data_extracao_tratada = dados_processados['data_extracao']
+                            except:
+                                # Se não conseguir converter, deixar como None
+                                data_extracao_tratada = None
                     
-                    cursor.execute(insert_sql, (
-                        dados_processados['codigo_ibge'],
-                        dados_processados['nome'],
-                        dados_processados['nivel_geografico'],
-                        dados_processados['sigla'],
-                        dados_processados['regiao_id'],
-                        dados_processados['regiao_sigla'],
-                        dados_processados['regiao_nome'],
-                        dados_processados['uf_id'],
-                        dados_processados['uf_sigla'],
-                        dados_processados['uf_nome'],
-                        dados_processados['municipio_id'],
-                        dados_processados['municipio_nome'],
-                        dados_processados['regiao_metropolitana'],
-                        data_extracao_tratada
-                    ))
+                        # Acumula para inserir na nova tabela em uma única carga
+                        linhas_tratadas.append((
+                            dados_processados['codigo_ibge'],
+                            dados_processados['nome'],
+                            dados_processados['nivel_geografico'],
+                            dados_processados['sigla'],
+                            dados_processados['regiao_id'],
+                            dados_processados['regiao_sigla'],
+                            dados_processados['regiao_nome'],
+                            dados_processados['uf_id'],
+                            dados_processados['uf_sigla'],
+                            dados_processados['uf_nome'],
+                            dados_processados['municipio_id'],
+                            dados_processados['municipio_nome'],
+                            dados_processados['regiao_metropolitana'],
+                            data_extracao_tratada
+                        ))
                     
-                    registros_processados += 1
+                        registros_processados += 1
                     
-                    if registros_processados % 100 == 0:
-                        print(f"Processados {registros_processados} registros...")
-            
+                        if registros_processados % 100 == 0:
+                            print(f"Processados {registros_processados} registros...")
+                
+                # dtype=object preserva inteiros ao lado de valores ausentes
+                df_tratado = pd.DataFrame(linhas_tratadas, columns=[c for c, _ in COLUNAS_TRATADO], dtype=object)
+                # Limpeza e carga na mesma transação: leitores nunca veem a tabela vazia
+                cursor.execute("DELETE FROM ibge_localidades_tratado")
+                self.backend.inserir_dataframe(conn, "ibge_localidades_tratado", df_tratado)
+                etapa.linhas = registros_processados
+            
+            self.registrar_metricas(cursor, medicao, registros_processados)
             conn.commit()
             cursor.close()
-            conn.close()
             
             print(f"Processamento concluído! {registros_processados} registros processados.")
             return True
             
         except Exception as e:
             print(f"Erro ao processar dados: {e}")
+            conn.rollback()
             return False
+        finally:
+            conn.close()
+    
+    def registrar_metricas(self, cursor, medicao, registros_processados):
+        """Grava as métricas do tratamento em ibge_log_extracao (tipo TRATAMENTO)"""
+        garantir_colunas_log(cursor, "ibge_log_extracao")
+        valores = medicao.valores_log()
+        colunas = ["tipo_extracao", "nivel_geografico", "codigo_ibge", "registros_extraidos", "status", "mensagem", "data_extracao"]
+        colunas += [coluna for coluna, _ in COLUNAS_LOG]
+        cursor.execute(f"""
+            INSERT INTO ibge_log_extracao ({', '.join(colunas)})
+            VALUES ({', '.join('?' for _ in colunas)})
+        """, (
+            "TRATAMENTO", "ALL", "ALL", registros_processados, "SUCESSO",
+            f"{registros_processados} registros tratados", datetime.now(),
+            *[valores[coluna] for coluna, _ in COLUNAS_LOG]
+        ))
+        medicao.finalizar("SUCESSO")
     
     def executar_tratamento(self):
         """Executa todo o processo de tratamento"""